@@ -0,0 +1,90 @@
+"""
+Benchmark batch search against one search per query.
+
+For each batch size, searches for item names sampled from the catalog, either one query at a time
+as separate /search requests would, or all at once with one embeddings request and one statement
+as /search/batch does. Embeddings come from the configured OpenAI or Azure OpenAI endpoint,
+without the query embedding cache, so both cases pay for embedding every query.
+
+    python -m benchmarks.batch_search --batch-sizes 1 10 50 --repeats 5
+"""
+
+import argparse
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from benchmarks.utils import Timer, format_table
+from fastapi_app.api_models import SearchQuery
+from fastapi_app.dependencies import common_parameters, get_azure_credential
+from fastapi_app.openai_clients import create_openai_embed_client
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_models import Item
+from fastapi_app.postgres_searcher import PostgresSearcher
+
+logger = logging.getLogger("ragapp")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch search against one search per query")
+    parser.add_argument("--top", type=int, default=5, help="Number of results requested per query")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 50], help="Queries per batch")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of timed runs per batch size and case")
+    args = parser.parse_args()
+
+    context = await common_parameters()
+    azure_credential = await get_azure_credential()
+    openai_embed_client = await create_openai_embed_client(azure_credential)
+    engine = await create_postgres_engine_from_env(azure_credential)
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with sessionmaker() as session:
+        sampled = await session.scalars(
+            text(f"SELECT name FROM {Item.__tablename__} ORDER BY random() LIMIT :n"),
+            {"n": max(args.batch_sizes) * args.repeats},
+        )
+        names = list(sampled)
+
+    rows = []
+    for batch_size in args.batch_sizes:
+        timers = {"one per query": Timer(), "batch": Timer()}
+        for repeat in range(args.repeats):
+            queries = [
+                SearchQuery(query=name, top=args.top) for name in names[repeat * batch_size : (repeat + 1) * batch_size]
+            ]
+            for case, timer in timers.items():
+                # New session per run so index settings don't leak between runs
+                async with sessionmaker() as session:
+                    searcher = PostgresSearcher(
+                        db_session=session,
+                        openai_embed_client=openai_embed_client,
+                        embed_deployment=context.openai_embed_deployment,
+                        embed_model=context.openai_embed_model,
+                        embed_dimensions=context.openai_embed_dimensions,
+                        embedding_column=context.embedding_column,
+                        candidate_pool=context.search_candidates,
+                    )
+                    with timer.measure():
+                        if case == "batch":
+                            await searcher.search_batch(queries)
+                        else:
+                            for query in queries:
+                                await searcher.search_and_embed(query.query, query.top, True, True)
+        sequential_p50 = timers["one per query"].percentile(50)
+        for case, timer in timers.items():
+            rows.append(
+                [batch_size, case, timer.percentile(50), timer.percentile(99), sequential_p50 / timer.percentile(50)]
+            )
+
+    await engine.dispose()
+    print(format_table(["queries", "case", "p50_ms", "p99_ms", "speedup"], rows))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+"""
+Benchmark filtered vector search across filter selectivity.
+
+For each brand filter and a range of price filters, runs vector searches with sampled query vectors
+and reports how many of the requested `top` rows came back (fill rate) and the latency,
+for each candidate pool size and HNSW iterative scan mode.
+
+    python -m benchmarks.filtered_search --candidates 20 100 --iterative-scan off strict_order
+"""
+
+import argparse
+import asyncio
+import logging
+
+import numpy as np
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from benchmarks.utils import Timer, format_table
+from fastapi_app.api_models import Filter
+from fastapi_app.dependencies import common_parameters
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_models import Item
+from fastapi_app.postgres_searcher import PostgresSearcher
+
+logger = logging.getLogger("ragapp")
+
+
+async def load_filters(session) -> list[tuple[Filter, float]]:
+    """Return (filter, selectivity) pairs, from the most to the least selective."""
+    table_name = Item.__tablename__
+    total = (await session.execute(text(f"SELECT count(*) FROM {table_name}"))).scalar_one()
+    filters = []
+    brand_counts = await session.execute(text(f"SELECT brand, count(*) FROM {table_name} GROUP BY brand"))
+    for brand, count in brand_counts:
+        filters.append((Filter(column="brand", comparison_operator="=", value=brand), count / total))
+    fractions = [0.01, 0.05, 0.25, 0.5]
+    price_thresholds = (
+        await session.execute(
+            text(
+                f"SELECT percentile_cont(CAST(:fractions AS float8[])) WITHIN GROUP (ORDER BY price) FROM {table_name}"
+            ),
+            {"fractions": fractions},
+        )
+    ).scalar_one()
+    for fraction, threshold in zip(fractions, price_thresholds):
+        filters.append((Filter(column="price", comparison_operator="<", value=round(threshold, 2)), fraction))
+    return sorted(filters, key=lambda pair: pair[1])
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark filtered vector search across filter selectivity")
+    parser.add_argument("--top", type=int, default=5, help="Number of results requested per search")
+    parser.add_argument("--queries", type=int, default=20, help="Number of sampled query vectors")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 100], help="Candidate pool sizes")
+    parser.add_argument(
+        "--iterative-scan",
+        type=str,
+        nargs="+",
+        default=["off"],
+        help="HNSW iterative scan modes to compare (strict_order and relaxed_order require pgvector 0.8+)",
+    )
+    args = parser.parse_args()
+
+    context = await common_parameters()
+    engine = await create_postgres_engine_from_env()
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+    embedding_column = context.embedding_column
+
+    async with sessionmaker() as session:
+        filters = await load_filters(session)
+        sampled = await session.execute(
+            text(
+                f"SELECT {embedding_column} FROM {Item.__tablename__} "
+                f"WHERE {embedding_column} IS NOT NULL ORDER BY random() LIMIT :n"
+            ),
+            {"n": args.queries},
+        )
+        query_vectors = [np.asarray(row[0]).tolist() for row in sampled]
+
+    rows = []
+    for filter, selectivity in filters:
+        for candidate_pool in args.candidates:
+            for iterative_scan in args.iterative_scan:
+                timer = Timer()
+                returned = []
+                for query_vector in query_vectors:
+                    # New transaction per search so index settings don't leak between runs
+                    async with sessionmaker() as session:
+                        searcher = PostgresSearcher(
+                            db_session=session,
+                            openai_embed_client=AsyncOpenAI(api_key="not-used-for-search"),
+                            embed_deployment=context.openai_embed_deployment,
+                            embed_model=context.openai_embed_model,
+                            embed_dimensions=context.openai_embed_dimensions,
+                            embedding_column=embedding_column,
+                            candidate_pool=candidate_pool,
+                            iterative_scan=iterative_scan,
+                        )
+                        with timer.measure():
+                            results = await searcher.search(None, query_vector, args.top, [filter])
+                        returned.append(len(results))
+                rows.append(
+                    [
+                        f"{filter.column} {filter.comparison_operator} {filter.value}",
+                        f"{selectivity:.1%}",
+                        candidate_pool,
+                        iterative_scan,
+                        float(np.mean(returned)) / args.top,
+                        timer.percentile(50),
+                        timer.percentile(95),
+                    ]
+                )
+
+    await engine.dispose()
+    print(
+        format_table(
+            ["filter", "selectivity", "candidates", "iterative_scan", "fill_rate", "p50_ms", "p95_ms"],
+            rows,
+        )
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+Benchmark the per-request cost of constructing chat flows.
+
+Compares building the OpenAI model, agents, search tool and parsed few-shot examples on every request,
+as the flows used to, with constructing flows around agents built once at startup.
+No network calls are made, so no database or OpenAI credentials are needed.
+
+    python -m benchmarks.flow_construction --requests 2000
+"""
+
+import argparse
+import json
+
+from agents import Agent, ModelSettings, OpenAIResponsesModel, function_tool
+from openai import AsyncOpenAI
+from openai.types.responses import EasyInputMessageParam, ResponseInputItemParam
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from benchmarks.utils import Timer, format_table
+from fastapi_app.api_models import ChatRequestOverrides
+from fastapi_app.postgres_searcher import PostgresSearcher
+from fastapi_app.rag_advanced import AdvancedRAGChat
+from fastapi_app.rag_agents import create_rag_agents
+from fastapi_app.rag_base import RAGChatBase
+from fastapi_app.rag_simple import SimpleRAGChat
+
+CHAT_MODEL = "gpt-4o-mini"
+QUERY_FEWSHOTS = open(RAGChatBase.prompts_dir / "query_fewshots.json").read()
+
+
+def build_agents_per_request(openai_chat_client: AsyncOpenAI, chat: RAGChatBase):
+    """Reproduce the construction that each request used to do before agents were shared."""
+    openai_agents_model = OpenAIResponsesModel(model=CHAT_MODEL, openai_client=openai_chat_client)
+    Agent(
+        name="Answerer",
+        instructions=chat.answer_prompt_template,
+        model=openai_agents_model,
+        model_settings=ModelSettings(
+            temperature=chat.chat_params.temperature,
+            max_tokens=chat.chat_params.response_token_limit,
+        ),
+    )
+    if isinstance(chat, AdvancedRAGChat):
+        Agent(
+            name="Searcher",
+            instructions=chat.query_prompt_template,
+            tools=[function_tool(chat.search_database)],
+            tool_use_behavior="stop_on_first_tool",
+            model=openai_agents_model,
+        )
+        # The few-shot examples were parsed again for every request
+        json.loads(QUERY_FEWSHOTS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-request cost of constructing chat flows")
+    parser.add_argument("--requests", type=int, default=2000, help="Number of simulated requests per case")
+    args = parser.parse_args()
+
+    openai_chat_client = AsyncOpenAI(api_key="not-used-for-construction")
+    shared_agents = create_rag_agents(openai_chat_client, CHAT_MODEL, None)
+    searcher = PostgresSearcher(
+        db_session=AsyncSession(),
+        openai_embed_client=AsyncOpenAI(api_key="not-used-for-construction"),
+        embed_deployment=None,
+        embed_model="text-embedding-3-large",
+        embed_dimensions=1024,
+        embedding_column="embedding_3l",
+    )
+    messages: list[ResponseInputItemParam] = [
+        EasyInputMessageParam(role="user", content="What is the best tent for winter camping?")
+    ]
+    overrides = ChatRequestOverrides()
+
+    rows = []
+    for flow_class in (SimpleRAGChat, AdvancedRAGChat):
+        for case in ("per request", "shared"):
+            timer = Timer()
+            for _ in range(args.requests):
+                with timer.measure():
+                    chat = flow_class(messages=messages, overrides=overrides, searcher=searcher, agents=shared_agents)
+                    if case == "per request":
+                        build_agents_per_request(openai_chat_client, chat)
+            rows.append([flow_class.__name__, case, timer.percentile(50) * 1000, timer.percentile(99) * 1000])
+
+    print(format_table(["flow", "agents", "p50_us", "p99_us"], rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark the execution modes of hybrid search across catalog sizes.
+
+For each catalog size, fills a scratch copy of the items table with synthetic items, made by combining
+the text and adding the embeddings of existing items, and indexes it like the items table.
+Then runs hybrid searches for sampled item names and embeddings with each execution mode:
+both legs in one statement fused in SQL, or both legs at the same time on two connections fused in Python.
+The scratch schema is dropped at the end, the items table is not changed.
+
+    python -m benchmarks.hybrid_execution --sizes 1000 10000 50000
+"""
+
+import argparse
+import asyncio
+import logging
+
+import numpy as np
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from sqlalchemy import event, text
+from sqlalchemy.engine import AdaptedConnection
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from benchmarks.utils import Timer, create_synthetic_items, format_table
+from fastapi_app.dependencies import common_parameters
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_models import Item
+from fastapi_app.postgres_searcher import HYBRID_EXECUTION_MODES, PostgresSearcher
+
+logger = logging.getLogger("ragapp")
+
+SCRATCH_SCHEMA = "hybrid_execution_benchmark"
+
+
+async def create_catalog(session: AsyncSession, embedding_column: str, size: int):
+    """Replace the scratch items table with a catalog of the given size."""
+    table_name = Item.__tablename__
+    await create_synthetic_items(session, SCRATCH_SCHEMA, embedding_column, size)
+    await session.execute(
+        text(
+            f"CREATE INDEX ON {SCRATCH_SCHEMA}.{table_name} "
+            f"USING hnsw ({embedding_column} vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        )
+    )
+    await session.execute(text(f"CREATE INDEX ON {SCRATCH_SCHEMA}.{table_name} USING gin (search_vector)"))
+    await session.execute(text(f"ANALYZE {SCRATCH_SCHEMA}.{table_name}"))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the execution modes of hybrid search across catalog sizes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="Catalog sizes")
+    parser.add_argument("--top", type=int, default=5, help="Number of results requested per search")
+    parser.add_argument("--queries", type=int, default=50, help="Number of sampled queries per catalog size")
+    args = parser.parse_args()
+
+    context = await common_parameters()
+    engine = await create_postgres_engine_from_env()
+    embedding_column = context.embedding_column
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def use_scratch_schema(dbapi_connection: AdaptedConnection, *args):
+        # Unqualified table names in the searcher's queries resolve to the scratch catalog
+        dbapi_connection.run_async(
+            lambda connection: connection.execute(f"SET search_path TO {SCRATCH_SCHEMA}, public")
+        )
+
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+    async with sessionmaker() as session, session.begin():
+        await session.execute(text(f"CREATE SCHEMA IF NOT EXISTS {SCRATCH_SCHEMA}"))
+
+    rows = []
+    try:
+        for size in args.sizes:
+            logger.info(f"Creating a catalog of {size} items")
+            async with sessionmaker() as session, session.begin():
+                await create_catalog(session, embedding_column, size)
+            async with sessionmaker() as session:
+                sampled = await session.execute(
+                    text(f"SELECT name, {embedding_column} FROM {Item.__tablename__} ORDER BY random() LIMIT :n"),
+                    {"n": args.queries},
+                )
+                queries = [(name, np.asarray(embedding).tolist()) for name, embedding in sampled]
+
+            for hybrid_execution in HYBRID_EXECUTION_MODES:
+                timer = Timer()
+                # The first search warms up the pooled connections and is not timed
+                for i, (query_text, query_vector) in enumerate([queries[0], *queries]):
+                    # New transaction per search so index settings don't leak between runs
+                    async with sessionmaker() as session:
+                        searcher = PostgresSearcher(
+                            db_session=session,
+                            openai_embed_client=AsyncOpenAI(api_key="not-used-for-search"),
+                            embed_deployment=context.openai_embed_deployment,
+                            embed_model=context.openai_embed_model,
+                            embed_dimensions=context.openai_embed_dimensions,
+                            embedding_column=embedding_column,
+                            candidate_pool=context.search_candidates,
+                            hybrid_execution=hybrid_execution,
+                            sessionmaker=sessionmaker,
+                        )
+                        if i == 0:
+                            await searcher.search(query_text, query_vector, args.top)
+                            continue
+                        with timer.measure():
+                            await searcher.search(query_text, query_vector, args.top)
+                rows.append([size, hybrid_execution, timer.percentile(50), timer.percentile(95)])
+    finally:
+        async with sessionmaker() as session, session.begin():
+            await session.execute(text(f"DROP SCHEMA {SCRATCH_SCHEMA} CASCADE"))
+        await engine.dispose()
+
+    print(format_table(["catalog_size", "execution", "p50_ms", "p95_ms"], rows))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    asyncio.run(main())
@@ -0,0 +1,169 @@
+"""
+Benchmark two-stage vector search on quantized or truncated embeddings against search on the full-precision embeddings.
+
+Runs vector searches for query vectors made by adding the embeddings of two sampled items, so that queries
+don't match an item exactly, with each vector search mode and coarse candidate pool size.
+Reports recall@top against an exact search without the index, the latency and the size of the index searched.
+Modes are skipped if their column is missing or not filled for every embedded row: the quantized modes require
+pgvector 0.7+ and setup_postgres_database.py --quantized-embeddings, the matryoshka mode requires the truncated
+embeddings filled by update_embeddings.py.
+
+    python -m benchmarks.two_stage_search --coarse-candidates 40 100 200
+"""
+
+import argparse
+import asyncio
+import logging
+
+import numpy as np
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from benchmarks.utils import Timer, format_table
+from fastapi_app.dependencies import common_parameters
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_models import (
+    TRUNCATED_EMBEDDINGS,
+    Item,
+    index_3l,
+    index_3l_256,
+    index_nomic,
+    quantized_column_name,
+    quantized_indexes,
+)
+from fastapi_app.postgres_searcher import VECTOR_SEARCH_MODES, PostgresSearcher
+
+logger = logging.getLogger("ragapp")
+
+
+async def exact_search(
+    sessionmaker: async_sessionmaker[AsyncSession], embedding_column: str, query_vector: list[float], top: int
+) -> list[int]:
+    """Return the ids of the nearest items by scanning the whole table, without the approximate index."""
+    async with sessionmaker() as session:
+        await session.execute(text("SET LOCAL enable_indexscan = off"))
+        result = await session.scalars(
+            text(f"SELECT id FROM {Item.__tablename__} ORDER BY {embedding_column} <=> :embedding LIMIT :top"),
+            {"embedding": np.array(query_vector), "top": top},
+        )
+        return list(result)
+
+
+def coarse_column(embedding_column: str, mode: str) -> str:
+    """The column whose index a vector search mode searches."""
+    if mode == "full":
+        return embedding_column
+    if mode == "matryoshka":
+        return TRUNCATED_EMBEDDINGS[embedding_column]
+    return quantized_column_name(embedding_column, mode)
+
+
+async def index_size_mb(session: AsyncSession, index_name: str) -> float:
+    size = await session.scalar(text("SELECT pg_relation_size(to_regclass(:name))"), {"name": index_name})
+    return (size or 0) / 1024 / 1024
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark two-stage vector search on smaller indexes")
+    parser.add_argument("--top", type=int, default=10, help="Number of results requested per search")
+    parser.add_argument("--queries", type=int, default=50, help="Number of query vectors")
+    parser.add_argument(
+        "--coarse-candidates", type=int, nargs="+", default=[40, 100, 200], help="Candidates rescored per search"
+    )
+    args = parser.parse_args()
+
+    context = await common_parameters()
+    engine = await create_postgres_engine_from_env()
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+    embedding_column = context.embedding_column
+    modes = [mode for mode in VECTOR_SEARCH_MODES if mode != "matryoshka" or embedding_column in TRUNCATED_EMBEDDINGS]
+    indexes = [index_3l, index_nomic, index_3l_256, *quantized_indexes]
+    index_names = {
+        mode: next(str(index.name) for index in indexes if coarse_column(embedding_column, mode) in index.columns)
+        for mode in modes
+    }
+
+    async with sessionmaker() as session:
+        sampled = await session.execute(
+            text(
+                f"SELECT {embedding_column} FROM {Item.__tablename__} "
+                f"WHERE {embedding_column} IS NOT NULL ORDER BY random() LIMIT :n"
+            ),
+            {"n": args.queries * 2},
+        )
+        embeddings = [np.asarray(row[0]) for row in sampled]
+        query_vectors = [(a + b).tolist() for a, b in zip(embeddings[::2], embeddings[1::2])]
+        exact_ids = [await exact_search(sessionmaker, embedding_column, vector, args.top) for vector in query_vectors]
+        existing_columns = set(
+            await session.scalars(
+                text("SELECT column_name FROM information_schema.columns WHERE table_name = :table_name"),
+                {"table_name": Item.__tablename__},
+            )
+        )
+        ready_modes = []
+        for mode in modes:
+            column = coarse_column(embedding_column, mode)
+            if column not in existing_columns:
+                logger.warning(f"Skipping {mode}: run setup_postgres_database.py --quantized-embeddings first")
+                continue
+            unfilled = await session.scalar(
+                text(
+                    f"SELECT count(*) FROM {Item.__tablename__} "
+                    f"WHERE {embedding_column} IS NOT NULL AND {column} IS NULL"
+                )
+            )
+            if unfilled:
+                logger.warning(f"Skipping {mode}: {unfilled} rows have no {column}, run update_embeddings.py first")
+                continue
+            ready_modes.append(mode)
+        index_sizes = {mode: await index_size_mb(session, index_name) for mode, index_name in index_names.items()}
+
+    rows = []
+    for mode in ready_modes:
+        # Coarse candidates don't apply to the full-precision search
+        for coarse_candidates in [None] if mode == "full" else args.coarse_candidates:
+            timer = Timer()
+            recalls = []
+            # The first search warms up the pooled connection and is not timed
+            for i, query_vector in enumerate([query_vectors[0], *query_vectors]):
+                # New transaction per search so index settings don't leak between runs
+                async with sessionmaker() as session:
+                    searcher = PostgresSearcher(
+                        db_session=session,
+                        openai_embed_client=AsyncOpenAI(api_key="not-used-for-search"),
+                        embed_deployment=context.openai_embed_deployment,
+                        embed_model=context.openai_embed_model,
+                        embed_dimensions=context.openai_embed_dimensions,
+                        embedding_column=embedding_column,
+                        candidate_pool=context.search_candidates,
+                        vector_search_mode=mode,
+                        coarse_candidates=coarse_candidates or 0,
+                    )
+                    if i == 0:
+                        await searcher.search(None, query_vector, args.top)
+                        continue
+                    with timer.measure():
+                        results = await searcher.search(None, query_vector, args.top)
+                recalls.append(len({item.id for item in results}.intersection(exact_ids[i - 1])) / args.top)
+            rows.append(
+                [
+                    mode,
+                    coarse_candidates or "-",
+                    float(np.mean(recalls)),
+                    timer.percentile(50),
+                    timer.percentile(95),
+                    index_sizes[mode],
+                ]
+            )
+
+    await engine.dispose()
+    print(format_table(["mode", "coarse_candidates", f"recall@{args.top}", "p50_ms", "p95_ms", "index_mb"], rows))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+import time
+from collections.abc import Sequence
+from contextlib import contextmanager
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from fastapi_app.postgres_models import Item
+
+
+class Timer:
+    """Collects wall-clock latencies in milliseconds."""
+
+    def __init__(self):
+        self.latencies_ms: list[float] = []
+
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        yield
+        self.latencies_ms.append((time.perf_counter() - start) * 1000)
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies_ms:
+            return float("nan")
+        return float(np.percentile(self.latencies_ms, p))
+
+
+def format_table(headers: Sequence[str], rows: Sequence[Sequence[object]]) -> str:
+    """Format rows as a plain-text table for terminal output."""
+
+    def format_cell(value: object) -> str:
+        if isinstance(value, float):
+            return f"{value:.2f}"
+        return str(value)
+
+    cells = [list(headers)] + [[format_cell(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in cells]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+async def create_synthetic_items(session: AsyncSession, schema: str, embedding_column: str, size: int):
+    """Replace the items table of a scratch schema with synthetic items, without any index but the primary key.
+
+    The synthetic items combine the text and add the embeddings of existing items.
+    """
+    table_name = Item.__tablename__
+    await session.execute(text(f"DROP TABLE IF EXISTS {schema}.{table_name}"))
+    await session.execute(
+        text(f"CREATE TABLE {schema}.{table_name} (LIKE public.{table_name} INCLUDING ALL EXCLUDING INDEXES)")
+    )
+    # Synthetic item n combines items at positions n, n / count and n / count^2 in base count,
+    # so that items are distinct up to count^3 items
+    await session.execute(
+        text(f"""
+        WITH source AS (
+            SELECT row_number() OVER (ORDER BY id) - 1 AS position, *
+            FROM public.{table_name} WHERE {embedding_column} IS NOT NULL
+        ),
+        source_count AS (SELECT count(*) AS n FROM source)
+        INSERT INTO {schema}.{table_name} (id, type, brand, name, description, price, {embedding_column})
+        SELECT number, a.type, b.brand, a.name || ' ' || b.name, a.description || ' ' || c.description, a.price,
+            a.{embedding_column} + b.{embedding_column} + c.{embedding_column}
+        FROM generate_series(1, :size) AS number
+        CROSS JOIN source_count
+        JOIN source AS a ON a.position = number % source_count.n
+        JOIN source AS b ON b.position = (number / source_count.n) % source_count.n
+        JOIN source AS c ON c.position = (number / (source_count.n * source_count.n)) % source_count.n
+        """),
+        {"size": size},
+    )
+    # Indexing after loading is faster than maintaining the indexes during the inserts
+    await session.execute(text(f"ALTER TABLE {schema}.{table_name} ADD PRIMARY KEY (id)"))
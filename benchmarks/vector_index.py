@@ -0,0 +1,161 @@
+"""
+Benchmark vector index types and build parameters on a synthetic catalog.
+
+Fills a scratch copy of the items table with synthetic items, made by combining the text and adding the
+embeddings of existing items, and builds each candidate index on it in turn, written like the
+setup_postgres_database.py --vector-index option.
+Reports the build time and size of each index, and the latency and recall@top of vector searches through it
+against an exact search, run before any vector index exists, for query vectors made by adding two catalog embeddings.
+The scratch schema is dropped at the end, the items table is not changed.
+
+    python -m benchmarks.vector_index --size 50000 --indexes hnsw:m=16,ef_construction=64 ivfflat:lists=200
+"""
+
+import argparse
+import asyncio
+import logging
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import event, text
+from sqlalchemy.engine import AdaptedConnection
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from benchmarks.utils import Timer, create_synthetic_items, format_table
+from fastapi_app.dependencies import common_parameters
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_models import Item, VectorIndexSpec
+
+logger = logging.getLogger("ragapp")
+
+SCRATCH_SCHEMA = "vector_index_benchmark"
+
+
+async def nearest_ids(session: AsyncSession, embedding_column: str, query_vector: np.ndarray, top: int) -> list[int]:
+    result = await session.scalars(
+        text(f"SELECT id FROM {Item.__tablename__} ORDER BY {embedding_column} <=> :embedding LIMIT :top"),
+        {"embedding": query_vector, "top": top},
+    )
+    return list(result)
+
+
+async def items_indexes(session: AsyncSession, schema: str) -> set[str]:
+    result = await session.scalars(
+        text("SELECT indexname FROM pg_indexes WHERE schemaname = :schema AND tablename = :table_name"),
+        {"schema": schema, "table_name": Item.__tablename__},
+    )
+    return set(result)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark vector index types and build parameters")
+    parser.add_argument(
+        "--indexes",
+        type=VectorIndexSpec.parse,
+        nargs="+",
+        default=[
+            VectorIndexSpec.parse(spec)
+            for spec in ["hnsw:m=16,ef_construction=64", "hnsw:m=32,ef_construction=128", "ivfflat:lists=100"]
+        ],
+        help="Indexes to compare, like hnsw:m=16,ef_construction=64 or ivfflat:lists=100",
+    )
+    parser.add_argument("--size", type=int, default=10000, help="Catalog size")
+    parser.add_argument("--top", type=int, default=10, help="Number of results requested per search")
+    parser.add_argument("--queries", type=int, default=50, help="Number of query vectors")
+    parser.add_argument("--ef-search", type=int, default=40, help="hnsw.ef_search for searches through HNSW indexes")
+    parser.add_argument("--probes", type=int, default=10, help="ivfflat.probes for searches through IVFFlat indexes")
+    args = parser.parse_args()
+
+    context = await common_parameters()
+    engine = await create_postgres_engine_from_env()
+    embedding_column = context.embedding_column
+    table_name = Item.__tablename__
+    search_settings = {"hnsw": {"hnsw.ef_search": args.ef_search}, "ivfflat": {"ivfflat.probes": args.probes}}
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def use_scratch_schema(dbapi_connection: AdaptedConnection, *args):
+        # Unqualified table names resolve to the scratch catalog
+        dbapi_connection.run_async(
+            lambda connection: connection.execute(f"SET search_path TO {SCRATCH_SCHEMA}, public")
+        )
+
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+    async with sessionmaker() as session, session.begin():
+        public_indexes = await items_indexes(session, "public")
+        await session.execute(text(f"CREATE SCHEMA IF NOT EXISTS {SCRATCH_SCHEMA}"))
+
+    rows = []
+    try:
+        logger.info(f"Creating a catalog of {args.size} items")
+        async with sessionmaker() as session, session.begin():
+            await create_synthetic_items(session, SCRATCH_SCHEMA, embedding_column, args.size)
+            await session.execute(text(f"ANALYZE {SCRATCH_SCHEMA}.{table_name}"))
+
+        async with sessionmaker() as session:
+            sampled = await session.scalars(
+                text(f"SELECT {embedding_column} FROM {table_name} ORDER BY random() LIMIT :n"),
+                {"n": args.queries * 2},
+            )
+            embeddings = [np.asarray(embedding) for embedding in sampled]
+            query_vectors = [a + b for a, b in zip(embeddings[::2], embeddings[1::2])]
+            # No vector index exists yet, so these searches scan the whole table
+            exact_ids = [await nearest_ids(session, embedding_column, vector, args.top) for vector in query_vectors]
+
+        for spec in args.indexes:
+            logger.info(f"Building {spec}")
+            # Qualified, so the indexes of the items table in public, found through the search path, are left alone
+            index_name = f"{SCRATCH_SCHEMA}.{spec.index_name(table_name, embedding_column)}"
+            build_timer = Timer()
+            async with sessionmaker() as session, session.begin():
+                await session.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+                with build_timer.measure():
+                    await session.execute(text(spec.create_index_sql(table_name, embedding_column, SCRATCH_SCHEMA)))
+                index_size = await session.scalar(
+                    text("SELECT pg_relation_size(to_regclass(:name))"), {"name": index_name}
+                )
+
+            timer = Timer()
+            recalls = []
+            # The first search warms up the index and is not timed
+            for i, query_vector in enumerate([query_vectors[0], *query_vectors]):
+                # New transaction per search so settings don't leak between indexes
+                async with sessionmaker() as session, session.begin():
+                    # Small catalogs would otherwise be scanned, whatever the index
+                    await session.execute(text("SET LOCAL enable_seqscan = off"))
+                    for name, value in search_settings[spec.method].items():
+                        await session.execute(text(f"SET LOCAL {name} = {int(value)}"))
+                    if i == 0:
+                        await nearest_ids(session, embedding_column, query_vector, args.top)
+                        continue
+                    with timer.measure():
+                        ids = await nearest_ids(session, embedding_column, query_vector, args.top)
+                recalls.append(len(set(ids).intersection(exact_ids[i - 1])) / args.top)
+
+            async with sessionmaker() as session, session.begin():
+                await session.execute(text(f"DROP INDEX {index_name}"))
+            rows.append(
+                [
+                    str(spec),
+                    build_timer.latencies_ms[0] / 1000,
+                    index_size / 1024 / 1024,
+                    float(np.mean(recalls)),
+                    timer.percentile(50),
+                    timer.percentile(99),
+                ]
+            )
+    finally:
+        async with sessionmaker() as session, session.begin():
+            await session.execute(text(f"DROP SCHEMA {SCRATCH_SCHEMA} CASCADE"))
+            missing_indexes = public_indexes - await items_indexes(session, "public")
+        await engine.dispose()
+    if missing_indexes:
+        raise RuntimeError(f"Indexes of the public items table were dropped: {', '.join(sorted(missing_indexes))}")
+
+    print(format_table(["index", "build_s", "index_mb", f"recall@{args.top}", "p50_ms", "p99_ms"], rows))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+    asyncio.run(main())
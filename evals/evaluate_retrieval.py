@@ -0,0 +1,133 @@
+"""
+Evaluate the retrieval quality and latency of hybrid search fusion strategies.
+
+For each question in the ground truth data, runs a hybrid search with each fusion strategy and reports
+recall@k, the fraction of the items cited by the ground truth answer that are in the top k results,
+along with the per-query search latency. Query embeddings are computed once per question, before timing.
+
+    python evals/evaluate_retrieval.py --k 1 3 5
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import re
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from rich.console import Console
+from rich.logging import RichHandler
+from rich.table import Table
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fastapi_app.api_models import Fusion, FusionMethod
+from fastapi_app.dependencies import common_parameters, get_azure_credential
+from fastapi_app.embeddings import compute_text_embeddings
+from fastapi_app.openai_clients import create_openai_embed_client
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_searcher import HYBRID_EXECUTION_MODES, PostgresSearcher
+
+logger = logging.getLogger("ragapp")
+
+FUSION_STRATEGIES = {
+    "rrf": Fusion(method=FusionMethod.RRF),
+    "weighted_rrf (vector 0.3)": Fusion(method=FusionMethod.WEIGHTED_RRF, vector_weight=0.3),
+    "weighted_rrf (vector 0.7)": Fusion(method=FusionMethod.WEIGHTED_RRF, vector_weight=0.7),
+    "convex (vector 0.3)": Fusion(method=FusionMethod.CONVEX, vector_weight=0.3),
+    "convex (vector 0.5)": Fusion(method=FusionMethod.CONVEX, vector_weight=0.5),
+    "convex (vector 0.7)": Fusion(method=FusionMethod.CONVEX, vector_weight=0.7),
+}
+
+
+def load_ground_truth(path: Path, num_questions: Optional[int] = None) -> list[tuple[str, set[int]]]:
+    """Return the questions with the ids of the items that their ground truth answers cite, like [12]."""
+    questions = []
+    with open(path) as f:
+        for line in f:
+            row = json.loads(line)
+            questions.append((row["question"], {int(id) for id in re.findall(r"\[(\d+)\]", row["truth"])}))
+    return questions[:num_questions]
+
+
+def recall_at_k(result_ids: list[int], cited_ids: set[int], k: int) -> float:
+    return len(cited_ids.intersection(result_ids[:k])) / len(cited_ids)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Evaluate the recall and latency of hybrid search fusion strategies")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5], help="Cutoffs for recall@k")
+    parser.add_argument("--numquestions", type=int, help="Number of ground truth questions to evaluate")
+    parser.add_argument(
+        "--hybrid-execution", type=str, default="statement", choices=HYBRID_EXECUTION_MODES, help="Hybrid execution"
+    )
+    args = parser.parse_args()
+
+    questions = [
+        (question, cited_ids)
+        for question, cited_ids in load_ground_truth(Path(__file__).parent / "ground_truth.jsonl", args.numquestions)
+        if cited_ids
+    ]
+    context = await common_parameters()
+    azure_credential = await get_azure_credential()
+    openai_embed_client = await create_openai_embed_client(azure_credential)
+    engine = await create_postgres_engine_from_env(azure_credential)
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+
+    query_vectors = await compute_text_embeddings(
+        [question for question, _ in questions],
+        openai_embed_client,
+        context.openai_embed_model,
+        context.openai_embed_deployment,
+        context.openai_embed_dimensions,
+    )
+
+    table = Table(title=f"Hybrid search fusion over {len(questions)} questions")
+    table.add_column("strategy")
+    for k in args.k:
+        table.add_column(f"recall@{k}", justify="right")
+    table.add_column("p50_ms", justify="right")
+    table.add_column("p95_ms", justify="right")
+    for name, fusion in FUSION_STRATEGIES.items():
+        recalls: dict[int, list[float]] = {k: [] for k in args.k}
+        latencies_ms = []
+        for (question, cited_ids), query_vector in zip(questions, query_vectors):
+            # New transaction per search so index settings don't leak between runs
+            async with sessionmaker() as session:
+                searcher = PostgresSearcher(
+                    db_session=session,
+                    openai_embed_client=openai_embed_client,
+                    embed_deployment=context.openai_embed_deployment,
+                    embed_model=context.openai_embed_model,
+                    embed_dimensions=context.openai_embed_dimensions,
+                    embedding_column=context.embedding_column,
+                    candidate_pool=context.search_candidates,
+                    hybrid_execution=args.hybrid_execution,
+                    sessionmaker=sessionmaker,
+                )
+                start = time.perf_counter()
+                results = await searcher.search(question, query_vector, top=max(args.k), fusion=fusion)
+                latencies_ms.append((time.perf_counter() - start) * 1000)
+            for k in args.k:
+                recalls[k].append(recall_at_k([item.id for item in results], cited_ids, k))
+        table.add_row(
+            name,
+            *[f"{np.mean(recalls[k]):.2f}" for k in args.k],
+            f"{np.percentile(latencies_ms, 50):.2f}",
+            f"{np.percentile(latencies_ms, 95):.2f}",
+        )
+
+    await engine.dispose()
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING, format="%(message)s", datefmt="[%X]", handlers=[RichHandler(rich_tracebacks=True)]
+    )
+    logger.setLevel(logging.INFO)
+    load_dotenv(".env", override=True)
+    asyncio.run(main())
@@ -2,7 +2,7 @@ import logging
 import os
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
-from typing import TypedDict
+from typing import Optional, TypedDict
 
 import fastapi
 from azure.monitor.opentelemetry import configure_azure_monitor
@@ -12,14 +12,25 @@ from opentelemetry.instrumentation.openai import OpenAIInstrumentor
 from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from fastapi_app.api_models import ItemPublic
+from fastapi_app.caching import AsyncLRUCache
 from fastapi_app.dependencies import (
     FastAPIAppContext,
     common_parameters,
     create_async_sessionmaker,
     get_azure_credential,
 )
+from fastapi_app.embeddings import EmbeddingCacheKey
+from fastapi_app.flow_router import FlowRouter
+from fastapi_app.item_cache import ItemCache
 from fastapi_app.openai_clients import create_openai_chat_client, create_openai_embed_client
 from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_listener import PostgresListener
+from fastapi_app.rag_advanced import QueryRewrite
+from fastapi_app.rag_agents import create_rag_agents
+from fastapi_app.rag_base import RAGAgents
+from fastapi_app.reranker import Reranker, create_reranker
+from fastapi_app.semantic_cache import SemanticSearchCache
 
 logger = logging.getLogger("ragapp")
 
@@ -29,6 +40,13 @@ class State(TypedDict):
     context: FastAPIAppContext
     chat_client: AsyncOpenAI
     embed_client: AsyncOpenAI
+    rag_agents: RAGAgents
+    embedding_cache: Optional[AsyncLRUCache[EmbeddingCacheKey, list[float]]]
+    semantic_cache: Optional[SemanticSearchCache[list[ItemPublic]]]
+    flow_router: Optional[FlowRouter]
+    query_rewrite_cache: Optional[AsyncLRUCache[str, QueryRewrite]]
+    item_cache: Optional[ItemCache]
+    reranker: Optional[Reranker]
 
 
 @asynccontextmanager
@@ -45,9 +63,71 @@ async def lifespan(app: fastapi.FastAPI) -> AsyncIterator[State]:
     sessionmaker = await create_async_sessionmaker(engine)
     chat_client = await create_openai_chat_client(azure_credential)
     embed_client = await create_openai_embed_client(azure_credential)
+    rag_agents = create_rag_agents(chat_client, context.openai_chat_model, context.openai_chat_deployment)
+    embedding_cache: Optional[AsyncLRUCache[EmbeddingCacheKey, list[float]]] = None
+    if context.embedding_cache_size > 0:
+        embedding_cache = AsyncLRUCache(maxsize=context.embedding_cache_size, ttl=context.embedding_cache_ttl)
+    semantic_cache: Optional[SemanticSearchCache[list[ItemPublic]]] = None
+    if context.semantic_cache_size > 0:
+        semantic_cache = SemanticSearchCache(
+            maxsize=context.semantic_cache_size,
+            max_distance=context.semantic_cache_max_distance,
+            ttl=context.semantic_cache_ttl,
+        )
+    item_cache: Optional[ItemCache] = None
+    if context.item_cache_size > 0:
+        item_cache = ItemCache(maxsize=context.item_cache_size, ttl=context.item_cache_ttl)
+    query_rewrite_cache: Optional[AsyncLRUCache[str, QueryRewrite]] = None
+    if context.query_rewrite_cache_size > 0:
+        query_rewrite_cache = AsyncLRUCache(
+            maxsize=context.query_rewrite_cache_size, ttl=context.query_rewrite_cache_ttl
+        )
+    reranker = create_reranker(
+        context.reranker, context.reranker_endpoint, context.reranker_key, context.reranker_model
+    )
+    flow_router: Optional[FlowRouter] = None
+    if context.adaptive_flow_routing:
+        flow_router = FlowRouter()
+    listener: Optional[PostgresListener] = None
+    if semantic_cache is not None or item_cache is not None or flow_router is not None:
+        # Cached results, items and brands are stale as soon as the items table changes
+        listener = PostgresListener(engine)
+        if semantic_cache is not None:
+            listener.add_callback(lambda payload: semantic_cache.clear())
+        if item_cache is not None:
+            listener.add_callback(item_cache.on_items_changed)
+        if flow_router is not None:
+            listener.add_callback(lambda payload: flow_router.invalidate_brands())
+        await listener.start()
     if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
         SQLAlchemyInstrumentor().instrument(engine=engine.sync_engine)
-    yield {"sessionmaker": sessionmaker, "context": context, "chat_client": chat_client, "embed_client": embed_client}
+    yield {
+        "sessionmaker": sessionmaker,
+        "context": context,
+        "chat_client": chat_client,
+        "embed_client": embed_client,
+        "rag_agents": rag_agents,
+        "embedding_cache": embedding_cache,
+        "semantic_cache": semantic_cache,
+        "flow_router": flow_router,
+        "query_rewrite_cache": query_rewrite_cache,
+        "item_cache": item_cache,
+        "reranker": reranker,
+    }
+    if listener is not None:
+        await listener.stop()
+    if embedding_cache is not None:
+        logger.info("Query embedding cache stats: %s", embedding_cache.stats())
+    if semantic_cache is not None:
+        logger.info("Semantic search cache stats: %s", semantic_cache.stats())
+    if item_cache is not None:
+        logger.info("Item cache stats: %s", item_cache.stats())
+    if query_rewrite_cache is not None:
+        logger.info("Query rewrite cache stats: %s", query_rewrite_cache.stats())
+    if flow_router is not None:
+        logger.info("Chat flow routes taken: %s", flow_router.stats())
+    if reranker is not None:
+        await reranker.close()
     await engine.dispose()
 
 
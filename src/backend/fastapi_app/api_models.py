@@ -1,8 +1,9 @@
 from enum import Enum
-from typing import Any, Optional
+from functools import cached_property
+from typing import Any, Literal, Optional, Union
 
 from openai.types.responses import ResponseInputItemParam
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class RetrievalMode(str, Enum):
@@ -11,12 +12,38 @@ class RetrievalMode(str, Enum):
     HYBRID = "hybrid"
 
 
+class SearchEffort(str, Enum):
+    LOW = "low"
+    MEDIUM = "medium"
+    HIGH = "high"
+
+
+class FusionMethod(str, Enum):
+    RRF = "rrf"
+    WEIGHTED_RRF = "weighted_rrf"
+    CONVEX = "convex"
+
+
+class Fusion(BaseModel):
+    """How hybrid search combines the rankings of its vector and full-text searches."""
+
+    model_config = ConfigDict(frozen=True)
+
+    method: FusionMethod = FusionMethod.RRF
+    k: int = Field(default=60, ge=1, description="Rank constant of reciprocal rank fusion")
+    vector_weight: float = Field(
+        default=0.5, ge=0, le=1, description="Weight of the vector search, the full-text search gets the rest"
+    )
+
+
 class ChatRequestOverrides(BaseModel):
     top: int = 3
     temperature: float = 0.3
     retrieval_mode: RetrievalMode = RetrievalMode.HYBRID
     use_advanced_flow: bool = True
     prompt_template: Optional[str] = None
+    search_effort: Optional[SearchEffort] = None
+    fusion: Optional[Fusion] = None
 
 
 class ChatRequestContext(BaseModel):
@@ -36,9 +63,13 @@ class ItemPublic(BaseModel):
     description: str
     price: float
 
-    def to_str_for_rag(self):
+    @cached_property
+    def rag_text(self) -> str:
         return f"Name:{self.name} Description:{self.description} Price:{self.price} Brand:{self.brand} Type:{self.type}"
 
+    def to_str_for_rag(self):
+        return self.rag_text
+
 
 class ItemWithDistance(ItemPublic):
     distance: float
@@ -72,6 +103,7 @@ class RetrievalResponseDelta(BaseModel):
     type: str
     delta: Optional[str] = None
     context: Optional[RAGContext] = None
+    thought: Optional[ThoughtStep] = None
 
 
 class ChatParams(ChatRequestOverrides):
@@ -101,6 +133,27 @@ class BrandFilter(Filter):
     value: str = Field(description="The brand name to compare against (e.g., 'AirStrider')")
 
 
+class SearchFilter(Filter):
+    """A filter sent by API clients, limited to the columns and operators that searches can filter on."""
+
+    column: Literal["brand", "type", "price"]
+    comparison_operator: Literal["=", "!=", "<", "<=", ">", ">="]
+    value: Union[float, str]
+
+
+class SearchQuery(BaseModel):
+    query: str
+    top: int = Field(default=5, ge=1, le=50)
+    enable_vector_search: bool = True
+    enable_text_search: bool = True
+    filters: list[SearchFilter] = []
+
+
+class BatchSearchRequest(BaseModel):
+    queries: list[SearchQuery] = Field(min_length=1, max_length=100)
+    search_effort: Optional[SearchEffort] = None
+
+
 class SearchResults(BaseModel):
     query: str
     """The original search query"""
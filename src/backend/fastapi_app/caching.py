@@ -0,0 +1,109 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+from typing import Generic, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class _ComputationCancelled(Exception):
+    """Raised to waiters of a coalesced computation when the request computing the value was cancelled."""
+
+
+class AsyncLRUCache(Generic[K, V]):
+    """
+    Size-bounded LRU cache with optional time-to-live, safe to share between requests on one event loop.
+    Concurrent misses for the same key are coalesced so that the value is only computed once.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        if maxsize <= 0:
+            raise ValueError("Cache maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._pending: dict[K, asyncio.Future[V]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def get_many(self, keys: Iterable[K]) -> dict[K, V]:
+        """Return the cached values of the given keys, skipping keys that aren't cached, and count hits and misses."""
+        values = {}
+        for key in dict.fromkeys(keys):
+            if (value := self.get(key)) is not None:
+                values[key] = value
+                self.hits += 1
+            else:
+                self.misses += 1
+        return values
+
+    def set(self, key: K, value: V):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: K):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_compute(self, key: K, compute: Callable[[], Awaitable[V]]) -> V:
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except _ComputationCancelled:
+                # Only the request computing the value was cancelled, so compute it again
+                continue
+
+        self.misses += 1
+        future: asyncio.Future[V] = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            # Cancelling the future would cancel the waiters too, although they weren't cancelled
+            future.set_exception(_ComputationCancelled())
+            future.exception()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # Mark the exception as retrieved, as there may be no other waiters
+            future.exception()
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._pending[key]
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
@@ -9,6 +9,17 @@ from openai import AsyncOpenAI
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
 
+from fastapi_app.api_models import ItemPublic, SearchEffort
+from fastapi_app.caching import AsyncLRUCache
+from fastapi_app.embeddings import EmbeddingCacheKey
+from fastapi_app.flow_router import FlowRouter
+from fastapi_app.item_cache import ItemCache
+from fastapi_app.postgres_models import DEFAULT_VECTOR_INDEX, VectorIndexSpec
+from fastapi_app.rag_advanced import QueryRewrite
+from fastapi_app.rag_base import RAGAgents
+from fastapi_app.reranker import Reranker
+from fastapi_app.semantic_cache import SemanticSearchCache
+
 logger = logging.getLogger("ragapp")
 
 
@@ -32,6 +43,32 @@ class FastAPIAppContext(BaseModel):
     openai_chat_deployment: Optional[str]
     openai_embed_deployment: Optional[str]
     embedding_column: str
+    search_candidates: int = 20
+    hnsw_iterative_scan: Optional[str] = None
+    hybrid_search_execution: str = "statement"
+    vector_search_mode: str = "full"
+    coarse_search_candidates: int = 100
+    vector_index: VectorIndexSpec = DEFAULT_VECTOR_INDEX
+    search_endpoint_search_effort: Optional[SearchEffort] = None
+    chat_endpoint_search_effort: Optional[SearchEffort] = None
+    embedding_cache_size: int = 0
+    embedding_cache_ttl: Optional[float] = None
+    semantic_cache_size: int = 0
+    semantic_cache_max_distance: float = 0.05
+    semantic_cache_ttl: Optional[float] = None
+    speculative_search: bool = False
+    adaptive_flow_routing: bool = False
+    query_rewrite_cache_size: int = 0
+    query_rewrite_cache_ttl: Optional[float] = None
+    item_cache_size: int = 0
+    item_cache_ttl: Optional[float] = None
+    precomputed_neighbors: bool = False
+    reranker: Optional[str] = None
+    reranker_endpoint: Optional[str] = None
+    reranker_key: Optional[str] = None
+    reranker_model: Optional[str] = None
+    rerank_candidates: int = 20
+    rerank_timeout: float = 0.5
 
 
 async def common_parameters():
@@ -66,6 +103,32 @@ async def common_parameters():
     else:
         openai_chat_deployment = None
         openai_chat_model = os.getenv("OPENAICOM_CHAT_MODEL") or "gpt-3.5-turbo"
+    search_candidates = int(os.getenv("POSTGRES_SEARCH_CANDIDATES") or 20)
+    hnsw_iterative_scan = os.getenv("POSTGRES_HNSW_ITERATIVE_SCAN") or None
+    hybrid_search_execution = os.getenv("POSTGRES_HYBRID_SEARCH_EXECUTION") or "statement"
+    vector_search_mode = os.getenv("POSTGRES_VECTOR_SEARCH_MODE") or "full"
+    coarse_search_candidates = int(os.getenv("POSTGRES_COARSE_SEARCH_CANDIDATES") or 100)
+    vector_index = VectorIndexSpec.parse(os.getenv("POSTGRES_VECTOR_INDEX") or str(DEFAULT_VECTOR_INDEX))
+    search_endpoint_search_effort = os.getenv("SEARCH_ENDPOINT_SEARCH_EFFORT") or None
+    chat_endpoint_search_effort = os.getenv("CHAT_ENDPOINT_SEARCH_EFFORT") or None
+    embedding_cache_size = int(os.getenv("EMBEDDING_CACHE_SIZE") or 4096)
+    embedding_cache_ttl = float(os.getenv("EMBEDDING_CACHE_TTL") or 3600)
+    semantic_cache_size = int(os.getenv("SEMANTIC_CACHE_SIZE") or 0)
+    semantic_cache_max_distance = float(os.getenv("SEMANTIC_CACHE_MAX_DISTANCE") or 0.05)
+    semantic_cache_ttl = float(os.getenv("SEMANTIC_CACHE_TTL") or 3600)
+    speculative_search = (os.getenv("SPECULATIVE_SEARCH") or "false").lower() == "true"
+    adaptive_flow_routing = (os.getenv("ADAPTIVE_FLOW_ROUTING") or "false").lower() == "true"
+    query_rewrite_cache_size = int(os.getenv("QUERY_REWRITE_CACHE_SIZE") or 0)
+    query_rewrite_cache_ttl = float(os.getenv("QUERY_REWRITE_CACHE_TTL") or 600)
+    item_cache_size = int(os.getenv("ITEM_CACHE_SIZE") or 0)
+    item_cache_ttl = float(os.getenv("ITEM_CACHE_TTL") or 3600)
+    precomputed_neighbors = (os.getenv("PRECOMPUTED_NEIGHBORS") or "false").lower() == "true"
+    reranker = os.getenv("RERANKER") or None
+    reranker_endpoint = os.getenv("RERANKER_ENDPOINT") or None
+    reranker_key = os.getenv("RERANKER_KEY") or None
+    reranker_model = os.getenv("RERANKER_MODEL") or None
+    rerank_candidates = int(os.getenv("RERANK_CANDIDATES") or 20)
+    rerank_timeout = float(os.getenv("RERANK_TIMEOUT") or 0.5)
     return FastAPIAppContext(
         openai_chat_model=openai_chat_model,
         openai_embed_model=openai_embed_model,
@@ -73,6 +136,32 @@ async def common_parameters():
         openai_chat_deployment=openai_chat_deployment,
         openai_embed_deployment=openai_embed_deployment,
         embedding_column=embedding_column,
+        search_candidates=search_candidates,
+        hnsw_iterative_scan=hnsw_iterative_scan,
+        hybrid_search_execution=hybrid_search_execution,
+        vector_search_mode=vector_search_mode,
+        coarse_search_candidates=coarse_search_candidates,
+        vector_index=vector_index,
+        search_endpoint_search_effort=search_endpoint_search_effort,
+        chat_endpoint_search_effort=chat_endpoint_search_effort,
+        embedding_cache_size=embedding_cache_size,
+        embedding_cache_ttl=embedding_cache_ttl,
+        semantic_cache_size=semantic_cache_size,
+        semantic_cache_max_distance=semantic_cache_max_distance,
+        semantic_cache_ttl=semantic_cache_ttl,
+        speculative_search=speculative_search,
+        adaptive_flow_routing=adaptive_flow_routing,
+        query_rewrite_cache_size=query_rewrite_cache_size,
+        query_rewrite_cache_ttl=query_rewrite_cache_ttl,
+        item_cache_size=item_cache_size,
+        item_cache_ttl=item_cache_ttl,
+        precomputed_neighbors=precomputed_neighbors,
+        reranker=reranker,
+        reranker_endpoint=reranker_endpoint,
+        reranker_key=reranker_key,
+        reranker_model=reranker_model,
+        rerank_candidates=rerank_candidates,
+        rerank_timeout=rerank_timeout,
     )
 
 
@@ -144,7 +233,64 @@ async def get_openai_embed_client(
     return OpenAIClient(client=request.state.embed_client)
 
 
+async def get_rag_agents(
+    request: Request,
+) -> RAGAgents:
+    """Get the chat agents shared by all requests"""
+    return request.state.rag_agents
+
+
+async def get_embedding_cache(
+    request: Request,
+) -> Optional[AsyncLRUCache[EmbeddingCacheKey, list[float]]]:
+    """Get the query embedding cache, if enabled"""
+    return request.state.embedding_cache
+
+
+async def get_semantic_cache(
+    request: Request,
+) -> Optional[SemanticSearchCache[list[ItemPublic]]]:
+    """Get the semantic search results cache, if enabled"""
+    return request.state.semantic_cache
+
+
+async def get_query_rewrite_cache(
+    request: Request,
+) -> Optional[AsyncLRUCache[str, QueryRewrite]]:
+    """Get the cache of search arguments generated by the advanced flow, if enabled"""
+    return request.state.query_rewrite_cache
+
+
+async def get_item_cache(
+    request: Request,
+) -> Optional[ItemCache]:
+    """Get the cache of catalog items by id, if enabled"""
+    return request.state.item_cache
+
+
+async def get_reranker(
+    request: Request,
+) -> Optional[Reranker]:
+    """Get the reranker for search results, if enabled"""
+    return request.state.reranker
+
+
+async def get_flow_router(
+    request: Request,
+) -> Optional[FlowRouter]:
+    """Get the router between the simple and advanced chat flows, if enabled"""
+    return request.state.flow_router
+
+
 CommonDeps = Annotated[FastAPIAppContext, Depends(get_context)]
 DBSession = Annotated[AsyncSession, Depends(get_async_db_session)]
+DBSessionMaker = Annotated[async_sessionmaker[AsyncSession], Depends(get_async_sessionmaker)]
 ChatClient = Annotated[OpenAIClient, Depends(get_openai_chat_client)]
 EmbeddingsClient = Annotated[OpenAIClient, Depends(get_openai_embed_client)]
+ChatAgents = Annotated[RAGAgents, Depends(get_rag_agents)]
+EmbeddingCache = Annotated[Optional[AsyncLRUCache[EmbeddingCacheKey, list[float]]], Depends(get_embedding_cache)]
+SemanticCache = Annotated[Optional[SemanticSearchCache[list[ItemPublic]]], Depends(get_semantic_cache)]
+QueryRewriteCache = Annotated[Optional[AsyncLRUCache[str, QueryRewrite]], Depends(get_query_rewrite_cache)]
+CatalogItemCache = Annotated[Optional[ItemCache], Depends(get_item_cache)]
+ChatFlowRouter = Annotated[Optional[FlowRouter], Depends(get_flow_router)]
+SearchReranker = Annotated[Optional[Reranker], Depends(get_reranker)]
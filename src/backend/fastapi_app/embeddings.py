@@ -1,35 +1,143 @@
+import asyncio
+from collections.abc import Iterator
 from typing import Optional, TypedDict
 
+import numpy as np
+from numpy.typing import ArrayLike
 from openai import AsyncOpenAI
 
+from fastapi_app.caching import AsyncLRUCache
 
-async def compute_text_embedding(
-    q: str,
-    openai_client: AsyncOpenAI,
-    embed_model: str,
-    embed_deployment: Optional[str] = None,
-    embedding_dimensions: Optional[int] = None,
-) -> list[float]:
+EmbeddingCacheKey = tuple[str, Optional[str], Optional[int], str]
+
+# Request limits of the OpenAI embeddings API
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300_000
+
+
+class ExtraArgs(TypedDict, total=False):
+    dimensions: int
+
+
+def get_dimensions_args(embed_model: str, embedding_dimensions: Optional[int]) -> ExtraArgs:
     SUPPORTED_DIMENSIONS_MODEL = {
         "text-embedding-ada-002": False,
         "text-embedding-3-small": True,
         "text-embedding-3-large": True,
     }
 
-    class ExtraArgs(TypedDict, total=False):
-        dimensions: int
-
     dimensions_args: ExtraArgs = {}
     if SUPPORTED_DIMENSIONS_MODEL.get(embed_model):
         if embedding_dimensions is None:
             raise ValueError(f"Model {embed_model} requires embedding dimensions")
         else:
             dimensions_args = {"dimensions": embedding_dimensions}
+    return dimensions_args
+
+
+def normalize_query_text(q: str) -> str:
+    """Normalize case and whitespace so that trivially different queries share an embedding."""
+    return " ".join(q.split()).casefold()
+
+
+def embedding_cache_key(
+    q: str, embed_model: str, embed_deployment: Optional[str], embedding_dimensions: Optional[int]
+) -> EmbeddingCacheKey:
+    return (embed_model, embed_deployment, embedding_dimensions, normalize_query_text(q))
+
+
+def truncate_embedding(embedding: ArrayLike, dimensions: int) -> np.ndarray:
+    """
+    Keep the first dimensions of an embedding, scaled back to unit length.
+    For text-embedding-3 models, this matches the embedding that the API returns for the smaller dimensions.
+    """
+    truncated = np.asarray(embedding, dtype=np.float32)[:dimensions]
+    norm = np.linalg.norm(truncated)
+    return truncated / norm if norm > 0 else truncated
+
+
+def estimate_token_count(text: str) -> int:
+    """
+    Estimate the token count without a tokenizer.
+    English text averages about 4 bytes per token with OpenAI tokenizers, so 3 bytes per token overestimates.
+    """
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+def batch_texts(
+    texts: list[str],
+    max_inputs: int = MAX_INPUTS_PER_REQUEST,
+    max_tokens: int = MAX_TOKENS_PER_REQUEST,
+) -> Iterator[tuple[int, int]]:
+    """Split texts into consecutive (start, end) ranges that each fit within one embeddings request."""
+    start = 0
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_token_count(text)
+        if i > start and (i - start >= max_inputs or batch_tokens + tokens > max_tokens):
+            yield start, i
+            start, batch_tokens = i, 0
+        batch_tokens += tokens
+    if start < len(texts):
+        yield start, len(texts)
+
+
+async def compute_text_embedding(
+    q: str,
+    openai_client: AsyncOpenAI,
+    embed_model: str,
+    embed_deployment: Optional[str] = None,
+    embedding_dimensions: Optional[int] = None,
+    cache: Optional[AsyncLRUCache[EmbeddingCacheKey, list[float]]] = None,
+) -> list[float]:
+    dimensions_args = get_dimensions_args(embed_model, embedding_dimensions)
+
+    async def create_embedding() -> list[float]:
+        embedding = await openai_client.embeddings.create(
+            # Azure OpenAI takes the deployment name as the model name
+            model=embed_deployment if embed_deployment else embed_model,
+            input=q,
+            **dimensions_args,
+        )
+        return embedding.data[0].embedding
+
+    if cache is None:
+        return await create_embedding()
+    cache_key = embedding_cache_key(q, embed_model, embed_deployment, embedding_dimensions)
+    return await cache.get_or_compute(cache_key, create_embedding)
+
+
+async def compute_text_embeddings(
+    texts: list[str],
+    openai_client: AsyncOpenAI,
+    embed_model: str,
+    embed_deployment: Optional[str] = None,
+    embedding_dimensions: Optional[int] = None,
+    max_inputs_per_request: int = MAX_INPUTS_PER_REQUEST,
+    max_tokens_per_request: int = MAX_TOKENS_PER_REQUEST,
+    max_concurrency: int = 4,
+) -> list[list[float]]:
+    """
+    Compute embeddings for many texts with as few requests as the API limits allow,
+    sending up to max_concurrency requests at a time. Returns embeddings in the same order as texts.
+    """
+    dimensions_args = get_dimensions_args(embed_model, embedding_dimensions)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def create_embeddings(start: int, end: int) -> list[list[float]]:
+        async with semaphore:
+            response = await openai_client.embeddings.create(
+                # Azure OpenAI takes the deployment name as the model name
+                model=embed_deployment if embed_deployment else embed_model,
+                input=texts[start:end],
+                **dimensions_args,
+            )
+        return [embedding.embedding for embedding in sorted(response.data, key=lambda embedding: embedding.index)]
 
-    embedding = await openai_client.embeddings.create(
-        # Azure OpenAI takes the deployment name as the model name
-        model=embed_deployment if embed_deployment else embed_model,
-        input=q,
-        **dimensions_args,
+    batches = await asyncio.gather(
+        *[
+            create_embeddings(start, end)
+            for start, end in batch_texts(texts, max_inputs_per_request, max_tokens_per_request)
+        ]
     )
-    return embedding.data[0].embedding
+    return [embedding for batch in batches for embedding in batch]
@@ -0,0 +1,67 @@
+import re
+import time
+from collections import Counter
+from collections.abc import Iterable
+from typing import Optional
+
+from openai.types.responses import ResponseInputItemParam
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from fastapi_app.postgres_models import Item
+
+# Words and symbols suggesting that the query rewrite should extract a price filter
+PRICE_HINTS = re.compile(
+    r"\d|\$|\b(cheap|cheaper|cheapest|budget|affordable|expensive|under|below|over|above|less|more|price|priced|cost)\b",
+    re.IGNORECASE,
+)
+
+
+class FlowRouter:
+    """
+    Decides whether a chat request needs the advanced flow, which costs an extra LLM call to rewrite the query.
+    The rewrite resolves follow-up questions against earlier messages and extracts price and brand filters,
+    so a question without earlier messages, price hints or brand names goes to the simple flow instead.
+    """
+
+    def __init__(self, brands_ttl: float = 300):
+        self.brands_ttl = brands_ttl
+        self._brand_pattern: Optional[re.Pattern[str]] = None
+        self._brands_expire_at = 0.0
+        self.routes: Counter[str] = Counter()
+
+    def set_brands(self, brands: Iterable[str]):
+        # Match longer names first, so that a brand containing another brand's name wins
+        names = sorted({brand for brand in brands if brand}, key=len, reverse=True)
+        self._brand_pattern = (
+            re.compile(r"\b(" + "|".join(re.escape(name) for name in names) + r")\b", re.IGNORECASE) if names else None
+        )
+        self._brands_expire_at = time.monotonic() + self.brands_ttl
+
+    def invalidate_brands(self):
+        self._brands_expire_at = 0.0
+
+    async def refresh_brands(self, session: AsyncSession):
+        """Reload the brand names from the database if they are older than brands_ttl."""
+        if time.monotonic() < self._brands_expire_at:
+            return
+        self.set_brands((await session.scalars(select(Item.brand).distinct())).all())
+
+    def needs_query_rewrite(self, messages: list[ResponseInputItemParam]) -> bool:
+        query = messages[-1].get("content") if messages else None
+        if not isinstance(query, str):
+            # Let the advanced flow report the invalid request
+            route = "invalid"
+        elif len(messages) > 1:
+            route = "follow_up"
+        elif PRICE_HINTS.search(query):
+            route = "price_hint"
+        elif self._brand_pattern is not None and self._brand_pattern.search(query):
+            route = "brand_hint"
+        else:
+            route = "simple"
+        self.routes[route] += 1
+        return route != "simple"
+
+    def stats(self) -> dict[str, int]:
+        return dict(self.routes)
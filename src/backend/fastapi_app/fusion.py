@@ -0,0 +1,75 @@
+from collections.abc import Sequence
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from fastapi_app.api_models import Fusion, FusionMethod
+
+
+class RankedCandidates(NamedTuple):
+    """Candidates of one search, best first, with their ranks and scores where higher scores are better."""
+
+    ids: Sequence[int]
+    ranks: Sequence[int]
+    scores: Sequence[float]
+
+
+def rank_by_total_score(id_lists: Sequence[Sequence[int]], score_lists: Sequence[np.ndarray]) -> list[int]:
+    """Sum the scores of each id across the lists, and return the ids by descending total, ties broken by id."""
+    if not id_lists:
+        return []
+    ids = np.concatenate([np.asarray(id_list, dtype=np.int64) for id_list in id_lists])
+    unique_ids, positions = np.unique(ids, return_inverse=True)
+    totals = np.zeros(len(unique_ids))
+    np.add.at(totals, positions, np.concatenate(score_lists))
+    # np.unique sorts the ids, so a stable sort orders ties by id
+    order = np.argsort(-totals, kind="stable")
+    return unique_ids[order].tolist()
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[tuple[Sequence[int], Sequence[int]]], k: int = 60, weights: Optional[Sequence[float]] = None
+) -> list[int]:
+    """
+    Fuse rankings with Reciprocal Rank Fusion, scoring each id by the sum of weight / (k + rank) over the rankings.
+    Each ranking is a pair of ids and their ranks. Without weights, every ranking has a weight of 1.
+    Returns the ids by descending score, ties broken by id.
+    """
+    weights = weights if weights is not None else [1.0] * len(rankings)
+    return rank_by_total_score(
+        [ids for ids, _ in rankings],
+        [weight / (k + np.asarray(ranks, dtype=np.float64)) for (_, ranks), weight in zip(rankings, weights)],
+    )
+
+
+def convex_combination(
+    scorings: Sequence[tuple[Sequence[int], Sequence[float]]], weights: Sequence[float]
+) -> list[int]:
+    """
+    Fuse scored candidate lists with a weighted sum of their scores, min-max normalized within each list,
+    so that scores on different scales, such as cosine similarity and ts_rank_cd, can be combined.
+    An id that is missing from a list gets nothing from it, like the lowest scoring candidate of that list.
+    Returns the ids by descending score, ties broken by id.
+    """
+    normalized_scores = []
+    for (_, scores), weight in zip(scorings, weights):
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(scores) == 0:
+            normalized_scores.append(scores)
+            continue
+        low, high = scores.min(), scores.max()
+        normalized = (scores - low) / (high - low) if high > low else np.ones_like(scores)
+        normalized_scores.append(weight * normalized)
+    return rank_by_total_score([ids for ids, _ in scorings], normalized_scores)
+
+
+def fuse_rankings(vector: RankedCandidates, fulltext: RankedCandidates, fusion: Fusion) -> list[int]:
+    """Fuse the candidates of the vector and full-text searches of a hybrid search, returning the ids by score."""
+    weights = (fusion.vector_weight, 1 - fusion.vector_weight)
+    if fusion.method == FusionMethod.CONVEX:
+        return convex_combination([(vector.ids, vector.scores), (fulltext.ids, fulltext.scores)], weights)
+    return reciprocal_rank_fusion(
+        [(vector.ids, vector.ranks), (fulltext.ids, fulltext.ranks)],
+        k=fusion.k,
+        weights=weights if fusion.method == FusionMethod.WEIGHTED_RRF else None,
+    )
@@ -0,0 +1,82 @@
+from collections.abc import Sequence
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from fastapi_app.api_models import ItemPublic
+from fastapi_app.caching import AsyncLRUCache
+from fastapi_app.postgres_listener import parse_changed_ids
+from fastapi_app.postgres_models import Item
+
+# Columns needed to build ItemPublic, so that embeddings aren't read when loading items
+PUBLIC_COLUMNS = [getattr(Item, name) for name in ItemPublic.model_fields]
+
+
+class ItemCache:
+    """
+    Caches items by id as ready-made ItemPublic models with their text for the RAG prompt,
+    so that hot items are served without a database round trip.
+    Entries are invalidated by the notifications that the items table's triggers send with the ids of changed rows.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self._items: AsyncLRUCache[int, ItemPublic] = AsyncLRUCache(maxsize=maxsize, ttl=ttl)
+        # Incremented on every invalidation, so that rows read before a change aren't cached after it
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, item: ItemPublic):
+        # Build the text for the RAG prompt once, instead of in every request that uses the item
+        item.to_str_for_rag()
+        self._items.set(item.id, item)
+
+    def clear(self):
+        self._generation += 1
+        self._items.clear()
+
+    def on_items_changed(self, payload: Optional[str]):
+        """Invalidate the items named in a notification on the items changed channel."""
+        changed_ids = parse_changed_ids(payload)
+        if changed_ids is None:
+            self.clear()
+            return
+        self._generation += 1
+        for id in changed_ids:
+            self._items.invalidate(id)
+
+    async def get_items(self, session: AsyncSession, ids: Sequence[int]) -> list[ItemPublic]:
+        """
+        Return the items with the given ids in the same order, loading the ones that aren't cached in one query.
+        Ids of items that don't exist are skipped.
+        """
+        items: dict[int, ItemPublic] = {}
+        missing_ids = []
+        for id in ids:
+            if (item := self._items.get(id)) is not None:
+                items[id] = item
+            else:
+                missing_ids.append(id)
+        self.hits += len(ids) - len(missing_ids)
+        self.misses += len(missing_ids)
+        if missing_ids:
+            generation = self._generation
+            rows = (await session.execute(select(*PUBLIC_COLUMNS).where(Item.id.in_(missing_ids)))).mappings()
+            loaded = [ItemPublic.model_validate(row) for row in rows]
+            for item in loaded:
+                items[item.id] = item
+            if generation == self._generation:
+                for item in loaded:
+                    self.put(item)
+        return [items[id] for id in ids if id in items]
+
+    async def get_item(self, session: AsyncSession, id: int) -> Optional[ItemPublic]:
+        items = await self.get_items(session, [id])
+        return items[0] if items else None
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
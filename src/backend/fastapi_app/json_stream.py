@@ -0,0 +1,109 @@
+import json
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from typing import Any, Optional, TextIO, TypeVar
+
+T = TypeVar("T")
+
+_decoder = json.JSONDecoder()
+
+
+def iter_json_array(f: TextIO, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Yield the elements of the JSON array in a file one at a time,
+    reading the file in chunks so that memory use is bounded by the largest element.
+    """
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        # Drop what has already been parsed before growing the buffer
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return not eof
+
+    def skip_whitespace() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                raise ValueError("Unexpected end of JSON array")
+
+    if skip_whitespace() != "[":
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    if skip_whitespace() == "]":
+        return
+    while True:
+        skip_whitespace()
+        while True:
+            try:
+                element, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The element continues past the end of the buffer
+                if not fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(buffer) and fill():
+                continue
+            break
+        pos = end
+        yield element
+        separator = skip_whitespace()
+        pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or ']' in JSON array, found {separator!r}")
+
+
+class JsonArrayWriter:
+    """Writes elements to a file as a JSON array one at a time, formatted the same way as json.dump."""
+
+    def __init__(self, f: TextIO, indent: Optional[int] = None):
+        self.f = f
+        self.indent = indent
+        self._prefix = "\n" + " " * indent if indent is not None else ""
+        self._count = 0
+        f.write("[")
+
+    def write(self, element: Any):
+        if self._count == 0:
+            self.f.write(self._prefix)
+        else:
+            self.f.write("," + self._prefix if self.indent is not None else ", ")
+        self.f.write(json.dumps(element, indent=self.indent).replace("\n", self._prefix))
+        self._count += 1
+
+    def close(self):
+        if self._count and self.indent is not None:
+            self.f.write("\n")
+        self.f.write("]")
+
+    def __enter__(self) -> "JsonArrayWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_json_array(f: TextIO, elements: Iterable[Any], indent: Optional[int] = None):
+    with JsonArrayWriter(f, indent) as writer:
+        for element in elements:
+            writer.write(element)
+
+
+def iter_batches(iterable: Iterable[T], batch_size: int) -> Iterator[list[T]]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
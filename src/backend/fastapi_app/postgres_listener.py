@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from collections.abc import Callable
+from typing import Any, Optional
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from fastapi_app.postgres_models import Item
+
+logger = logging.getLogger("ragapp")
+
+# Channel that the trigger created by setup_postgres_database.py notifies when rows of the items table change
+ITEMS_CHANGED_CHANNEL = f"{Item.__tablename__}_changed"
+
+
+class PostgresListener:
+    """
+    Holds a dedicated connection that LISTENs on a channel and calls back on every notification.
+    If the connection is lost, callbacks are called with a None payload, since notifications may have been missed,
+    and the listener reconnects.
+    """
+
+    def __init__(self, engine: AsyncEngine, channel: str = ITEMS_CHANGED_CHANNEL, reconnect_delay: float = 5.0):
+        self.engine = engine
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._callbacks: list[Callable[[Optional[str]], None]] = []
+        self._connection: Optional[AsyncConnection] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+
+    def add_callback(self, callback: Callable[[Optional[str]], None]):
+        self._callbacks.append(callback)
+
+    def _notify(self, payload: Optional[str]):
+        for callback in self._callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("Error in callback for Postgres notification on %s", self.channel)
+
+    def _on_notification(self, connection: Any, pid: int, channel: str, payload: str):
+        self._notify(payload)
+
+    def _on_termination(self, connection: Any):
+        logger.warning("Lost the connection listening on %s, reconnecting", self.channel)
+        self._notify(None)
+        self._connection = None
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while self._connection is None:
+            await asyncio.sleep(self.reconnect_delay)
+            try:
+                await self.start()
+            except Exception as e:
+                logger.warning("Could not reconnect to listen on %s: %s", self.channel, e)
+        # Anything may have changed while disconnected
+        self._notify(None)
+
+    async def start(self):
+        connection = await self.engine.connect()
+        raw_connection = await connection.get_raw_connection()
+        driver_connection = raw_connection.driver_connection
+        if driver_connection is None:
+            await connection.close()
+            raise RuntimeError("The Postgres connection was invalidated before it could listen")
+        await driver_connection.add_listener(self.channel, self._on_notification)
+        driver_connection.add_termination_listener(self._on_termination)
+        self._connection = connection
+        logger.info("Listening for Postgres notifications on %s", self.channel)
+
+    async def stop(self):
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            raw_connection = await connection.get_raw_connection()
+            driver_connection = raw_connection.driver_connection
+            if driver_connection is not None:
+                driver_connection.remove_termination_listener(self._on_termination)
+                await driver_connection.remove_listener(self.channel, self._on_notification)
+            await connection.close()
+
+
+def parse_changed_ids(payload: Optional[str]) -> Optional[set[int]]:
+    """
+    Return the ids of the rows that changed according to a notification on ITEMS_CHANGED_CHANNEL,
+    or None if they are unknown and any row may have changed.
+    The payload is the operation followed by the ids, like "UPDATE:1,2,3", or only the operation
+    for TRUNCATE or when there are too many ids to fit in a notification.
+    """
+    if payload is None:
+        return None
+    _, separator, ids = payload.partition(":")
+    if not separator:
+        return None
+    return {int(id) for id in ids.split(",")}
@@ -1,7 +1,11 @@
 from __future__ import annotations
 
-from pgvector.sqlalchemy import Vector
-from sqlalchemy import Index
+import hashlib
+from typing import NamedTuple, cast
+
+from pgvector.sqlalchemy import BIT, HALFVEC, Vector
+from sqlalchemy import Column, Computed, ForeignKey, Index, MetaData, Table
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 
@@ -21,15 +25,35 @@ class Item(Base):
     # Embeddings for different models:
     embedding_3l: Mapped[Vector] = mapped_column(Vector(1024), nullable=True)  # text-embedding-3-large
     embedding_nomic: Mapped[Vector] = mapped_column(Vector(768), nullable=True)  # nomic-embed-text
+    # First dimensions of embedding_3l scaled back to unit length, for a smaller index (see TRUNCATED_EMBEDDINGS):
+    embedding_3l_256: Mapped[Vector] = mapped_column(Vector(256), nullable=True)
+    # Hash of the text each embedding column was computed from, keyed by column name:
+    embedding_hashes: Mapped[dict[str, str]] = mapped_column(JSONB, nullable=True)
+    # Full-text search document, maintained by Postgres whenever a row is written:
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(
+            "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(brand, '')), 'B') || "
+            "setweight(to_tsvector('english', coalesce(type, '')), 'B') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'C')",
+            persisted=True,
+        ),
+    )
 
     def to_dict(self, include_embedding: bool = False):
-        model_dict = {column.name: getattr(self, column.name) for column in self.__table__.columns}
+        model_dict = {
+            column.name: getattr(self, column.name) for column in self.__table__.columns if column.computed is None
+        }
         if include_embedding:
             model_dict["embedding_3l"] = model_dict.get("embedding_3l", [])
             model_dict["embedding_nomic"] = model_dict.get("embedding_nomic", [])
         else:
             del model_dict["embedding_3l"]
             del model_dict["embedding_nomic"]
+        del model_dict["embedding_hashes"]
+        # Computed from embedding_3l by the app whenever it writes embedding_3l
+        del model_dict["embedding_3l_256"]
         return model_dict
 
     def to_str_for_rag(self):
@@ -38,6 +62,30 @@ class Item(Base):
     def to_str_for_embedding(self):
         return f"Name: {self.name} Description: {self.description} Type: {self.type}"
 
+    def hash_for_embedding(self):
+        return hashlib.sha256(self.to_str_for_embedding().encode("utf-8")).hexdigest()
+
+
+def embedding_dimensions(column_name: str) -> int:
+    """Number of dimensions of a vector column of the items table."""
+    dimensions = cast(Vector, Item.__table__.c[column_name].type).dim
+    if dimensions is None:
+        raise ValueError(f"The column {column_name} has no fixed number of dimensions")
+    return dimensions
+
+
+class ItemNeighbor(Base):
+    """Nearest neighbors of each item by an embedding column, precomputed by update_item_neighbors.py."""
+
+    __tablename__ = "item_neighbors"
+    embedding_column: Mapped[str] = mapped_column(primary_key=True)
+    item_id: Mapped[int] = mapped_column(ForeignKey("items.id", ondelete="CASCADE"), primary_key=True)
+    rank: Mapped[int] = mapped_column(primary_key=True)
+    neighbor_id: Mapped[int] = mapped_column(ForeignKey("items.id", ondelete="CASCADE"))
+    distance: Mapped[float] = mapped_column()
+    # The item's embedding hash when its neighbors were computed, to find items whose embedding changed since:
+    embedding_hash: Mapped[str] = mapped_column(nullable=True)
+
 
 """
 **Define HNSW index to support vector similarity search**
@@ -47,22 +95,186 @@ We use the vector_cosine_ops access method (cosine distance)
 If you know your embeddings are normalized,
  you can switch to inner product for potentially better performance.
 The index operator should match the operator used in queries.
+The type and build parameters of these indexes can be changed per deployment,
+ with setup_postgres_database.py --vector-index (see VectorIndexSpec).
 """
 
 table_name = Item.__tablename__
 
+# Index type: build parameters it accepts
+VECTOR_INDEX_METHODS = {"hnsw": ("m", "ef_construction"), "ivfflat": ("lists",)}
+
+
+class VectorIndexSpec(NamedTuple):
+    """Type and build parameters of a vector index, written like hnsw:m=16,ef_construction=64 or ivfflat:lists=100."""
+
+    method: str
+    parameters: dict[str, int]
+
+    @classmethod
+    def parse(cls, spec: str) -> VectorIndexSpec:
+        method, _, parameters = spec.strip().partition(":")
+        if method not in VECTOR_INDEX_METHODS:
+            raise ValueError(f"Unsupported vector index type: {method}")
+        parsed_parameters = {}
+        for parameter in filter(None, parameters.split(",")):
+            name, _, value = parameter.partition("=")
+            name = name.strip()
+            if name not in VECTOR_INDEX_METHODS[method]:
+                raise ValueError(f"Unsupported {method} index parameter: {name}")
+            if not value.strip().isdigit() or int(value) == 0:
+                raise ValueError(f"The {method} index parameter {name} must be a positive integer")
+            parsed_parameters[name] = int(value)
+        return cls(method, parsed_parameters)
+
+    def __str__(self) -> str:
+        if not self.parameters:
+            return self.method
+        return f"{self.method}:" + ",".join(f"{name}={value}" for name, value in self.parameters.items())
+
+    def index_name(self, table_name: str, column_name: str) -> str:
+        return f"{self.method}_index_for_cosine_{table_name}_{column_name}"
+
+    def create_index_sql(self, table_name: str, column_name: str, schema: str | None = None) -> str:
+        """The index is created in the schema of its table, which defaults to the search path."""
+        with_clause = ", ".join(f"{name} = {value}" for name, value in self.parameters.items())
+        qualified_table_name = f"{schema}.{table_name}" if schema else table_name
+        return (
+            f"CREATE INDEX {self.index_name(table_name, column_name)} ON {qualified_table_name} "
+            f"USING {self.method} ({column_name} vector_cosine_ops)" + (f" WITH ({with_clause})" if with_clause else "")
+        )
+
+
+DEFAULT_VECTOR_INDEX = VectorIndexSpec("hnsw", {"m": 16, "ef_construction": 64})
+
 index_3l = Index(
-    f"hnsw_index_for_cosine_{table_name}_embedding_3l",
+    DEFAULT_VECTOR_INDEX.index_name(table_name, "embedding_3l"),
     Item.embedding_3l,
-    postgresql_using="hnsw",
-    postgresql_with={"m": 16, "ef_construction": 64},
+    postgresql_using=DEFAULT_VECTOR_INDEX.method,
+    postgresql_with=DEFAULT_VECTOR_INDEX.parameters,
     postgresql_ops={"embedding_3l": "vector_cosine_ops"},
 )
 
 index_nomic = Index(
-    f"hnsw_index_for_cosine_{table_name}_embedding_nomic",
+    DEFAULT_VECTOR_INDEX.index_name(table_name, "embedding_nomic"),
     Item.embedding_nomic,
+    postgresql_using=DEFAULT_VECTOR_INDEX.method,
+    postgresql_with=DEFAULT_VECTOR_INDEX.parameters,
+    postgresql_ops={"embedding_nomic": "vector_cosine_ops"},
+)
+
+"""
+**Define HNSW index over truncated embeddings for two-stage vector search**
+
+text-embedding-3 models are trained so that the first dimensions of an embedding,
+ scaled back to unit length, are an embedding on their own (Matryoshka representation learning).
+update_embeddings.py and seeding fill the truncated column from the full embedding without calling the API.
+Unlike the quantized columns, it is a plain column that only this app's code keeps in sync,
+ since truncating and normalizing in SQL requires pgvector 0.7+: other writes to the full embedding leave it stale,
+ unless they also set it to NULL, which the next update_embeddings.py run fills again.
+Its index is a quarter of the size of the full embedding's index and faster to traverse,
+ and searches rescore its candidates with the full embedding to keep the recall.
+"""
+
+# Full embedding column: column of its truncated embeddings
+TRUNCATED_EMBEDDINGS = {"embedding_3l": "embedding_3l_256"}
+
+index_3l_256 = Index(
+    f"hnsw_index_for_cosine_{table_name}_embedding_3l_256",
+    Item.embedding_3l_256,
     postgresql_using="hnsw",
     postgresql_with={"m": 16, "ef_construction": 64},
-    postgresql_ops={"embedding_nomic": "vector_cosine_ops"},
+    postgresql_ops={"embedding_3l_256": "vector_cosine_ops"},
+)
+
+"""
+**Define GIN index to support full-text search**
+
+The search_vector column is a stored generated column,
+ so queries can match and rank against it without calling to_tsvector per row.
+"""
+
+index_search_vector = Index(
+    f"gin_index_for_fulltext_{table_name}_search_vector",
+    Item.search_vector,
+    postgresql_using="gin",
 )
+
+"""
+**Define B-tree indexes to support filtered search**
+
+The query rewriter can filter on these columns,
+ so the planner can use these indexes for selective filters
+ instead of scanning the whole table.
+"""
+
+index_brand = Index(f"btree_index_{table_name}_brand", Item.brand)
+
+index_type = Index(f"btree_index_{table_name}_type", Item.type)
+
+index_price = Index(f"btree_index_{table_name}_price", Item.price)
+
+"""
+**Define B-tree index to find the items that have a given item as a neighbor**
+
+The primary key serves lookups of an item's neighbors,
+ and this index serves incremental refreshes of the neighbors of items whose embedding changed.
+"""
+
+index_neighbor_id = Index(
+    f"btree_index_{ItemNeighbor.__tablename__}_neighbor_id", ItemNeighbor.embedding_column, ItemNeighbor.neighbor_id
+)
+
+"""
+**Define quantized embedding columns and HNSW indexes for two-stage vector search**
+
+These are optional, as halfvec and bit vectors require pgvector 0.7+,
+ so they are not part of the Item model: setup_postgres_database.py --quantized-embeddings adds them.
+Each is a stored generated column computed from a full-precision embedding column,
+ so Postgres keeps it up to date whenever update_embeddings.py or seeding writes an embedding.
+Half-precision vectors halve the size of the HNSW index, and binary quantized vectors,
+ one bit per dimension compared by Hamming distance, make it 32 times smaller.
+Searches lose some recall on these indexes, which two-stage search recovers
+ by rescoring a larger pool of their candidates with the full-precision embeddings.
+"""
+
+# Quantization: SQL expression converting a full-precision vector, distance operator, HNSW operator class
+QUANTIZATIONS = {
+    "halfvec": ("CAST({vector} AS halfvec({dimensions}))", "<=>", "halfvec_cosine_ops"),
+    "binary": ("CAST(binary_quantize({vector}) AS bit({dimensions}))", "<~>", "bit_hamming_ops"),
+}
+
+
+def quantized_column_name(embedding_column: str, quantization: str) -> str:
+    return f"{embedding_column}_{quantization}"
+
+
+def quantize_expression(vector: str, quantization: str, dimensions: int) -> str:
+    """SQL expression converting the full-precision vector expression to the given quantization."""
+    return QUANTIZATIONS[quantization][0].format(vector=vector, dimensions=dimensions)
+
+
+quantized_items = Table(table_name, MetaData())
+quantized_indexes: list[Index] = []
+for embedding in (Item.__table__.c.embedding_3l, Item.__table__.c.embedding_nomic):
+    for quantization, (_, _, operator_class) in QUANTIZATIONS.items():
+        quantized_column = Column(
+            quantized_column_name(embedding.name, quantization),
+            HALFVEC(embedding_dimensions(embedding.name))
+            if quantization == "halfvec"
+            else BIT(embedding_dimensions(embedding.name)),
+            Computed(
+                quantize_expression(embedding.name, quantization, embedding_dimensions(embedding.name)), persisted=True
+            ),
+        )
+        quantized_items.append_column(quantized_column)
+        distance = "cosine" if quantization == "halfvec" else "hamming"
+        quantized_indexes.append(
+            Index(
+                f"hnsw_index_for_{distance}_{table_name}_{quantized_column.name}",
+                quantized_column,
+                postgresql_using="hnsw",
+                postgresql_with={"m": 16, "ef_construction": 64},
+                postgresql_ops={quantized_column.name: operator_class},
+            )
+        )
@@ -1,13 +1,61 @@
-from typing import Optional, Union
+import asyncio
+from collections.abc import Sequence
+from typing import Any, Optional, Union
 
 import numpy as np
 from openai import AsyncAzureOpenAI, AsyncOpenAI
-from sqlalchemy import Float, Integer, column, select, text
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from fastapi_app.api_models import Filter
-from fastapi_app.embeddings import compute_text_embedding
-from fastapi_app.postgres_models import Item
+from fastapi_app.api_models import Filter, Fusion, FusionMethod, ItemPublic, SearchEffort, SearchQuery
+from fastapi_app.caching import AsyncLRUCache
+from fastapi_app.embeddings import (
+    EmbeddingCacheKey,
+    compute_text_embedding,
+    compute_text_embeddings,
+    embedding_cache_key,
+)
+from fastapi_app.fusion import RankedCandidates, fuse_rankings
+from fastapi_app.item_cache import PUBLIC_COLUMNS, ItemCache
+from fastapi_app.postgres_models import (
+    DEFAULT_VECTOR_INDEX,
+    QUANTIZATIONS,
+    TRUNCATED_EMBEDDINGS,
+    Item,
+    VectorIndexSpec,
+    embedding_dimensions,
+    quantize_expression,
+    quantized_column_name,
+)
+from fastapi_app.reranker import Reranker, rerank
+from fastapi_app.semantic_cache import SemanticSearchCache
+
+HNSW_ITERATIVE_SCAN_MODES = ("off", "strict_order", "relaxed_order")
+
+# How hybrid searches run: both legs in one statement fused in SQL,
+# or each leg on its own connection at the same time, fused in Python
+HYBRID_EXECUTION_MODES = ("statement", "concurrent")
+
+# How the vector search reads the index: on the full-precision embeddings, or in two stages,
+# on the quantized or truncated (matryoshka) embeddings and then rescoring with the full-precision embeddings
+VECTOR_SEARCH_MODES = ("full", *QUANTIZATIONS, "matryoshka")
+
+# Size of the dynamic candidate list for HNSW queries, 40 is the pgvector default
+HNSW_EF_SEARCH = {
+    SearchEffort.LOW: 20,
+    SearchEffort.MEDIUM: 40,
+    SearchEffort.HIGH: 100,
+}
+
+# Multiple of the square root of the number of lists that IVFFlat queries probe, which pgvector suggests as a start
+IVFFLAT_PROBES_FACTOR = {
+    SearchEffort.LOW: 0.5,
+    SearchEffort.MEDIUM: 1,
+    SearchEffort.HIGH: 2,
+}
+
+# Number of lists of IVFFlat indexes built without the lists parameter
+IVFFLAT_DEFAULT_LISTS = 100
 
 
 class PostgresSearcher:
@@ -19,49 +67,166 @@ class PostgresSearcher:
         embed_model: str,
         embed_dimensions: Optional[int],
         embedding_column: str,
+        candidate_pool: int = 20,
+        iterative_scan: Optional[str] = None,  # Requires pgvector 0.8+
+        default_search_effort: Optional[SearchEffort] = None,  # None uses the server's hnsw.ef_search with HNSW
+        embedding_cache: Optional[AsyncLRUCache[EmbeddingCacheKey, list[float]]] = None,
+        semantic_cache: Optional[SemanticSearchCache[list[ItemPublic]]] = None,
+        item_cache: Optional[ItemCache] = None,
+        hybrid_execution: str = "statement",
+        sessionmaker: Optional[async_sessionmaker[AsyncSession]] = None,  # Required for concurrent hybrid execution
+        reranker: Optional[Reranker] = None,
+        rerank_candidates: int = 20,
+        rerank_timeout: float = 0.5,  # Seconds
+        vector_search_mode: str = "full",  # Quantized modes require pgvector 0.7+ and the quantized columns
+        coarse_candidates: int = 100,  # Candidates of the first stage of two-stage search that are rescored
+        vector_index: VectorIndexSpec = DEFAULT_VECTOR_INDEX,  # As set up by setup_postgres_database.py
     ):
+        if iterative_scan not in (None, *HNSW_ITERATIVE_SCAN_MODES):
+            raise ValueError(f"Unsupported HNSW iterative scan mode: {iterative_scan}")
+        if hybrid_execution not in HYBRID_EXECUTION_MODES:
+            raise ValueError(f"Unsupported hybrid execution mode: {hybrid_execution}")
+        if hybrid_execution == "concurrent" and sessionmaker is None:
+            raise ValueError("Concurrent hybrid execution requires a sessionmaker for the second connection")
+        if vector_search_mode not in VECTOR_SEARCH_MODES:
+            raise ValueError(f"Unsupported vector search mode: {vector_search_mode}")
+        if vector_search_mode == "matryoshka" and embedding_column not in TRUNCATED_EMBEDDINGS:
+            raise ValueError(f"Column {embedding_column} has no truncated embeddings for matryoshka vector search")
         self.db_session = db_session
         self.openai_embed_client = openai_embed_client
         self.embed_model = embed_model
         self.embed_deployment = embed_deployment
         self.embed_dimensions = embed_dimensions
         self.embedding_column = embedding_column
+        self.candidate_pool = candidate_pool
+        self.iterative_scan = iterative_scan
+        self.default_search_effort = default_search_effort
+        self.embedding_cache = embedding_cache
+        self.semantic_cache = semantic_cache
+        self.item_cache = item_cache
+        self.hybrid_execution = hybrid_execution
+        self.sessionmaker = sessionmaker
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.rerank_timeout = rerank_timeout
+        self.vector_search_mode = vector_search_mode
+        self.coarse_candidates = coarse_candidates
+        self.vector_index = vector_index
 
-    def build_filter_clause(self, filters: Optional[list[Filter]]) -> tuple[str, str]:
+    def build_filter_clause(self, filters: Optional[Sequence[Filter]]) -> tuple[str, str]:
         if filters is None:
             return "", ""
         filter_clauses = []
         for filter in filters:
-            filter_value = f"'{filter.value}'" if isinstance(filter.value, str) else filter.value
+            if isinstance(filter.value, str):
+                # Quotes are doubled so that a string value can't end the literal early
+                filter_value = "'" + filter.value.replace("'", "''") + "'"
+            else:
+                filter_value = filter.value
             filter_clauses.append(f"{filter.column} {filter.comparison_operator} {filter_value}")
         filter_clause = " AND ".join(filter_clauses)
         if len(filter_clause) > 0:
             return f"WHERE {filter_clause}", f"AND {filter_clause}"
         return "", ""
 
-    async def search(
-        self,
-        query_text: Optional[str],
-        query_vector: list[float],
-        top: int = 5,
-        filters: Optional[list[Filter]] = None,
-    ):
+    def build_index_settings(
+        self, has_vector: bool, has_filters: bool, candidates: int, search_effort: Optional[SearchEffort]
+    ) -> dict[str, str]:
+        search_effort = search_effort or self.default_search_effort
+        index_settings: dict[str, str] = {}
+        if has_vector and self.vector_search_mode == "full" and self.vector_index.method == "ivfflat":
+            # IVFFlat queries only read ivfflat.probes lists, 1 by default, which loses much of the recall,
+            # so the search effort applies even without a default
+            lists = self.vector_index.parameters.get("lists", IVFFLAT_DEFAULT_LISTS)
+            probes = round(lists**0.5 * IVFFLAT_PROBES_FACTOR[search_effort or SearchEffort.MEDIUM])
+            index_settings["ivfflat.probes"] = str(min(max(probes, 1), lists))
+        elif has_vector:
+            ef_search = HNSW_EF_SEARCH[search_effort] if search_effort else None
+            if self.vector_search_mode != "full":
+                # Two-stage search reads a larger pool of candidates from the index, to rescore them
+                candidates = max(candidates, self.coarse_candidates)
+                ef_search = ef_search or candidates
+            if ef_search:
+                # ef_search smaller than the candidate pool would cap the number of rows returned
+                index_settings["hnsw.ef_search"] = str(max(ef_search, candidates))
+            if has_filters and self.iterative_scan not in (None, "off"):
+                # Keep scanning the HNSW index until enough rows pass the filters,
+                # instead of filtering a fixed-size set of nearest neighbors
+                index_settings["hnsw.iterative_scan"] = self.iterative_scan
+        return index_settings
+
+    async def apply_index_settings(self, settings: dict[str, str]):
+        """
+        Set index query parameters for the rest of the current transaction in a single round trip.
+        """
+        if not settings:
+            return
+        set_configs = ", ".join(f"set_config('{name}', :setting_{i}, true)" for i, name in enumerate(settings))
+        await self.db_session.execute(
+            text(f"SELECT {set_configs}"),
+            {f"setting_{i}": value for i, value in enumerate(settings.values())},
+        )
+
+    def build_coarse_distance(self, embedding: str) -> str:
+        """Build the distance that orders the first stage of a two-stage vector search, using a smaller index."""
+        if self.vector_search_mode == "matryoshka":
+            truncated_column = TRUNCATED_EMBEDDINGS[self.embedding_column]
+            dimensions = embedding_dimensions(truncated_column)
+            # Cosine distance doesn't depend on the length of the vectors, so the query needn't be re-normalized
+            truncated_embedding = f"CAST((CAST(CAST({embedding} AS vector) AS real[]))[1:{dimensions}] AS vector)"
+            return f"{truncated_column} <=> {truncated_embedding}"
+        quantized_embedding = quantize_expression(
+            f"CAST({embedding} AS vector)",
+            self.vector_search_mode,
+            embedding_dimensions(self.embedding_column),
+        )
+        quantized_column = quantized_column_name(self.embedding_column, self.vector_search_mode)
+        distance_operator = QUANTIZATIONS[self.vector_search_mode][1]
+        return f"{quantized_column} {distance_operator} {quantized_embedding}"
+
+    def build_ranking_query(
+        self, query_text: Optional[str], has_vector: bool, filters: Optional[Sequence[Filter]], param_suffix: str = ""
+    ) -> tuple[str, str]:
+        """
+        Build a query ranking the ids of matching items, and the ORDER BY clause for its rows aliased as ranked.
+        The suffix is appended to the names of the query's parameters, so that several queries fit in one statement.
+        """
         filter_clause_where, filter_clause_and = self.build_filter_clause(filters)
         table_name = Item.__tablename__
-        vector_query = f"""
-            SELECT id, RANK () OVER (ORDER BY {self.embedding_column} <=> :embedding) AS rank
+        embedding = f":embedding{param_suffix}"
+        candidates = f":candidates{param_suffix}"
+        if self.vector_search_mode == "full":
+            vector_query = f"""
+            SELECT id, RANK () OVER (ORDER BY {self.embedding_column} <=> {embedding}) AS rank,
+                {self.embedding_column} <=> {embedding} AS distance
                 FROM {table_name}
                 {filter_clause_where}
-                ORDER BY {self.embedding_column} <=> :embedding
-                LIMIT 20
+                ORDER BY {self.embedding_column} <=> {embedding}
+                LIMIT {candidates}
+            """
+        else:
+            # Find a larger pool of candidates with a smaller index,
+            # then rank them by their distance to the full-precision embeddings
+            vector_query = f"""
+            SELECT id, RANK () OVER (ORDER BY distance) AS rank, distance
+                FROM (
+                    SELECT id, {self.embedding_column} <=> {embedding} AS distance
+                    FROM {table_name}
+                    {filter_clause_where}
+                    ORDER BY {self.build_coarse_distance(embedding)}
+                    LIMIT GREATEST({candidates}, {int(self.coarse_candidates)})
+                ) AS coarse_search
+                ORDER BY distance
+                LIMIT {candidates}
             """
 
         fulltext_query = f"""
-            SELECT id, RANK () OVER (ORDER BY ts_rank_cd(to_tsvector('english', description), query) DESC)
-                FROM {table_name}, plainto_tsquery('english', :query) query
-                WHERE to_tsvector('english', description) @@ query {filter_clause_and}
-                ORDER BY ts_rank_cd(to_tsvector('english', description), query) DESC
-                LIMIT 20
+            SELECT id, RANK () OVER (ORDER BY ts_rank_cd(search_vector, query) DESC),
+                ts_rank_cd(search_vector, query) AS text_score
+                FROM {table_name}, plainto_tsquery('english', :query{param_suffix}) query
+                WHERE search_vector @@ query {filter_clause_and}
+                ORDER BY ts_rank_cd(search_vector, query) DESC
+                LIMIT {candidates}
             """
 
         hybrid_query = f"""
@@ -78,31 +243,263 @@ class PostgresSearcher:
         FROM vector_search
         FULL OUTER JOIN fulltext_search ON vector_search.id = fulltext_search.id
         ORDER BY score DESC
-        LIMIT 20
+        LIMIT {candidates}
         """
 
-        if query_text is not None and len(query_vector) > 0:
-            sql = text(hybrid_query).columns(column("id", Integer), column("score", Float))
-        elif len(query_vector) > 0:
-            sql = text(vector_query).columns(column("id", Integer), column("rank", Integer))
+        if query_text is not None and has_vector:
+            return hybrid_query, "ranked.score DESC"
+        elif has_vector:
+            return vector_query, "ranked.rank"
         elif query_text is not None:
-            sql = text(fulltext_query).columns(column("id", Integer), column("rank", Integer))
+            return fulltext_query, "ranked.rank"
+        raise ValueError("Both query text and query vector are empty")
+
+    async def search(
+        self,
+        query_text: Optional[str],
+        query_vector: list[float],
+        top: int = 5,
+        filters: Optional[list[Filter]] = None,
+        search_effort: Optional[SearchEffort] = None,
+        fusion: Optional[Fusion] = None,
+    ) -> list[ItemPublic]:
+        candidates = max(self.candidate_pool, top)
+        await self.apply_index_settings(
+            self.build_index_settings(len(query_vector) > 0, bool(filters), candidates, search_effort)
+        )
+        fusion = fusion or Fusion()
+        # Rank fusion runs in SQL, unless the searches run separately or the fusion needs their scores
+        if (
+            query_text is not None
+            and len(query_vector) > 0
+            and (self.hybrid_execution == "concurrent" or fusion.method != FusionMethod.RRF)
+        ):
+            vector_candidates, fulltext_candidates = await self.search_hybrid_candidates(
+                query_text, query_vector, filters, candidates
+            )
+            ids = fuse_rankings(vector_candidates, fulltext_candidates, fusion)
+            return await self.load_items(ids[:top])
+        ranking_query, order_by = self.build_ranking_query(query_text, len(query_vector) > 0, filters)
+        params = {
+            "embedding": np.array(query_vector),
+            "query": query_text,
+            "k": fusion.k,
+            "top": top,
+            "candidates": candidates,
+        }
+        if self.item_cache is not None:
+            # Only rank in the database, cached items don't need to be read again
+            sql = f"SELECT ranked.id FROM ({ranking_query}) AS ranked ORDER BY {order_by} LIMIT :top"
+            ids = (await self.db_session.scalars(text(sql), params)).all()
+            return await self.item_cache.get_items(self.db_session, ids)
+
+        # Join the ranked ids back to the table so that rows come back hydrated and ordered in one round trip
+        table_name = Item.__tablename__
+        public_columns = ", ".join(f"{table_name}.{column}" for column in ItemPublic.model_fields)
+        sql = f"""
+        SELECT {public_columns}
+        FROM ({ranking_query}) AS ranked
+        JOIN {table_name} ON {table_name}.id = ranked.id
+        ORDER BY {order_by}
+        LIMIT :top
+        """
+        rows = (await self.db_session.execute(text(sql), params)).mappings()
+        return [ItemPublic.model_validate(row) for row in rows]
+
+    async def search_hybrid_candidates(
+        self, query_text: str, query_vector: list[float], filters: Optional[list[Filter]], candidates: int
+    ) -> tuple[RankedCandidates, RankedCandidates]:
+        """
+        Run the vector and full-text searches of a hybrid search without fusing them, returning the candidates of each.
+        In concurrent execution mode, the full-text search runs on a second pooled connection
+        at the same time as the vector search, otherwise both run in one statement.
+        """
+        vector_query, _ = self.build_ranking_query(None, True, filters)
+        fulltext_query, _ = self.build_ranking_query(query_text, False, filters)
+        # Cosine similarity, so that higher scores are better for both searches
+        vector_candidates = f"SELECT id, rank, 1 - distance AS score FROM ({vector_query}) AS vector_search"
+        fulltext_candidates = f"SELECT id, rank, text_score AS score FROM ({fulltext_query}) AS fulltext_search"
+        params = {"embedding": np.array(query_vector), "query": query_text, "candidates": candidates}
+
+        vector_rows: Sequence[Any]
+        fulltext_rows: Sequence[Any]
+        if self.hybrid_execution == "concurrent":
+
+            async def run_fulltext_search() -> Sequence[Any]:
+                assert self.sessionmaker is not None
+                async with self.sessionmaker() as session:
+                    return (await session.execute(text(fulltext_candidates), params)).all()
+
+            async def run_vector_search() -> Sequence[Any]:
+                # Index settings were applied to this session's transaction
+                return (await self.db_session.execute(text(vector_candidates), params)).all()
+
+            vector_rows, fulltext_rows = await asyncio.gather(run_vector_search(), run_fulltext_search())
         else:
-            raise ValueError("Both query text and query vector are empty")
+            sql = f"""
+            SELECT 'vector' AS search, * FROM ({vector_candidates}) AS vector_candidates
+            UNION ALL
+            SELECT 'fulltext' AS search, * FROM ({fulltext_candidates}) AS fulltext_candidates
+            ORDER BY search, rank
+            """
+            rows = (await self.db_session.execute(text(sql), params)).all()
+            vector_rows = [row for row in rows if row.search == "vector"]
+            fulltext_rows = [row for row in rows if row.search == "fulltext"]
+        return (
+            RankedCandidates(
+                ids=[row.id for row in vector_rows],
+                ranks=[row.rank for row in vector_rows],
+                # Items without an embedding have no distance, so they get the lowest cosine similarity
+                scores=[row.score if row.score is not None else -1.0 for row in vector_rows],
+            ),
+            RankedCandidates(
+                ids=[row.id for row in fulltext_rows],
+                ranks=[row.rank for row in fulltext_rows],
+                scores=[row.score for row in fulltext_rows],
+            ),
+        )
+
+    async def load_items(self, ids: Sequence[int]) -> list[ItemPublic]:
+        """Return the items with the given ids in the same order."""
+        if self.item_cache is not None:
+            return await self.item_cache.get_items(self.db_session, ids)
+        rows = (await self.db_session.execute(select(*PUBLIC_COLUMNS).where(Item.id.in_(ids)))).mappings()
+        items = {item.id: item for item in (ItemPublic.model_validate(row) for row in rows)}
+        return [items[id] for id in ids if id in items]
+
+    async def search_batch(
+        self, queries: list[SearchQuery], search_effort: Optional[SearchEffort] = None
+    ) -> list[list[ItemPublic]]:
+        """
+        Search for many queries with one embeddings request and one statement,
+        returning the results of each query in the same order as the queries.
+        Queries with neither vector nor text search enabled have no results.
+        """
+        vector_queries = [query.query for query in queries if query.enable_vector_search]
+        embeddings = iter(await self.embed_queries(vector_queries))
+        vectors = [next(embeddings) if query.enable_vector_search else [] for query in queries]
+
+        branches = []
+        params: dict[str, Any] = {"k": 60}
+        for i, (query, vector) in enumerate(zip(queries, vectors)):
+            query_text = query.query if query.enable_text_search else None
+            if query_text is None and len(vector) == 0:
+                continue
+            ranking_query, order_by = self.build_ranking_query(query_text, len(vector) > 0, query.filters, f"_{i}")
+            # Each query keeps its own ranking, numbered so that the union can be put back in order
+            branches.append(f"""(
+            SELECT {i} AS query_index, ranked.id, row_number() OVER (ORDER BY {order_by}) AS position
+            FROM ({ranking_query}) AS ranked
+            ORDER BY position
+            LIMIT :top_{i}
+            )""")
+            params |= {
+                f"embedding_{i}": np.array(vector),
+                f"query_{i}": query_text,
+                f"top_{i}": query.top,
+                f"candidates_{i}": max(self.candidate_pool, query.top),
+            }
+        results: list[list[ItemPublic]] = [[] for _ in queries]
+        if not branches:
+            return results
 
-        results = (
-            await self.db_session.execute(
-                sql,
-                {"embedding": np.array(query_vector), "query": query_text, "k": 60},
+        # Index settings apply to the whole statement, so they are chosen for the most demanding query
+        await self.apply_index_settings(
+            self.build_index_settings(
+                any(len(vector) > 0 for vector in vectors),
+                any(query.filters for query in queries),
+                max(self.candidate_pool, *(query.top for query in queries)),
+                search_effort,
             )
-        ).fetchall()
+        )
+        ranked_union = " UNION ALL ".join(branches)
+        table_name = Item.__tablename__
+        if self.item_cache is not None:
+            sql = f"SELECT batch.query_index, batch.id FROM ({ranked_union}) AS batch ORDER BY query_index, position"
+            rows = (await self.db_session.execute(text(sql), params)).all()
+            items = {
+                item.id: item
+                for item in await self.item_cache.get_items(self.db_session, list(dict.fromkeys(id for _, id in rows)))
+            }
+            for query_index, id in rows:
+                if id in items:
+                    results[query_index].append(items[id])
+            return results
 
-        # Convert results to SQLAlchemy models
-        row_models = []
-        for id, _ in results[:top]:
-            item = await self.db_session.execute(select(Item).where(Item.id == id))
-            row_models.append(item.scalar())
-        return row_models
+        public_columns = ", ".join(f"{table_name}.{column}" for column in ItemPublic.model_fields)
+        sql = f"""
+        SELECT batch.query_index, {public_columns}
+        FROM ({ranked_union}) AS batch
+        JOIN {table_name} ON {table_name}.id = batch.id
+        ORDER BY batch.query_index, batch.position
+        """
+        for row in (await self.db_session.execute(text(sql), params)).mappings():
+            results[row["query_index"]].append(ItemPublic.model_validate(row))
+        return results
+
+    async def embed_query(self, query_text: str) -> list[float]:
+        return await compute_text_embedding(
+            query_text,
+            self.openai_embed_client,
+            self.embed_model,
+            self.embed_deployment,
+            self.embed_dimensions,
+            cache=self.embedding_cache,
+        )
+
+    async def embed_queries(self, query_texts: list[str]) -> list[list[float]]:
+        """
+        Embed many queries in as few embeddings requests as the API limits allow, reusing cached embeddings.
+        Queries that only differ in case or whitespace are embedded once.
+        """
+        keys = [
+            embedding_cache_key(query_text, self.embed_model, self.embed_deployment, self.embed_dimensions)
+            for query_text in query_texts
+        ]
+        embeddings: dict[EmbeddingCacheKey, list[float]] = {}
+        if self.embedding_cache is not None:
+            embeddings = self.embedding_cache.get_many(keys)
+        missing: dict[EmbeddingCacheKey, str] = {}
+        for key, query_text in zip(keys, query_texts):
+            if key not in embeddings:
+                missing.setdefault(key, query_text)
+        if missing:
+            computed = await compute_text_embeddings(
+                list(missing.values()),
+                self.openai_embed_client,
+                self.embed_model,
+                self.embed_deployment,
+                self.embed_dimensions,
+            )
+            for key, embedding in zip(missing, computed):
+                embeddings[key] = embedding
+                if self.embedding_cache is not None:
+                    self.embedding_cache.set(key, embedding)
+        return [embeddings[key] for key in keys]
+
+    async def search_and_rerank(
+        self,
+        rerank_query: str,
+        query_text: Optional[str],
+        query_vector: list[float],
+        top: int,
+        filters: Optional[list[Filter]],
+        search_effort: Optional[SearchEffort],
+        fusion: Optional[Fusion],
+    ) -> tuple[list[ItemPublic], bool]:
+        """
+        Search, and with a reranker, rerank a larger pool of candidates against the query to pick the top ones.
+        Returns the results, and False if they are in search order because the reranker failed or timed out.
+        """
+        if self.reranker is None:
+            return await self.search(query_text, query_vector, top, filters, search_effort, fusion), True
+        candidates = await self.search(
+            query_text, query_vector, max(top, self.rerank_candidates), filters, search_effort, fusion
+        )
+        reranked = await rerank(self.reranker, rerank_query, candidates, top, self.rerank_timeout)
+        if reranked is None:
+            return candidates[:top], False
+        return reranked, True
 
     async def search_and_embed(
         self,
@@ -111,20 +508,42 @@ class PostgresSearcher:
         enable_vector_search: bool = False,
         enable_text_search: bool = False,
         filters: Optional[list[Filter]] = None,
-    ) -> list[Item]:
+        search_effort: Optional[SearchEffort] = None,
+        query_vector: Optional[list[float]] = None,
+        fusion: Optional[Fusion] = None,
+    ) -> list[ItemPublic]:
         """
-        Search rows by query text. Optionally converts the query text to a vector if enable_vector_search is True.
+        Search rows by query text. Optionally converts the query text to a vector if enable_vector_search is True,
+        unless the query vector was already computed.
         """
+        rerank_query = query_text or ""
         vector: list[float] = []
         if enable_vector_search and query_text is not None:
-            vector = await compute_text_embedding(
-                query_text,
-                self.openai_embed_client,
-                self.embed_model,
-                self.embed_deployment,
-                self.embed_dimensions,
-            )
+            vector = query_vector if query_vector is not None else await self.embed_query(query_text)
         if not enable_text_search:
             query_text = None
 
-        return await self.search(query_text, vector, top, filters)
+        if self.semantic_cache is None or len(vector) == 0:
+            results, _ = await self.search_and_rerank(
+                rerank_query, query_text, vector, top, filters, search_effort, fusion
+            )
+            return results
+
+        # Paraphrased queries with the same filters and options can reuse the results of an earlier query
+        cache_key = (
+            tuple((filter.column, filter.comparison_operator, filter.value) for filter in filters or []),
+            top,
+            query_text is not None,
+            search_effort or self.default_search_effort,
+            fusion or Fusion(),
+        )
+        if (cached_results := self.semantic_cache.lookup(vector, cache_key)) is not None:
+            return cached_results
+        generation = self.semantic_cache.generation
+        results, reranked = await self.search_and_rerank(
+            rerank_query, query_text, vector, top, filters, search_effort, fusion
+        )
+        # Results that fell back to the search order aren't cached, so the next paraphrase is reranked
+        if reranked:
+            self.semantic_cache.store(vector, cache_key, results, generation)
+        return results
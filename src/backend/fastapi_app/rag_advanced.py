@@ -1,19 +1,20 @@
+import asyncio
+import hashlib
 import json
+import logging
 from collections.abc import AsyncGenerator
+from dataclasses import dataclass
 from typing import Optional
 
 from agents import (
-    Agent,
     ItemHelpers,
-    ModelSettings,
-    OpenAIResponsesModel,
     RawResponsesStreamEvent,
+    RunContextWrapper,
     Runner,
     ToolCallOutputItem,
     function_tool,
     set_tracing_disabled,
 )
-from openai import AsyncOpenAI
 from openai.types.responses import EasyInputMessageParam, ResponseInputItemParam, ResponseTextDeltaEvent
 
 from fastapi_app.api_models import (
@@ -28,15 +29,30 @@ from fastapi_app.api_models import (
     SearchResults,
     ThoughtStep,
 )
+from fastapi_app.caching import AsyncLRUCache
+from fastapi_app.embeddings import normalize_query_text
 from fastapi_app.postgres_searcher import PostgresSearcher
-from fastapi_app.rag_base import RAGChatBase
+from fastapi_app.rag_base import RAGAgents, RAGChatBase
 
 set_tracing_disabled(disabled=True)
 
+logger = logging.getLogger("ragapp")
+
+
+@dataclass(frozen=True)
+class QueryRewrite:
+    """Search arguments that the search agent generated for a conversation."""
+
+    search_query: str
+    price_filter: Optional[PriceFilter] = None
+    brand_filter: Optional[BrandFilter] = None
+
 
 class AdvancedRAGChat(RAGChatBase):
     query_prompt_template = open(RAGChatBase.prompts_dir / "query.txt").read()
-    query_fewshots = open(RAGChatBase.prompts_dir / "query_fewshots.json").read()
+    query_fewshots: list[ResponseInputItemParam] = json.loads(
+        open(RAGChatBase.prompts_dir / "query_fewshots.json").read()
+    )
 
     def __init__(
         self,
@@ -44,34 +60,26 @@ class AdvancedRAGChat(RAGChatBase):
         messages: list[ResponseInputItemParam],
         overrides: ChatRequestOverrides,
         searcher: PostgresSearcher,
-        openai_chat_client: AsyncOpenAI,
-        chat_model: str,
-        chat_deployment: Optional[str],  # Not needed for non-Azure OpenAI
+        agents: RAGAgents,
+        speculative_search: bool = False,
+        query_rewrite_cache: Optional[AsyncLRUCache[str, QueryRewrite]] = None,
     ):
         self.searcher = searcher
         self.chat_params = self.get_chat_params(messages, overrides)
-        self.model_for_thoughts = (
-            {"model": chat_model, "deployment": chat_deployment} if chat_deployment else {"model": chat_model}
-        )
-        openai_agents_model = OpenAIResponsesModel(
-            model=chat_model if chat_deployment is None else chat_deployment, openai_client=openai_chat_client
-        )
-        self.search_agent = Agent(
-            name="Searcher",
-            instructions=self.query_prompt_template,
-            tools=[function_tool(self.search_database)],
-            tool_use_behavior="stop_on_first_tool",
-            model=openai_agents_model,
-        )
-        self.answer_agent = Agent(
-            name="Answerer",
-            instructions=self.answer_prompt_template,
-            model=openai_agents_model,
-            model_settings=ModelSettings(
-                temperature=self.chat_params.temperature,
-                max_tokens=self.chat_params.response_token_limit,
-            ),
-        )
+        self.model_for_thoughts = agents.model_for_thoughts
+        self.search_agent = agents.search_agent
+        self.answer_agent = agents.answer_agent
+        self.speculative_search = speculative_search
+        self._speculative_search_task: Optional[asyncio.Task[list[ItemPublic]]] = None
+        self._speculative_search_in_database = False
+        self._speculative_search_discarded = False
+        self.used_speculative_search = False
+        self.query_rewrite_cache = query_rewrite_cache
+        self._query_rewrite: Optional[QueryRewrite] = None
+        self.used_query_rewrite_cache = False
+        # Set once the search arguments are final, before the search itself runs
+        self._search_arguments_ready = asyncio.Event()
+        self._search_results: Optional[SearchResults] = None
 
     async def search_database(
         self,
@@ -79,70 +87,170 @@ class AdvancedRAGChat(RAGChatBase):
         price_filter: Optional[PriceFilter] = None,
         brand_filter: Optional[BrandFilter] = None,
     ) -> SearchResults:
-        """
-        Search PostgreSQL database for relevant products based on user query
-
-        Args:
-            search_query: English query string to use for full text search, e.g. 'red shoes'.
-            price_filter: Filter search results based on price of the product
-            brand_filter: Filter search results based on brand of the product
-
-        Returns:
-            List of formatted items that match the search query and filters
-        """
+        self._query_rewrite = QueryRewrite(search_query, price_filter, brand_filter)
         # Only send non-None filters
         filters: list[Filter] = []
         if price_filter:
             filters.append(price_filter)
         if brand_filter:
             filters.append(brand_filter)
-        results = await self.searcher.search_and_embed(
-            search_query,
+        results = None
+        if not filters and normalize_query_text(search_query) == normalize_query_text(
+            self.chat_params.original_user_query
+        ):
+            results = await self.take_speculative_search()
+        else:
+            await self.discard_speculative_search()
+        self._search_arguments_ready.set()
+        if results is None:
+            results = await self.searcher.search_and_embed(
+                search_query,
+                top=self.chat_params.top,
+                enable_vector_search=self.chat_params.enable_vector_search,
+                enable_text_search=self.chat_params.enable_text_search,
+                search_effort=self.chat_params.search_effort,
+                fusion=self.chat_params.fusion,
+                filters=filters,
+            )
+        return SearchResults(query=search_query, items=results, filters=filters)
+
+    async def search_speculatively(self) -> list[ItemPublic]:
+        query_text = self.chat_params.original_user_query
+        query_vector = None
+        if self.chat_params.enable_vector_search:
+            query_vector = await self.searcher.embed_query(query_text)
+        if self._speculative_search_discarded:
+            # The embedding stays in the embedding cache, for other requests with the same question
+            return []
+        self._speculative_search_in_database = True
+        return await self.searcher.search_and_embed(
+            query_text,
             top=self.chat_params.top,
             enable_vector_search=self.chat_params.enable_vector_search,
             enable_text_search=self.chat_params.enable_text_search,
-            filters=filters,
-        )
-        return SearchResults(
-            query=search_query, items=[ItemPublic.model_validate(item.to_dict()) for item in results], filters=filters
+            search_effort=self.chat_params.search_effort,
+            fusion=self.chat_params.fusion,
+            query_vector=query_vector,
         )
 
-    async def prepare_context(self) -> tuple[list[ItemPublic], list[ThoughtStep]]:
-        few_shots: list[ResponseInputItemParam] = json.loads(self.query_fewshots)
-        user_query = f"Find search results for user query: {self.chat_params.original_user_query}"
-        new_user_message = EasyInputMessageParam(role="user", content=user_query)
-        all_messages = few_shots + self.chat_params.past_messages + [new_user_message]
+    async def take_speculative_search(self) -> Optional[list[ItemPublic]]:
+        """Return the results of the speculative search, or None if there was none or it failed."""
+        task, self._speculative_search_task = self._speculative_search_task, None
+        if task is None:
+            return None
+        try:
+            results = await task
+        except Exception as e:
+            logger.warning("Speculative search failed, searching again: %s", e)
+            return None
+        self.used_speculative_search = True
+        return results
+
+    async def discard_speculative_search(self):
+        """Skip the search of the speculative search if it hasn't started, otherwise wait for it to finish."""
+        task, self._speculative_search_task = self._speculative_search_task, None
+        if task is None:
+            return
+        # The task isn't cancelled: concurrent requests for the same question may be waiting on its embedding
+        # through the embedding cache, and cancelling a query mid-flight could leave the shared session unusable
+        self._speculative_search_discarded = True
+        await asyncio.wait([task])
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Discarded speculative search failed: %s", task.exception())
+
+    def get_query_rewrite_cache_key(self) -> str:
+        """Hash the conversation, ignoring case and extra whitespace in message text."""
+        conversation = [
+            (message.get("role"), normalize_query_text(content) if isinstance(content, str) else content)
+            for message in self.chat_params.past_messages
+            for content in [message.get("content")]
+        ] + [("user", normalize_query_text(self.chat_params.original_user_query))]
+        return hashlib.sha256(json.dumps(conversation, sort_keys=True, default=str).encode("utf-8")).hexdigest()
 
-        run_results = await Runner.run(self.search_agent, input=all_messages)
+    async def run_search_agent(self, all_messages: list[ResponseInputItemParam]) -> QueryRewrite:
+        """Generate search arguments with the search agent, which also runs the search."""
+        run_results = await Runner.run(self.search_agent, input=all_messages, context=self)
         most_recent_response = run_results.new_items[-1]
-        if isinstance(most_recent_response, ToolCallOutputItem):
-            search_results = most_recent_response.output
-        else:
+        if not isinstance(most_recent_response, ToolCallOutputItem) or self._query_rewrite is None:
             raise ValueError("Error retrieving search results, model did not call tool properly")
+        self._search_results = most_recent_response.output
+        return self._query_rewrite
 
-        thoughts = [
-            ThoughtStep(
-                title="Prompt to generate search arguments",
-                description=[{"role": "system", "content": self.query_prompt_template}]
-                + ItemHelpers.input_to_new_input_list(run_results.input),
-                props=self.model_for_thoughts,
-            ),
-            ThoughtStep(
-                title="Search using generated search arguments",
-                description=search_results.query,
-                props={
-                    "top": self.chat_params.top,
-                    "vector_search": self.chat_params.enable_vector_search,
-                    "text_search": self.chat_params.enable_text_search,
-                    "filters": search_results.filters,
-                },
-            ),
-            ThoughtStep(
-                title="Search results",
-                description=search_results.items,
-            ),
+    async def rewrite_and_search(self, all_messages: list[ResponseInputItemParam]) -> SearchResults:
+        # Without earlier messages to resolve, the rewritten query is often the original query,
+        # so search for it while the query rewrite runs
+        if self.speculative_search and not self.chat_params.past_messages:
+            self._speculative_search_task = asyncio.create_task(self.search_speculatively())
+        try:
+            if self.query_rewrite_cache is None:
+                await self.run_search_agent(all_messages)
+            else:
+                query_rewrite = await self.query_rewrite_cache.get_or_compute(
+                    self.get_query_rewrite_cache_key(), lambda: self.run_search_agent(all_messages)
+                )
+                if self._search_results is None:
+                    # The search arguments came from the cache, so the search agent didn't run the search
+                    self.used_query_rewrite_cache = True
+                    self._search_results = await self.search_database(
+                        query_rewrite.search_query, query_rewrite.price_filter, query_rewrite.brand_filter
+                    )
+        finally:
+            await self.discard_speculative_search()
+        if self._search_results is None:
+            raise ValueError("Error retrieving search results, the search didn't run")
+        return self._search_results
+
+    async def prepare_context_steps(self) -> AsyncGenerator[ThoughtStep, None]:
+        user_query = f"Find search results for user query: {self.chat_params.original_user_query}"
+        new_user_message = EasyInputMessageParam(role="user", content=user_query)
+        all_messages = self.query_fewshots + self.chat_params.past_messages + [new_user_message]
+
+        yield ThoughtStep(
+            title="Prompt to generate search arguments",
+            description=[{"role": "system", "content": self.query_prompt_template}]
+            + ItemHelpers.input_to_new_input_list(all_messages),
+            props=self.model_for_thoughts,
+        )
+
+        search_task = asyncio.create_task(self.rewrite_and_search(all_messages))
+        try:
+            # Report the search arguments as soon as they are known, while the search runs
+            search_arguments_ready = asyncio.ensure_future(self._search_arguments_ready.wait())
+            await asyncio.wait([search_task, search_arguments_ready], return_when=asyncio.FIRST_COMPLETED)
+            search_arguments_ready.cancel()
+            if self._query_rewrite is not None:
+                yield self.get_search_arguments_thought(self._query_rewrite)
+            search_results = await search_task
+        finally:
+            # The consumer stopped early, for example because the client disconnected
+            if not search_task.done():
+                search_task.cancel()
+                await asyncio.wait([search_task])
+
+        self.context_items = search_results.items
+        yield ThoughtStep(
+            title="Search results",
+            description=search_results.items,
+        )
+
+    def get_search_arguments_thought(self, query_rewrite: QueryRewrite) -> ThoughtStep:
+        filters: list[Filter] = [
+            search_filter
+            for search_filter in (query_rewrite.price_filter, query_rewrite.brand_filter)
+            if search_filter is not None
         ]
-        return search_results.items, thoughts
+        return ThoughtStep(
+            title="Search using generated search arguments",
+            description=query_rewrite.search_query,
+            props={
+                "top": self.chat_params.top,
+                "vector_search": self.chat_params.enable_vector_search,
+                "text_search": self.chat_params.enable_text_search,
+                "filters": filters,
+            }
+            | ({"speculative_search": self.used_speculative_search} if self.speculative_search else {})
+            | ({"cached": self.used_query_rewrite_cache} if self.query_rewrite_cache is not None else {}),
+        )
 
     async def answer(
         self,
@@ -153,6 +261,7 @@ class AdvancedRAGChat(RAGChatBase):
             self.answer_agent,
             input=self.chat_params.past_messages
             + [{"content": self.prepare_rag_request(self.chat_params.original_user_query, items), "role": "user"}],
+            run_config=self.get_answer_run_config(),
         )
 
         return RetrievalResponse(
@@ -180,6 +289,7 @@ class AdvancedRAGChat(RAGChatBase):
             self.answer_agent,
             input=self.chat_params.past_messages
             + [{"content": self.prepare_rag_request(self.chat_params.original_user_query, items), "role": "user"}],  # noqa
+            run_config=self.get_answer_run_config(),
         )
 
         yield RetrievalResponseDelta(
@@ -202,3 +312,24 @@ class AdvancedRAGChat(RAGChatBase):
             if isinstance(event, RawResponsesStreamEvent) and isinstance(event.data, ResponseTextDeltaEvent):
                 yield RetrievalResponseDelta(type="response.output_text.delta", delta=str(event.data.delta))
         return
+
+
+@function_tool
+async def search_database(
+    ctx: RunContextWrapper[AdvancedRAGChat],
+    search_query: str,
+    price_filter: Optional[PriceFilter] = None,
+    brand_filter: Optional[BrandFilter] = None,
+) -> SearchResults:
+    """
+    Search PostgreSQL database for relevant products based on user query
+
+    Args:
+        search_query: English query string to use for full text search, e.g. 'red shoes'.
+        price_filter: Filter search results based on price of the product
+        brand_filter: Filter search results based on brand of the product
+
+    Returns:
+        List of formatted items that match the search query and filters
+    """
+    return await ctx.context.search_database(search_query, price_filter, brand_filter)
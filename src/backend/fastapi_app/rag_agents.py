@@ -0,0 +1,35 @@
+from typing import Optional
+
+from agents import Agent, OpenAIResponsesModel
+from openai import AsyncOpenAI
+
+from fastapi_app.rag_advanced import AdvancedRAGChat, search_database
+from fastapi_app.rag_base import RAGAgents, RAGChatBase
+
+
+def create_rag_agents(
+    openai_chat_client: AsyncOpenAI,
+    chat_model: str,
+    chat_deployment: Optional[str],  # Not needed for non-Azure OpenAI
+) -> RAGAgents:
+    """Build the agents shared by all chat requests, once when the app starts."""
+    openai_agents_model = OpenAIResponsesModel(
+        model=chat_model if chat_deployment is None else chat_deployment, openai_client=openai_chat_client
+    )
+    return RAGAgents(
+        model_for_thoughts=(
+            {"model": chat_model, "deployment": chat_deployment} if chat_deployment else {"model": chat_model}
+        ),
+        search_agent=Agent(
+            name="Searcher",
+            instructions=AdvancedRAGChat.query_prompt_template,
+            tools=[search_database],
+            tool_use_behavior="stop_on_first_tool",
+            model=openai_agents_model,
+        ),
+        answer_agent=Agent(
+            name="Answerer",
+            instructions=RAGChatBase.answer_prompt_template,
+            model=openai_agents_model,
+        ),
+    )
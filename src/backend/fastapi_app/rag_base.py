@@ -1,7 +1,10 @@
 import pathlib
 from abc import ABC, abstractmethod
 from collections.abc import AsyncGenerator
+from dataclasses import dataclass
+from typing import Any
 
+from agents import Agent, ModelSettings, RunConfig
 from openai.types.responses import ResponseInputItemParam
 
 from fastapi_app.api_models import (
@@ -14,9 +17,24 @@ from fastapi_app.api_models import (
 )
 
 
+@dataclass
+class RAGAgents:
+    """
+    Agents shared by all chat requests, built once when the app starts.
+    Per-request state is passed to runs as context, and per-request model settings in the run config.
+    """
+
+    model_for_thoughts: dict[str, str]
+    search_agent: Agent[Any]
+    answer_agent: Agent[Any]
+
+
 class RAGChatBase(ABC):
     prompts_dir = pathlib.Path(__file__).parent / "prompts/"
     answer_prompt_template = open(prompts_dir / "answer.txt").read()
+    chat_params: ChatParams
+    # The search results, set by prepare_context_steps before it yields its last thought
+    context_items: list[ItemPublic]
 
     def get_chat_params(self, messages: list[ResponseInputItemParam], overrides: ChatRequestOverrides) -> ChatParams:
         response_token_limit = 1024
@@ -34,6 +52,8 @@ class RAGChatBase(ABC):
             temperature=overrides.temperature,
             retrieval_mode=overrides.retrieval_mode,
             use_advanced_flow=overrides.use_advanced_flow,
+            search_effort=overrides.search_effort,
+            fusion=overrides.fusion,
             response_token_limit=response_token_limit,
             prompt_template=prompt_template,
             enable_text_search=enable_text_search,
@@ -42,10 +62,26 @@ class RAGChatBase(ABC):
             past_messages=messages[:-1],
         )
 
+    def get_answer_run_config(self) -> RunConfig:
+        return RunConfig(
+            model_settings=ModelSettings(
+                temperature=self.chat_params.temperature,
+                max_tokens=self.chat_params.response_token_limit,
+            )
+        )
+
     @abstractmethod
-    async def prepare_context(self) -> tuple[list[ItemPublic], list[ThoughtStep]]:
+    def prepare_context_steps(self) -> AsyncGenerator[ThoughtStep, None]:
+        """
+        Retrieve relevant rows from the database and build a context for the chat model,
+        yielding each thought as soon as its stage completes.
+        """
         raise NotImplementedError
 
+    async def prepare_context(self) -> tuple[list[ItemPublic], list[ThoughtStep]]:
+        thoughts = [thought async for thought in self.prepare_context_steps()]
+        return self.context_items, thoughts
+
     def prepare_rag_request(self, user_query, items: list[ItemPublic]) -> str:
         sources_str = "\n".join([f"[{item.id}]:{item.to_str_for_rag()}" for item in items])
         return f"{user_query}Sources:\n{sources_str}"
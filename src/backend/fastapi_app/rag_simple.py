@@ -1,16 +1,11 @@
 from collections.abc import AsyncGenerator
-from typing import Optional
 
 from agents import (
-    Agent,
     ItemHelpers,
-    ModelSettings,
-    OpenAIResponsesModel,
     RawResponsesStreamEvent,
     Runner,
     set_tracing_disabled,
 )
-from openai import AsyncOpenAI
 from openai.types.responses import ResponseInputItemParam, ResponseTextDeltaEvent
 
 from fastapi_app.api_models import (
@@ -22,7 +17,7 @@ from fastapi_app.api_models import (
     ThoughtStep,
 )
 from fastapi_app.postgres_searcher import PostgresSearcher
-from fastapi_app.rag_base import RAGChatBase
+from fastapi_app.rag_base import RAGAgents, RAGChatBase
 
 set_tracing_disabled(disabled=True)
 
@@ -34,55 +29,35 @@ class SimpleRAGChat(RAGChatBase):
         messages: list[ResponseInputItemParam],
         overrides: ChatRequestOverrides,
         searcher: PostgresSearcher,
-        openai_chat_client: AsyncOpenAI,
-        chat_model: str,
-        chat_deployment: Optional[str],  # Not needed for non-Azure OpenAI
+        agents: RAGAgents,
     ):
         self.searcher = searcher
         self.chat_params = self.get_chat_params(messages, overrides)
-        self.model_for_thoughts = (
-            {"model": chat_model, "deployment": chat_deployment} if chat_deployment else {"model": chat_model}
-        )
-        openai_agents_model = OpenAIResponsesModel(
-            model=chat_model if chat_deployment is None else chat_deployment, openai_client=openai_chat_client
-        )
-        self.answer_agent = Agent(
-            name="Answerer",
-            instructions=self.answer_prompt_template,
-            model=openai_agents_model,
-            model_settings=ModelSettings(
-                temperature=self.chat_params.temperature,
-                max_tokens=self.chat_params.response_token_limit,
-            ),
-        )
-
-    async def prepare_context(self) -> tuple[list[ItemPublic], list[ThoughtStep]]:
-        """Retrieve relevant rows from the database and build a context for the chat model."""
+        self.model_for_thoughts = agents.model_for_thoughts
+        self.answer_agent = agents.answer_agent
 
-        results = await self.searcher.search_and_embed(
+    async def prepare_context_steps(self) -> AsyncGenerator[ThoughtStep, None]:
+        yield ThoughtStep(
+            title="Search query for database",
+            description=self.chat_params.original_user_query,
+            props={
+                "top": self.chat_params.top,
+                "vector_search": self.chat_params.enable_vector_search,
+                "text_search": self.chat_params.enable_text_search,
+            },
+        )
+        self.context_items = await self.searcher.search_and_embed(
             self.chat_params.original_user_query,
             top=self.chat_params.top,
             enable_vector_search=self.chat_params.enable_vector_search,
             enable_text_search=self.chat_params.enable_text_search,
+            search_effort=self.chat_params.search_effort,
+            fusion=self.chat_params.fusion,
+        )
+        yield ThoughtStep(
+            title="Search results",
+            description=self.context_items,
         )
-        items = [ItemPublic.model_validate(item.to_dict()) for item in results]
-
-        thoughts = [
-            ThoughtStep(
-                title="Search query for database",
-                description=self.chat_params.original_user_query,
-                props={
-                    "top": self.chat_params.top,
-                    "vector_search": self.chat_params.enable_vector_search,
-                    "text_search": self.chat_params.enable_text_search,
-                },
-            ),
-            ThoughtStep(
-                title="Search results",
-                description=items,
-            ),
-        ]
-        return items, thoughts
 
     async def answer(
         self,
@@ -93,6 +68,7 @@ class SimpleRAGChat(RAGChatBase):
             self.answer_agent,
             input=self.chat_params.past_messages
             + [{"content": self.prepare_rag_request(self.chat_params.original_user_query, items), "role": "user"}],
+            run_config=self.get_answer_run_config(),
         )
 
         return RetrievalResponse(
@@ -120,6 +96,7 @@ class SimpleRAGChat(RAGChatBase):
             self.answer_agent,
             input=self.chat_params.past_messages
             + [{"content": self.prepare_rag_request(self.chat_params.original_user_query, items), "role": "user"}],
+            run_config=self.get_answer_run_config(),
         )
 
         yield RetrievalResponseDelta(
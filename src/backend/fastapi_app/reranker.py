@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import math
+import re
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Optional
+
+import aiohttp
+import numpy as np
+
+from fastapi_app.api_models import ItemPublic
+
+logger = logging.getLogger("ragapp")
+
+RERANKERS = ("lexical", "http")
+
+
+class Reranker(ABC):
+    """Scores search results against the query, to reorder the candidates of a first-stage search."""
+
+    @abstractmethod
+    async def score(self, query: str, documents: list[str]) -> list[float]:
+        """Score all the documents in one call, returning a score per document where higher is more relevant."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class LexicalReranker(Reranker):
+    """
+    Scores documents with BM25 over the candidates, computed locally on the CPU without a model.
+    Cheap and deterministic, for tests and deployments without a rerank endpoint.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    @staticmethod
+    def tokenize(text: str) -> list[str]:
+        return re.findall(r"\w+", text.casefold())
+
+    async def score(self, query: str, documents: list[str]) -> list[float]:
+        if not documents:
+            return []
+        term_counts = [Counter(self.tokenize(document)) for document in documents]
+        lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float64)
+        length_norm = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1.0))
+        scores = np.zeros(len(documents))
+        for term in set(self.tokenize(query)):
+            frequencies = np.array([counts[term] for counts in term_counts], dtype=np.float64)
+            document_frequency = np.count_nonzero(frequencies)
+            if document_frequency == 0:
+                continue
+            idf = math.log(1 + (len(documents) - document_frequency + 0.5) / (document_frequency + 0.5))
+            scores += idf * frequencies * (self.k1 + 1) / (frequencies + length_norm)
+        return scores.tolist()
+
+
+class HTTPReranker(Reranker):
+    """
+    Scores documents with a rerank endpoint, like the Cohere or Jina rerank APIs, in one request:
+    the body has the query and the documents, and the response lists a relevance score per document index.
+    """
+
+    def __init__(self, endpoint: str, api_key: Optional[str] = None, model: Optional[str] = None):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.model = model
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created on first use, as the session must be created in the event loop that uses it
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def score(self, query: str, documents: list[str]) -> list[float]:
+        body: dict = {"query": query, "documents": documents}
+        if self.model:
+            body["model"] = self.model
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        async with self.session.post(self.endpoint, json=body, headers=headers) as response:
+            response.raise_for_status()
+            results = (await response.json())["results"]
+        # Documents that the endpoint didn't score go after the scored ones
+        scores = [-math.inf] * len(documents)
+        for result in results:
+            scores[result["index"]] = result["relevance_score"]
+        return scores
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+def create_reranker(
+    reranker: Optional[str], endpoint: Optional[str], api_key: Optional[str], model: Optional[str]
+) -> Optional[Reranker]:
+    if reranker is None:
+        return None
+    if reranker == "lexical":
+        return LexicalReranker()
+    if reranker == "http":
+        if not endpoint:
+            raise ValueError("The http reranker requires RERANKER_ENDPOINT")
+        return HTTPReranker(endpoint, api_key=api_key, model=model)
+    raise ValueError(f"Unsupported reranker: {reranker}")
+
+
+async def rerank(
+    reranker: Reranker, query: str, items: list[ItemPublic], top: int, timeout: float
+) -> Optional[list[ItemPublic]]:
+    """
+    Reorder items by their reranker scores and return the top ones,
+    or None if the reranker failed or didn't answer within the timeout, in seconds.
+    """
+    try:
+        scores = await asyncio.wait_for(reranker.score(query, [item.to_str_for_rag() for item in items]), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Reranker took longer than %.2fs, keeping the search order", timeout)
+        return None
+    except Exception as e:
+        logger.warning("Reranker failed, keeping the search order: %s", e)
+        return None
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")
+    return [items[i] for i in order[:top]]
@@ -1,30 +1,57 @@
 import json
 import logging
-from collections.abc import AsyncGenerator
-from typing import Union
+from collections.abc import AsyncGenerator, Sequence
+from typing import Annotated, Optional, Union
 
 import fastapi
-from fastapi import HTTPException
+from fastapi import HTTPException, Query
 from fastapi.responses import StreamingResponse
 from openai import APIError
-from sqlalchemy import select, text
+from sqlalchemy import RowMapping, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from fastapi_app.api_models import (
+    BatchSearchRequest,
     ChatRequest,
     ErrorResponse,
     ItemPublic,
     ItemWithDistance,
     RetrievalResponse,
     RetrievalResponseDelta,
+    SearchEffort,
 )
-from fastapi_app.dependencies import ChatClient, CommonDeps, DBSession, EmbeddingsClient
-from fastapi_app.postgres_models import Item
+from fastapi_app.caching import AsyncLRUCache
+from fastapi_app.dependencies import (
+    CatalogItemCache,
+    ChatAgents,
+    ChatFlowRouter,
+    CommonDeps,
+    DBSession,
+    DBSessionMaker,
+    EmbeddingCache,
+    EmbeddingsClient,
+    FastAPIAppContext,
+    OpenAIClient,
+    QueryRewriteCache,
+    SearchReranker,
+    SemanticCache,
+)
+from fastapi_app.embeddings import EmbeddingCacheKey
+from fastapi_app.flow_router import FlowRouter
+from fastapi_app.item_cache import ItemCache
+from fastapi_app.postgres_models import Item, ItemNeighbor
 from fastapi_app.postgres_searcher import PostgresSearcher
-from fastapi_app.rag_advanced import AdvancedRAGChat
+from fastapi_app.rag_advanced import AdvancedRAGChat, QueryRewrite
+from fastapi_app.rag_base import RAGAgents
 from fastapi_app.rag_simple import SimpleRAGChat
+from fastapi_app.reranker import Reranker
+from fastapi_app.semantic_cache import SemanticSearchCache
 
 router = fastapi.APIRouter()
 
+# Upper limit for n in /similar. HNSW index scans return at most hnsw.ef_search rows, 40 by default
+MAX_SIMILAR_ITEMS = 40
+
 
 ERROR_FILTER = {"error": "Your message contains content that was flagged by the content filter."}
 
@@ -44,100 +71,269 @@ async def format_as_ndjson(r: AsyncGenerator[RetrievalResponseDelta, None]) -> A
             yield json.dumps({"error": str(error)}, ensure_ascii=False) + "\n"
 
 
+async def use_advanced_flow(
+    chat_request: ChatRequest, flow_router: Optional[FlowRouter], database_session: AsyncSession
+) -> bool:
+    """Use the advanced flow if requested, unless the router finds that the query rewrite would add nothing."""
+    if not chat_request.context.overrides.use_advanced_flow:
+        return False
+    if flow_router is None:
+        return True
+    await flow_router.refresh_brands(database_session)
+    return flow_router.needs_query_rewrite(chat_request.input)
+
+
+def create_searcher(
+    context: FastAPIAppContext,
+    database_session: AsyncSession,
+    openai_embed: OpenAIClient,
+    default_search_effort: Optional[SearchEffort],
+    embedding_cache: Optional[AsyncLRUCache[EmbeddingCacheKey, list[float]]],
+    item_cache: Optional[ItemCache],
+    semantic_cache: Optional[SemanticSearchCache[list[ItemPublic]]] = None,
+    sessionmaker: Optional[async_sessionmaker[AsyncSession]] = None,
+    reranker: Optional[Reranker] = None,
+) -> PostgresSearcher:
+    """Create a searcher with the app's search settings, shared by every endpoint that searches."""
+    return PostgresSearcher(
+        db_session=database_session,
+        openai_embed_client=openai_embed.client,
+        embed_deployment=context.openai_embed_deployment,
+        embed_model=context.openai_embed_model,
+        embed_dimensions=context.openai_embed_dimensions,
+        embedding_column=context.embedding_column,
+        candidate_pool=context.search_candidates,
+        iterative_scan=context.hnsw_iterative_scan,
+        vector_search_mode=context.vector_search_mode,
+        coarse_candidates=context.coarse_search_candidates,
+        vector_index=context.vector_index,
+        default_search_effort=default_search_effort,
+        embedding_cache=embedding_cache,
+        semantic_cache=semantic_cache,
+        item_cache=item_cache,
+        hybrid_execution=context.hybrid_search_execution,
+        sessionmaker=sessionmaker,
+        reranker=reranker,
+        rerank_candidates=context.rerank_candidates,
+        rerank_timeout=context.rerank_timeout,
+    )
+
+
+async def create_rag_flow(
+    context: FastAPIAppContext,
+    database_session: AsyncSession,
+    sessionmaker: async_sessionmaker[AsyncSession],
+    openai_embed: OpenAIClient,
+    embedding_cache: Optional[AsyncLRUCache[EmbeddingCacheKey, list[float]]],
+    semantic_cache: Optional[SemanticSearchCache[list[ItemPublic]]],
+    flow_router: Optional[FlowRouter],
+    query_rewrite_cache: Optional[AsyncLRUCache[str, QueryRewrite]],
+    item_cache: Optional[ItemCache],
+    reranker: Optional[Reranker],
+    rag_agents: RAGAgents,
+    chat_request: ChatRequest,
+) -> Union[SimpleRAGChat, AdvancedRAGChat]:
+    searcher = create_searcher(
+        context,
+        database_session,
+        openai_embed,
+        context.chat_endpoint_search_effort,
+        embedding_cache,
+        item_cache,
+        semantic_cache=semantic_cache,
+        sessionmaker=sessionmaker,
+        reranker=reranker,
+    )
+    if await use_advanced_flow(chat_request, flow_router, database_session):
+        return AdvancedRAGChat(
+            messages=chat_request.input,
+            overrides=chat_request.context.overrides,
+            searcher=searcher,
+            agents=rag_agents,
+            speculative_search=context.speculative_search,
+            query_rewrite_cache=query_rewrite_cache,
+        )
+    return SimpleRAGChat(
+        messages=chat_request.input,
+        overrides=chat_request.context.overrides,
+        searcher=searcher,
+        agents=rag_agents,
+    )
+
+
 @router.get("/items/{id}", response_model=ItemPublic)
-async def item_handler(database_session: DBSession, id: int) -> ItemPublic:
+async def item_handler(database_session: DBSession, item_cache: CatalogItemCache, id: int) -> ItemPublic:
     """A simple API to get an item by ID."""
-    item = (await database_session.scalars(select(Item).where(Item.id == id))).first()
+    item: Optional[ItemPublic]
+    if item_cache is not None:
+        item = await item_cache.get_item(database_session, id)
+    else:
+        row = (await database_session.scalars(select(Item).where(Item.id == id))).first()
+        item = ItemPublic.model_validate(row.to_dict()) if row else None
     if not item:
         raise HTTPException(detail=f"Item with ID {id} not found.", status_code=404)
-    return ItemPublic.model_validate(item.to_dict())
+    return item
+
+
+async def find_nearest_items(
+    database_session: AsyncSession, embedding_column: str, select_columns: str, id: int, n: int
+) -> Sequence[RowMapping]:
+    """
+    Search the vector index for the items nearest to an item, reading the item's embedding in a subquery
+    so that no vectors are sent between the app and the database.
+    """
+    table_name = Item.__tablename__
+    return (
+        (
+            await database_session.execute(
+                text(
+                    f"SELECT {select_columns}, {embedding_column} <=> "
+                    f"(SELECT {embedding_column} FROM {table_name} WHERE id = :item_id) AS distance "
+                    f"FROM {table_name} WHERE id <> :item_id ORDER BY distance LIMIT :n"
+                ),
+                {"item_id": id, "n": n},
+            )
+        )
+        .mappings()
+        .all()
+    )
 
 
 @router.get("/similar", response_model=list[ItemWithDistance])
 async def similar_handler(
-    context: CommonDeps, database_session: DBSession, id: int, n: int = 5
+    context: CommonDeps,
+    database_session: DBSession,
+    item_cache: CatalogItemCache,
+    id: int,
+    n: Annotated[int, Query(ge=1, le=MAX_SIMILAR_ITEMS)] = 5,
 ) -> list[ItemWithDistance]:
     """A similarity API to find items similar to items with given ID."""
-    item = (await database_session.scalars(select(Item).where(Item.id == id))).first()
-    if not item:
-        raise HTTPException(detail=f"Item with ID {id} not found.", status_code=404)
-
-    closest = (
-        await database_session.execute(
-            text(
-                f"SELECT *, {context.embedding_column} <=> :embedding as DISTANCE FROM {Item.__tablename__} "
-                "WHERE id <> :item_id ORDER BY distance LIMIT :n"
-            ),
-            {"embedding": getattr(item, context.embedding_column), "n": n, "item_id": id},
+    table_name = Item.__tablename__
+    # With the item cache, only rank in the database and hydrate the neighbors from the cache
+    columns = ["id"] if item_cache is not None else list(ItemPublic.model_fields)
+    select_columns = ", ".join(f"{table_name}.{column}" for column in columns)
+    closest: Sequence[RowMapping] = []
+    if context.precomputed_neighbors:
+        # Read the neighbors stored by update_item_neighbors.py, an index lookup instead of a vector search
+        closest = (
+            (
+                await database_session.execute(
+                    text(
+                        f"SELECT {select_columns}, neighbors.distance FROM {ItemNeighbor.__tablename__} AS neighbors "
+                        f"JOIN {table_name} ON {table_name}.id = neighbors.neighbor_id "
+                        "WHERE neighbors.embedding_column = :embedding_column AND neighbors.item_id = :item_id "
+                        "ORDER BY neighbors.rank LIMIT :n"
+                    ),
+                    {"embedding_column": context.embedding_column, "item_id": id, "n": n},
+                )
+            )
+            .mappings()
+            .all()
         )
-    ).fetchall()
+    if len(closest) < n:
+        # Not computed yet, or fewer stored than requested, so search the index
+        closest = await find_nearest_items(database_session, context.embedding_column, select_columns, id, n)
+    if not closest or closest[0]["distance"] is None:
+        # All distances are NULL if the item doesn't exist or has no embedding
+        if (await database_session.scalars(select(Item.id).where(Item.id == id))).first() is None:
+            raise HTTPException(detail=f"Item with ID {id} not found.", status_code=404)
+        return []
+    # Neighbors without an embedding have no distance
+    closest = [row for row in closest if row["distance"] is not None]
 
-    items = [dict(row._mapping) for row in closest]
-    return [ItemWithDistance.model_validate(item) for item in items]
+    if item_cache is not None:
+        distances = {row["id"]: row["distance"] for row in closest}
+        neighbors = await item_cache.get_items(database_session, list(distances))
+        return [ItemWithDistance(**neighbor.model_dump(), distance=distances[neighbor.id]) for neighbor in neighbors]
+    return [ItemWithDistance(**row) for row in closest]
 
 
 @router.get("/search", response_model=list[ItemPublic])
 async def search_handler(
     context: CommonDeps,
     database_session: DBSession,
+    sessionmaker: DBSessionMaker,
     openai_embed: EmbeddingsClient,
+    embedding_cache: EmbeddingCache,
+    semantic_cache: SemanticCache,
+    item_cache: CatalogItemCache,
+    reranker: SearchReranker,
     query: str,
     top: int = 5,
     enable_vector_search: bool = True,
     enable_text_search: bool = True,
+    search_effort: Optional[SearchEffort] = None,
 ) -> list[ItemPublic]:
     """A search API to find items based on a query."""
-    searcher = PostgresSearcher(
-        db_session=database_session,
-        openai_embed_client=openai_embed.client,
-        embed_deployment=context.openai_embed_deployment,
-        embed_model=context.openai_embed_model,
-        embed_dimensions=context.openai_embed_dimensions,
-        embedding_column=context.embedding_column,
+    searcher = create_searcher(
+        context,
+        database_session,
+        openai_embed,
+        context.search_endpoint_search_effort,
+        embedding_cache,
+        item_cache,
+        semantic_cache=semantic_cache,
+        sessionmaker=sessionmaker,
+        reranker=reranker,
+    )
+    return await searcher.search_and_embed(
+        query,
+        top=top,
+        enable_vector_search=enable_vector_search,
+        enable_text_search=enable_text_search,
+        search_effort=search_effort,
     )
-    results = await searcher.search_and_embed(
-        query, top=top, enable_vector_search=enable_vector_search, enable_text_search=enable_text_search
+
+
+@router.post("/search/batch", response_model=list[list[ItemPublic]])
+async def batch_search_handler(
+    context: CommonDeps,
+    database_session: DBSession,
+    openai_embed: EmbeddingsClient,
+    embedding_cache: EmbeddingCache,
+    item_cache: CatalogItemCache,
+    batch_request: BatchSearchRequest,
+) -> list[list[ItemPublic]]:
+    """
+    A search API to run many queries at once, with one embeddings request and one database round trip.
+    Returns the results of each query in the same order as the queries.
+    """
+    searcher = create_searcher(
+        context, database_session, openai_embed, context.search_endpoint_search_effort, embedding_cache, item_cache
     )
-    return [ItemPublic.model_validate(item.to_dict()) for item in results]
+    return await searcher.search_batch(batch_request.queries, search_effort=batch_request.search_effort)
 
 
 @router.post("/chat", response_model=Union[RetrievalResponse, ErrorResponse])
 async def chat_handler(
     context: CommonDeps,
     database_session: DBSession,
+    sessionmaker: DBSessionMaker,
     openai_embed: EmbeddingsClient,
-    openai_chat: ChatClient,
+    embedding_cache: EmbeddingCache,
+    semantic_cache: SemanticCache,
+    flow_router: ChatFlowRouter,
+    query_rewrite_cache: QueryRewriteCache,
+    item_cache: CatalogItemCache,
+    reranker: SearchReranker,
+    rag_agents: ChatAgents,
     chat_request: ChatRequest,
 ):
     try:
-        searcher = PostgresSearcher(
-            db_session=database_session,
-            openai_embed_client=openai_embed.client,
-            embed_deployment=context.openai_embed_deployment,
-            embed_model=context.openai_embed_model,
-            embed_dimensions=context.openai_embed_dimensions,
-            embedding_column=context.embedding_column,
+        rag_flow = await create_rag_flow(
+            context,
+            database_session,
+            sessionmaker,
+            openai_embed,
+            embedding_cache,
+            semantic_cache,
+            flow_router,
+            query_rewrite_cache,
+            item_cache,
+            reranker,
+            rag_agents,
+            chat_request,
         )
-        rag_flow: Union[SimpleRAGChat, AdvancedRAGChat]
-        if chat_request.context.overrides.use_advanced_flow:
-            rag_flow = AdvancedRAGChat(
-                messages=chat_request.input,
-                overrides=chat_request.context.overrides,
-                searcher=searcher,
-                openai_chat_client=openai_chat.client,
-                chat_model=context.openai_chat_model,
-                chat_deployment=context.openai_chat_deployment,
-            )
-        else:
-            rag_flow = SimpleRAGChat(
-                messages=chat_request.input,
-                overrides=chat_request.context.overrides,
-                searcher=searcher,
-                openai_chat_client=openai_chat.client,
-                chat_model=context.openai_chat_model,
-                chat_deployment=context.openai_chat_deployment,
-            )
-
         items, thoughts = await rag_flow.prepare_context()
         response = await rag_flow.answer(items=items, earlier_thoughts=thoughts)
         return response
@@ -152,55 +348,42 @@ async def chat_handler(
 @router.post("/chat/stream")
 async def chat_stream_handler(
     context: CommonDeps,
-    database_session: DBSession,
+    sessionmaker: DBSessionMaker,
     openai_embed: EmbeddingsClient,
-    openai_chat: ChatClient,
+    embedding_cache: EmbeddingCache,
+    semantic_cache: SemanticCache,
+    flow_router: ChatFlowRouter,
+    query_rewrite_cache: QueryRewriteCache,
+    item_cache: CatalogItemCache,
+    reranker: SearchReranker,
+    rag_agents: ChatAgents,
     chat_request: ChatRequest,
 ):
-    searcher = PostgresSearcher(
-        db_session=database_session,
-        openai_embed_client=openai_embed.client,
-        embed_deployment=context.openai_embed_deployment,
-        embed_model=context.openai_embed_model,
-        embed_dimensions=context.openai_embed_dimensions,
-        embedding_column=context.embedding_column,
-    )
-
-    rag_flow: Union[SimpleRAGChat, AdvancedRAGChat]
-    if chat_request.context.overrides.use_advanced_flow:
-        rag_flow = AdvancedRAGChat(
-            messages=chat_request.input,
-            overrides=chat_request.context.overrides,
-            searcher=searcher,
-            openai_chat_client=openai_chat.client,
-            chat_model=context.openai_chat_model,
-            chat_deployment=context.openai_chat_deployment,
-        )
-    else:
-        rag_flow = SimpleRAGChat(
-            messages=chat_request.input,
-            overrides=chat_request.context.overrides,
-            searcher=searcher,
-            openai_chat_client=openai_chat.client,
-            chat_model=context.openai_chat_model,
-            chat_deployment=context.openai_chat_deployment,
-        )
-
-    try:
-        # Intentionally do search we stream down the answer, to avoid using database connections during stream
+    async def stream_chat() -> AsyncGenerator[RetrievalResponseDelta, None]:
+        # Search with a session of our own that is closed before the answer streams down,
+        # to avoid holding a database connection during the stream
         # See https://github.com/tiangolo/fastapi/discussions/11321
-        items, thoughts = await rag_flow.prepare_context()
-        result = rag_flow.answer_stream(items, thoughts)
-        return StreamingResponse(content=format_as_ndjson(result), media_type="application/x-ndjson")
-    except Exception as e:
-        if isinstance(e, APIError) and e.code == "content_filter":
-            return StreamingResponse(
-                content=json.dumps(ERROR_FILTER) + "\n",
-                media_type="application/x-ndjson",
-            )
-        else:
-            logging.exception("Exception while generating response: %s", e)
-            return StreamingResponse(
-                content=json.dumps({"error": str(e)}, ensure_ascii=False) + "\n",
-                media_type="application/x-ndjson",
+        async with sessionmaker() as database_session:
+            rag_flow = await create_rag_flow(
+                context,
+                database_session,
+                sessionmaker,
+                openai_embed,
+                embedding_cache,
+                semantic_cache,
+                flow_router,
+                query_rewrite_cache,
+                item_cache,
+                reranker,
+                rag_agents,
+                chat_request,
             )
+            thoughts = []
+            async for thought in rag_flow.prepare_context_steps():
+                thoughts.append(thought)
+                yield RetrievalResponseDelta(type="response.thought", thought=thought)
+        async for event in rag_flow.answer_stream(rag_flow.context_items, thoughts):
+            yield event
+
+    # Start streaming right away, sending each retrieval stage as it completes
+    return StreamingResponse(content=format_as_ndjson(stream_chat()), media_type="application/x-ndjson")
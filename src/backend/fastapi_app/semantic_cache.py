@@ -0,0 +1,102 @@
+import time
+from collections.abc import Hashable, Sequence
+from typing import Generic, Optional, TypeVar, Union
+
+import numpy as np
+
+V = TypeVar("V")
+
+Vector = Union[Sequence[float], np.ndarray]
+
+
+class SemanticSearchCache(Generic[V]):
+    """
+    Caches search results by query embedding, so that paraphrased queries can reuse earlier results.
+
+    A lookup returns the results of the most similar cached query with the same key (filters and search options),
+    if its cosine distance to the new query is at most `max_distance`.
+    Embeddings are kept in a preallocated matrix so that a lookup is a single matrix-vector product.
+    """
+
+    def __init__(self, maxsize: int, max_distance: float, ttl: Optional[float] = None):
+        if maxsize <= 0:
+            raise ValueError("Cache maxsize must be positive")
+        self.maxsize = maxsize
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self._vectors: Optional[np.ndarray] = None
+        self._key_ids = np.full(maxsize, -1, dtype=np.int64)
+        self._last_used = np.zeros(maxsize, dtype=np.float64)
+        self._expires_at = np.zeros(maxsize, dtype=np.float64)
+        self._values: list[Optional[V]] = [None] * maxsize
+        self._keys: dict[Hashable, int] = {}
+        # Incremented on every clear, so that results of searches started before a change aren't cached after it
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._key_ids >= 0))
+
+    @staticmethod
+    def _normalize(vector: Vector) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm > 0 else array
+
+    def lookup(self, vector: Vector, key: Hashable) -> Optional[V]:
+        key_id = self._keys.get(key)
+        if self._vectors is None or key_id is None or len(vector) != self._vectors.shape[1]:
+            self.misses += 1
+            return None
+        similarities = self._vectors @ self._normalize(vector)
+        candidates = (self._key_ids == key_id) & (self._expires_at >= time.monotonic())
+        similarities[~candidates] = -np.inf
+        slot = int(np.argmax(similarities))
+        if not candidates[slot] or 1 - similarities[slot] > self.max_distance:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._last_used[slot] = time.monotonic()
+        return self._values[slot]
+
+    def store(self, vector: Vector, key: Hashable, value: V, generation: Optional[int] = None):
+        """Cache a value, unless the cache was cleared since `generation` was read before computing the value."""
+        if generation is not None and generation != self.generation:
+            return
+        normalized = self._normalize(vector)
+        if self._vectors is None or self._vectors.shape[1] != len(normalized):
+            # Embedding dimensions are fixed per cache, start over if they change
+            self._vectors = np.zeros((self.maxsize, len(normalized)), dtype=np.float32)
+            self.clear()
+        now = time.monotonic()
+        free_slots = np.flatnonzero((self._key_ids < 0) | (self._expires_at < now))
+        # Reuse an empty or expired slot, otherwise evict the least recently used entry
+        slot = int(free_slots[0]) if len(free_slots) else int(np.argmin(self._last_used))
+        self._key_ids[slot] = -1
+        if key not in self._keys and len(self._keys) >= self.maxsize:
+            self._compact_keys()
+        self._vectors[slot] = normalized
+        self._key_ids[slot] = self._keys.setdefault(key, len(self._keys))
+        self._last_used[slot] = now
+        self._expires_at[slot] = now + self.ttl if self.ttl is not None else np.inf
+        self._values[slot] = value
+
+    def _compact_keys(self):
+        """Drop keys that no longer have any cached entries and renumber the rest."""
+        live_key_ids = set(self._key_ids[self._key_ids >= 0].tolist())
+        live_keys = [key for key, key_id in self._keys.items() if key_id in live_key_ids]
+        remapped = np.full(self.maxsize, -1, dtype=np.int64)
+        for new_id, key in enumerate(live_keys):
+            remapped[self._key_ids == self._keys[key]] = new_id
+        self._key_ids = remapped
+        self._keys = {key: new_id for new_id, key in enumerate(live_keys)}
+
+    def clear(self):
+        self.generation += 1
+        self._key_ids[:] = -1
+        self._values = [None] * self.maxsize
+        self._keys.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
@@ -1,22 +1,169 @@
 import argparse
 import asyncio
 import logging
+import os
+from typing import Optional
 
 from dotenv import load_dotenv
-from sqlalchemy import text
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
 
 from fastapi_app.postgres_engine import create_postgres_engine_from_args, create_postgres_engine_from_env
-from fastapi_app.postgres_models import Base
+from fastapi_app.postgres_listener import ITEMS_CHANGED_CHANNEL
+from fastapi_app.postgres_models import (
+    VECTOR_INDEX_METHODS,
+    Base,
+    Item,
+    VectorIndexSpec,
+    quantized_indexes,
+    quantized_items,
+)
 
 logger = logging.getLogger("ragapp")
 
+# halfvec and bit vectors, and the binary_quantize function, were introduced in pgvector 0.7.0
+QUANTIZED_EMBEDDINGS_MIN_PGVECTOR_VERSION = (0, 7, 0)
 
-async def create_db_schema(engine):
+# Notification payloads are limited to 8000 bytes, leaving room for the operation name
+MAX_NOTIFICATION_IDS_LENGTH = 7900
+
+
+def upgrade_existing_tables(sync_conn):
+    """Add columns and indexes that were introduced after the tables were first created."""
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                logger.info(f"Adding column {column.name} to {table.name}...")
+                column_ddl = CreateColumn(column).compile(dialect=sync_conn.dialect)
+                sync_conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+        # Columns that already have an index may have been given an index of another type by configure_vector_indexes
+        indexed_columns = {tuple(index["column_names"]) for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if tuple(column.name for column in index.columns) not in indexed_columns:
+                index.create(sync_conn, checkfirst=True)
+
+
+def add_quantized_embeddings(sync_conn):
+    """Add the quantized embedding columns and their HNSW indexes, for two-stage vector search."""
+    existing_columns = {column["name"] for column in inspect(sync_conn).get_columns(quantized_items.name)}
+    for column in quantized_items.columns:
+        if column.name not in existing_columns:
+            # Adding a stored generated column rewrites the table, computing the column for every row
+            logger.info(f"Adding column {column.name} to {quantized_items.name}...")
+            column_ddl = CreateColumn(column).compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f"ALTER TABLE {quantized_items.name} ADD COLUMN {column_ddl}"))
+    for index in quantized_indexes:
+        logger.info(f"Creating index {index.name}...")
+        index.create(sync_conn, checkfirst=True)
+
+
+async def configure_vector_indexes(conn, spec: VectorIndexSpec):
+    """
+    Replace the indexes of the embedding columns with indexes of the given type and build parameters.
+    Indexes that already match are kept, since rebuilding a vector index over a large table takes a while.
+    """
+    table_name = Item.__tablename__
+    for column_name in ("embedding_3l", "embedding_nomic"):
+        index_name = spec.index_name(table_name, column_name)
+        existing_index = (
+            await conn.execute(
+                text("SELECT reloptions FROM pg_class WHERE relname = :index_name AND relkind = 'i'"),
+                {"index_name": index_name},
+            )
+        ).first()
+        parameters = {f"{name}={value}" for name, value in spec.parameters.items()}
+        if existing_index is not None and set(existing_index.reloptions or []) == parameters:
+            logger.info(f"Index {index_name} already matches {spec}")
+            continue
+        for method in VECTOR_INDEX_METHODS:
+            other_index_name = VectorIndexSpec(method, {}).index_name(table_name, column_name)
+            await conn.execute(text(f"DROP INDEX IF EXISTS {other_index_name}"))
+        logger.info(f"Creating index {index_name} ({spec})...")
+        await conn.execute(text(spec.create_index_sql(table_name, column_name)))
+    if spec.method == "ivfflat" and not await conn.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {table_name})")):
+        logger.warning("IVFFlat indexes built on an empty table have poor recall, rebuild them after loading data")
+
+
+def vector_index_spec(spec: str) -> VectorIndexSpec:
+    try:
+        return VectorIndexSpec.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+
+
+async def create_change_notification_trigger(conn):
+    """
+    Notify listening app instances whenever rows of the items table change, so they can invalidate caches.
+    The notification lists the ids of the changed rows, collected once per statement from transition tables.
+    """
+    table_name = Item.__tablename__
+    await conn.execute(
+        text(f"""
+        CREATE OR REPLACE FUNCTION notify_{table_name}_changed() RETURNS trigger AS $$
+        DECLARE
+            changed_ids text;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT string_agg(id::text, ',') INTO changed_ids FROM new_rows;
+            ELSIF TG_OP = 'UPDATE' THEN
+                SELECT string_agg(id::text, ',') INTO changed_ids
+                    FROM (SELECT id FROM old_rows UNION SELECT id FROM new_rows) AS changed_rows;
+            ELSIF TG_OP = 'DELETE' THEN
+                SELECT string_agg(id::text, ',') INTO changed_ids FROM old_rows;
+            END IF;
+            IF TG_OP <> 'TRUNCATE' AND changed_ids IS NULL THEN
+                -- The statement changed no rows
+                RETURN NULL;
+            END IF;
+            IF changed_ids IS NULL OR length(changed_ids) > {MAX_NOTIFICATION_IDS_LENGTH} THEN
+                -- Too many ids for a notification payload, listeners treat this as "any row may have changed"
+                PERFORM pg_notify('{ITEMS_CHANGED_CHANNEL}', TG_OP);
+            ELSE
+                PERFORM pg_notify('{ITEMS_CHANGED_CHANNEL}', TG_OP || ':' || changed_ids);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """)
+    )
+    # Transition tables can only be used by triggers for a single event
+    triggers = {
+        "inserted": ("INSERT", "REFERENCING NEW TABLE AS new_rows"),
+        "updated": ("UPDATE", "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+        "deleted": ("DELETE", "REFERENCING OLD TABLE AS old_rows"),
+        "truncated": ("TRUNCATE", ""),
+    }
+    # Earlier versions used a single trigger for all events
+    await conn.execute(text(f"DROP TRIGGER IF EXISTS {table_name}_changed ON {table_name}"))
+    for trigger_name, (event, transition_tables) in triggers.items():
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS {table_name}_{trigger_name} ON {table_name}"))
+        await conn.execute(
+            text(
+                f"CREATE TRIGGER {table_name}_{trigger_name} AFTER {event} ON {table_name} {transition_tables} "
+                f"FOR EACH STATEMENT EXECUTE FUNCTION notify_{table_name}_changed()"
+            )
+        )
+
+
+async def create_db_schema(engine, quantized_embeddings: bool = False, vector_index: Optional[VectorIndexSpec] = None):
     async with engine.begin() as conn:
         logger.info("Enabling the pgvector extension for Postgres...")
         await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
         logger.info("Creating database tables and indexes...")
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_existing_tables)
+        if vector_index is not None:
+            await configure_vector_indexes(conn, vector_index)
+        logger.info("Creating change notification trigger...")
+        await create_change_notification_trigger(conn)
+        if quantized_embeddings:
+            pgvector_version = await conn.scalar(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'"))
+            if tuple(int(part) for part in pgvector_version.split(".")) < QUANTIZED_EMBEDDINGS_MIN_PGVECTOR_VERSION:
+                raise RuntimeError(f"Quantized embeddings require pgvector 0.7.0+, the database has {pgvector_version}")
+            logger.info("Creating quantized embedding columns and indexes...")
+            await conn.run_sync(add_quantized_embeddings)
 
     await conn.close()
 
@@ -29,6 +176,18 @@ async def main():
     parser.add_argument("--database", type=str, help="Postgres database")
     parser.add_argument("--sslmode", type=str, help="Postgres sslmode")
     parser.add_argument("--tenant-id", type=str, help="Azure tenant ID", default=None)
+    parser.add_argument(
+        "--quantized-embeddings",
+        action="store_true",
+        help="Add halfvec and binary quantized embedding columns with HNSW indexes (requires pgvector 0.7+)",
+    )
+    parser.add_argument(
+        "--vector-index",
+        type=vector_index_spec,
+        default=os.getenv("POSTGRES_VECTOR_INDEX") or None,
+        help="Type and build parameters of the embedding indexes, like hnsw:m=16,ef_construction=64 "
+        "or ivfflat:lists=100 (default: POSTGRES_VECTOR_INDEX, or the HNSW indexes of the models)",
+    )
 
     # if no args are specified, use environment variables
     args = parser.parse_args()
@@ -37,7 +196,7 @@ async def main():
     else:
         engine = await create_postgres_engine_from_args(args)
 
-    await create_db_schema(engine)
+    await create_db_schema(engine, quantized_embeddings=args.quantized_embeddings, vector_index=args.vector_index)
 
     await engine.dispose()
 
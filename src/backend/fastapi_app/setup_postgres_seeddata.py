@@ -3,23 +3,109 @@ import asyncio
 import json
 import logging
 import os
+import time
+from collections.abc import Iterable, Iterator
 
 import numpy as np
 import sqlalchemy.exc
 from dotenv import load_dotenv
 from sqlalchemy import select, text
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncConnection, async_sessionmaker
 
+from fastapi_app.embeddings import truncate_embedding
+from fastapi_app.json_stream import iter_batches, iter_json_array
 from fastapi_app.postgres_engine import (
     create_postgres_engine_from_args,
     create_postgres_engine_from_env,
 )
-from fastapi_app.postgres_models import Item
+from fastapi_app.postgres_models import TRUNCATED_EMBEDDINGS, VECTOR_INDEX_METHODS, Item, embedding_dimensions
 
 logger = logging.getLogger("ragapp")
 
 
-async def seed_data(engine):
+def seed_data_row(seed_data_object: dict) -> dict:
+    """Convert an object from seed_data.json to the column values of its row."""
+    row = {key: value for key, value in seed_data_object.items()}
+    row["embedding_3l"] = np.array(seed_data_object["embedding_3l"])
+    row["embedding_nomic"] = np.array(seed_data_object["embedding_nomic"])
+    for embedding_column, truncated_column in TRUNCATED_EMBEDDINGS.items():
+        dimensions = embedding_dimensions(truncated_column)
+        row[truncated_column] = (
+            truncate_embedding(seed_data_object[embedding_column], dimensions)
+            if seed_data_object[embedding_column]
+            else None
+        )
+    # Record the text that the seeded embeddings were computed from, so update_embeddings can skip them
+    source_hash = Item(**seed_data_object).hash_for_embedding()
+    row["embedding_hashes"] = json.dumps(
+        {column: source_hash for column in ("embedding_3l", "embedding_nomic") if seed_data_object[column]}
+    )
+    return row
+
+
+async def bulk_insert_seed_data(
+    conn: AsyncConnection, rows: Iterable[dict], rebuild_indexes: bool = False, batch_size: int = 1000
+) -> int:
+    """
+    Insert rows with a binary COPY into a staging table, then merge them into the items table,
+    skipping rows whose id already exists. Returns the number of rows inserted.
+    """
+    table_name = Item.__tablename__
+    staging_table_name = f"{table_name}_staging"
+    driver_connection = (await conn.get_raw_connection()).driver_connection
+    if driver_connection is None:
+        raise RuntimeError("The Postgres connection was invalidated before the COPY")
+    columns: list[str] = []
+    for batch in iter_batches(rows, batch_size):
+        if not columns:
+            columns = list(batch[0].keys())
+            await conn.execute(
+                text(
+                    f"CREATE TEMPORARY TABLE {staging_table_name} ON COMMIT DROP "
+                    f"AS SELECT {', '.join(columns)} FROM {table_name} WITH NO DATA"
+                )
+            )
+        await driver_connection.copy_records_to_table(
+            staging_table_name, records=[tuple(row[column] for column in columns) for row in batch], columns=columns
+        )
+    if not columns:
+        return 0
+    column_names = ", ".join(columns)
+
+    vector_indexes = []
+    if rebuild_indexes:
+        # Indexes are rebuilt from their current definitions, whichever type and build parameters
+        # setup_postgres_database.py gave them, including the optional quantized embedding indexes
+        vector_index_methods = "|".join(VECTOR_INDEX_METHODS)
+        vector_indexes = (
+            await conn.execute(
+                text(
+                    "SELECT indexname, indexdef FROM pg_indexes "
+                    f"WHERE tablename = :table_name AND indexdef ~ ' USING ({vector_index_methods}) '"
+                ),
+                {"table_name": table_name},
+            )
+        ).all()
+        # Building a vector index once over all rows is much faster than inserting rows into it one at a time
+        for index_name, _ in vector_indexes:
+            await conn.execute(text(f"DROP INDEX {index_name}"))
+    result = await conn.execute(
+        text(
+            f"INSERT INTO {table_name} ({column_names}) SELECT {column_names} FROM {staging_table_name} "
+            "ON CONFLICT (id) DO NOTHING"
+        )
+    )
+    for index_name, index_definition in vector_indexes:
+        logger.info(f"Rebuilding index {index_name}...")
+        await conn.execute(text(index_definition))
+    # Rows were inserted with explicit ids, so move the id sequence past them
+    await conn.execute(
+        text(f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), (SELECT max(id) FROM {table_name}))")
+    )
+    return result.rowcount
+
+
+async def seed_data(engine, bulk: bool = False, rebuild_indexes: bool = False):
     # Check if Item table exists
     async with engine.begin() as conn:
         table_name = Item.__tablename__
@@ -32,27 +118,44 @@ async def seed_data(engine):
             logger.error(f" {table_name} table does not exist. Please run the database setup script first.")
             return
 
-    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
-        # Insert the objects from the JSON file into the database
+    total = 0
+
+    def read_seed_data_rows() -> Iterator[dict]:
+        nonlocal total
         current_dir = os.path.dirname(os.path.realpath(__file__))
         with open(os.path.join(current_dir, "seed_data.json")) as f:
-            seed_data_objects = json.load(f)
-            for seed_data_object in seed_data_objects:
-                db_item = await session.execute(select(Item).filter(Item.id == seed_data_object["id"]))
+            # Read the objects one at a time, so memory use doesn't grow with the size of the file
+            for seed_data_object in iter_json_array(f):
+                total += 1
+                yield seed_data_row(seed_data_object)
+
+    start_time = time.perf_counter()
+
+    if bulk:
+        async with engine.begin() as conn:
+            inserted = await bulk_insert_seed_data(conn, read_seed_data_rows(), rebuild_indexes)
+    else:
+        inserted = 0
+        async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+            # Insert the objects from the JSON file into the database
+            for attrs in read_seed_data_rows():
+                db_item = await session.execute(select(Item).filter(Item.id == attrs["id"]))
                 if db_item.scalars().first():
                     continue
-                attrs = {key: value for key, value in seed_data_object.items()}
-                attrs["embedding_3l"] = np.array(seed_data_object["embedding_3l"])
-                attrs["embedding_nomic"] = np.array(seed_data_object["embedding_nomic"])
                 column_names = ", ".join(attrs.keys())
                 values = ", ".join([f":{key}" for key in attrs.keys()])
                 await session.execute(text(f"INSERT INTO {table_name} ({column_names}) VALUES ({values})"), attrs)
+                inserted += 1
             try:
                 await session.commit()
             except sqlalchemy.exc.IntegrityError:
                 pass
 
-    logger.info(f"{table_name} table seeded successfully.")
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        f"{table_name} table seeded successfully: inserted {inserted} of {total} rows "
+        f"in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)."
+    )
 
 
 async def main():
@@ -63,6 +166,12 @@ async def main():
     parser.add_argument("--database", type=str, help="Postgres database")
     parser.add_argument("--sslmode", type=str, help="Postgres sslmode")
     parser.add_argument("--tenant-id", type=str, help="Azure tenant ID", default=None)
+    parser.add_argument("--bulk", action="store_true", help="Load rows with COPY instead of one INSERT per row")
+    parser.add_argument(
+        "--rebuild-indexes",
+        action="store_true",
+        help="With --bulk, rebuild the HNSW indexes after loading",
+    )
 
     # if no args are specified, use environment variables
     args = parser.parse_args()
@@ -71,7 +180,7 @@ async def main():
     else:
         engine = await create_postgres_engine_from_args(args)
 
-    await seed_data(engine)
+    await seed_data(engine, bulk=args.bulk, rebuild_indexes=args.rebuild_indexes)
 
     await engine.dispose()
 
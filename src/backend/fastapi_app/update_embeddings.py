@@ -3,75 +3,268 @@ import asyncio
 import json
 import logging
 import os
+import time
+from typing import Optional
 
+import numpy as np
 from dotenv import load_dotenv
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from openai import AsyncOpenAI
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, async_sessionmaker
+from sqlalchemy.orm import load_only
 
-from fastapi_app.dependencies import common_parameters, get_azure_credential
-from fastapi_app.embeddings import compute_text_embedding
+from fastapi_app.dependencies import FastAPIAppContext, common_parameters, get_azure_credential
+from fastapi_app.embeddings import compute_text_embeddings, estimate_token_count, truncate_embedding
+from fastapi_app.json_stream import JsonArrayWriter, iter_batches, iter_json_array
 from fastapi_app.openai_clients import create_openai_embed_client
 from fastapi_app.postgres_engine import create_postgres_engine_from_env
-from fastapi_app.postgres_models import Item
+from fastapi_app.postgres_models import TRUNCATED_EMBEDDINGS, Item, embedding_dimensions
 
 logger = logging.getLogger("ragapp")
 
 
-async def update_embeddings(in_seed_data=False):
-    azure_credential = await get_azure_credential()
-    engine = await create_postgres_engine_from_env(azure_credential)
-    openai_embed_client = await create_openai_embed_client(azure_credential)
-    common_params = await common_parameters()
-
-    embedding_column = ""
+def get_embedding_column() -> str:
     OPENAI_EMBED_HOST = os.getenv("OPENAI_EMBED_HOST")
     if OPENAI_EMBED_HOST == "azure":
-        embedding_column = os.getenv("AZURE_OPENAI_EMBEDDING_COLUMN", "embedding_3l")
+        return os.getenv("AZURE_OPENAI_EMBEDDING_COLUMN", "embedding_3l")
     elif OPENAI_EMBED_HOST == "ollama":
-        embedding_column = os.getenv("OLLAMA_EMBEDDING_COLUMN", "embedding_nomic")
+        return os.getenv("OLLAMA_EMBEDDING_COLUMN", "embedding_nomic")
     else:
-        embedding_column = os.getenv("OPENAICOM_EMBEDDING_COLUMN", "embedding_3l")
-    logger.info(f"Updating embeddings in column: {embedding_column}")
-    if in_seed_data:
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        rows = []
-        with open(os.path.join(current_dir, "seed_data.json")) as f:
-            seed_data_objects = json.load(f)
-            for seed_data_object in seed_data_objects:
-                # for each column in the JSON, store it in the same named attribute in the object
-                attrs = {key: value for key, value in seed_data_object.items()}
-                row = Item(**attrs)
-                embedding = await compute_text_embedding(
-                    row.to_str_for_embedding(),
-                    openai_client=openai_embed_client,
-                    embed_model=common_params.openai_embed_model,
-                    embed_deployment=common_params.openai_embed_deployment,
-                    embedding_dimensions=common_params.openai_embed_dimensions,
-                )
-                setattr(row, embedding_column, embedding)
-                rows.append(row)
-            # Write updated seed data to the file
-            with open(os.path.join(current_dir, "seed_data.json"), "w") as f:
-                json.dump([row.to_dict(include_embedding=True) for row in rows], f, indent=4)
+        return os.getenv("OPENAICOM_EMBEDDING_COLUMN", "embedding_3l")
+
+
+def read_checkpoint(checkpoint_path: Optional[str], embedding_column: str) -> int:
+    """Return the id of the last row committed by an interrupted run, or 0 to start from the beginning."""
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint["embedding_column"] != embedding_column:
+        logger.warning(f"Ignoring checkpoint for column {checkpoint['embedding_column']}")
+        return 0
+    logger.info(f"Resuming after row id {checkpoint['last_id']}")
+    return checkpoint["last_id"]
+
+
+def write_checkpoint(checkpoint_path: Optional[str], embedding_column: str, last_id: int):
+    if checkpoint_path is None:
         return
+    # Replace the file atomically so an interrupted write can't leave a corrupt checkpoint
+    with open(f"{checkpoint_path}.tmp", "w") as f:
+        json.dump({"embedding_column": embedding_column, "last_id": last_id}, f)
+    os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+
+async def update_embeddings_in_seed_data(
+    openai_embed_client: AsyncOpenAI, common_params: FastAPIAppContext, embedding_column: str, batch_size: int = 500
+):
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    seed_data_path = os.path.join(current_dir, "seed_data.json")
+
+    async def embed_batch(seed_data_objects: list[dict]) -> list[dict]:
+        # for each column in the JSON, store it in the same named attribute in the object
+        rows = [Item(**seed_data_object) for seed_data_object in seed_data_objects]
+        embeddings = await compute_text_embeddings(
+            [row.to_str_for_embedding() for row in rows],
+            openai_client=openai_embed_client,
+            embed_model=common_params.openai_embed_model,
+            embed_deployment=common_params.openai_embed_deployment,
+            embedding_dimensions=common_params.openai_embed_dimensions,
+        )
+        for row, embedding in zip(rows, embeddings):
+            setattr(row, embedding_column, embedding)
+        return [row.to_dict(include_embedding=True) for row in rows]
+
+    # Stream the seed data through in batches, so memory use doesn't grow with the size of the file,
+    # writing to a new file that replaces the original once complete
+    with open(seed_data_path) as in_file, open(f"{seed_data_path}.tmp", "w") as out_file:
+        with JsonArrayWriter(out_file, indent=4) as writer:
+            for batch in iter_batches(iter_json_array(in_file), batch_size):
+                for seed_data_object in await embed_batch(batch):
+                    writer.write(seed_data_object)
+    os.replace(f"{seed_data_path}.tmp", seed_data_path)
+
+
+async def update_embeddings_in_database(
+    bind: AsyncEngine | AsyncConnection,
+    openai_embed_client: AsyncOpenAI,
+    common_params: FastAPIAppContext,
+    embedding_column: str,
+    page_size: int = 500,
+    concurrent_pages: int = 4,
+    checkpoint_path: Optional[str] = None,
+    force: bool = False,
+) -> int:
+    """
+    Embed rows page by page, in id order, committing each page and recording it in the checkpoint file.
+    Unless force is set, rows are skipped if their embedding was already computed from their current text.
+    Returns the number of rows embedded.
+    """
+    sessionmaker = async_sessionmaker(bind, expire_on_commit=False)
+    embedding = getattr(Item, embedding_column)
+    truncated_column = TRUNCATED_EMBEDDINGS.get(embedding_column)
+    truncated_dimensions = embedding_dimensions(truncated_column) if truncated_column else 0
+    # The truncated embedding is computed from the full one, so it's written along with it
+    set_truncated = f"{truncated_column} = :truncated_embedding, " if truncated_column else ""
+    last_id = read_checkpoint(checkpoint_path, embedding_column)
+    scanned = embedded = tokens = 0
+    start_time = time.perf_counter()
 
-    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
-        async with session.begin():
-            rows_to_update = (await session.scalars(select(Item))).all()
-
-            for row_model in rows_to_update:
-                setattr(
-                    row_model,
-                    embedding_column,
-                    await compute_text_embedding(
-                        row_model.to_str_for_embedding(),
-                        openai_client=openai_embed_client,
-                        embed_model=common_params.openai_embed_model,
-                        embed_deployment=common_params.openai_embed_deployment,
-                        embedding_dimensions=common_params.openai_embed_dimensions,
+    while True:
+        # Keyset pagination: each page starts after the last id of the previous one
+        pages: list[list[tuple[Item, bool]]] = []
+        async with sessionmaker() as session:
+            for _ in range(concurrent_pages):
+                page = (
+                    await session.execute(
+                        select(Item, embedding.is_not(None))
+                        .options(load_only(Item.id, Item.name, Item.description, Item.type, Item.embedding_hashes))
+                        .where(Item.id > last_id)
+                        .order_by(Item.id)
+                        .limit(page_size)
+                    )
+                ).all()
+                if not page:
+                    break
+                pages.append([(row, has_embedding) for row, has_embedding in page])
+                last_id = page[-1][0].id
+        if not pages:
+            break
+
+        rows_to_embed = [
+            [
+                row
+                for row, has_embedding in page
+                if force
+                or not has_embedding
+                or (row.embedding_hashes or {}).get(embedding_column) != row.hash_for_embedding()
+            ]
+            for page in pages
+        ]
+        texts = [row.to_str_for_embedding() for page in rows_to_embed for row in page]
+        # Each page is sent as its own request, with the pages of a round in flight at once
+        embeddings = iter(
+            await compute_text_embeddings(
+                texts,
+                openai_client=openai_embed_client,
+                embed_model=common_params.openai_embed_model,
+                embed_deployment=common_params.openai_embed_deployment,
+                embedding_dimensions=common_params.openai_embed_dimensions,
+                max_inputs_per_request=page_size,
+                max_concurrency=concurrent_pages,
+            )
+        )
+
+        for page, rows in zip(pages, rows_to_embed):
+            if rows:
+                params: list[dict] = []
+                for row in rows:
+                    # Bind embeddings as arrays for the pgvector codec registered on the connection
+                    row_embedding = np.array(next(embeddings))
+                    row_params = {
+                        "id": row.id,
+                        "embedding": row_embedding,
+                        "embedding_hashes": json.dumps(
+                            {**(row.embedding_hashes or {}), embedding_column: row.hash_for_embedding()}
+                        ),
+                    }
+                    if truncated_column:
+                        row_params["truncated_embedding"] = truncate_embedding(row_embedding, truncated_dimensions)
+                    params.append(row_params)
+                async with sessionmaker() as session, session.begin():
+                    await session.execute(
+                        text(
+                            f"UPDATE {Item.__tablename__} SET {embedding_column} = :embedding, {set_truncated}"
+                            "embedding_hashes = CAST(:embedding_hashes AS jsonb) WHERE id = :id"
+                        ),
+                        params,
+                    )
+            write_checkpoint(checkpoint_path, embedding_column, page[-1][0].id)
+
+        scanned += sum(len(page) for page in pages)
+        embedded += len(texts)
+        tokens += sum(estimate_token_count(row_text) for row_text in texts)
+        elapsed = time.perf_counter() - start_time
+        logger.info(
+            f"Scanned {scanned} rows, embedded {embedded} "
+            f"({embedded / elapsed:.1f} rows/s, ~{tokens / elapsed:.0f} tokens/s), last id {last_id}"
+        )
+
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    logger.info(f"Embedded {embedded} of {scanned} rows, the others were already up to date")
+    await update_truncated_embeddings(bind, embedding_column, page_size)
+    return embedded
+
+
+async def update_truncated_embeddings(
+    bind: AsyncEngine | AsyncConnection, embedding_column: str, page_size: int = 500
+) -> int:
+    """
+    Fill the truncated embeddings of rows that have a full embedding but no truncated one,
+    such as rows embedded before the truncated column was added, from the full embedding without calling the API.
+    Returns the number of rows updated.
+    """
+    truncated_column = TRUNCATED_EMBEDDINGS.get(embedding_column)
+    if truncated_column is None:
+        return 0
+    dimensions = embedding_dimensions(truncated_column)
+    sessionmaker = async_sessionmaker(bind, expire_on_commit=False)
+    table_name = Item.__tablename__
+    updated = 0
+    while True:
+        async with sessionmaker() as session, session.begin():
+            # Updated rows no longer match, so each page reads the next rows
+            rows = (
+                await session.execute(
+                    text(
+                        f"SELECT id, {embedding_column} FROM {table_name} "
+                        f"WHERE {embedding_column} IS NOT NULL AND {truncated_column} IS NULL ORDER BY id LIMIT :limit"
                     ),
+                    {"limit": page_size},
                 )
-            await session.commit()
+            ).all()
+            if not rows:
+                break
+            await session.execute(
+                text(f"UPDATE {table_name} SET {truncated_column} = :embedding WHERE id = :id"),
+                [{"id": id, "embedding": truncate_embedding(embedding, dimensions)} for id, embedding in rows],
+            )
+        updated += len(rows)
+    if updated:
+        logger.info(f"Filled {truncated_column} of {updated} rows from {embedding_column}")
+    return updated
+
+
+async def update_embeddings(
+    in_seed_data=False,
+    page_size: int = 500,
+    concurrent_pages: int = 4,
+    checkpoint_path: Optional[str] = None,
+    force: bool = False,
+):
+    azure_credential = await get_azure_credential()
+    openai_embed_client = await create_openai_embed_client(azure_credential)
+    common_params = await common_parameters()
+
+    embedding_column = get_embedding_column()
+    logger.info(f"Updating embeddings in column: {embedding_column}")
+    if in_seed_data:
+        await update_embeddings_in_seed_data(openai_embed_client, common_params, embedding_column)
+        return
+
+    engine = await create_postgres_engine_from_env(azure_credential)
+    await update_embeddings_in_database(
+        engine,
+        openai_embed_client,
+        common_params,
+        embedding_column,
+        page_size=page_size,
+        concurrent_pages=concurrent_pages,
+        checkpoint_path=checkpoint_path,
+        force=force,
+    )
+    await engine.dispose()
 
 
 if __name__ == "__main__":
@@ -81,5 +274,16 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--in_seed_data", action="store_true")
+    parser.add_argument("--page_size", type=int, default=500, help="Rows embedded and committed together")
+    parser.add_argument("--concurrent_pages", type=int, default=4, help="Pages embedded at the same time")
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=".update_embeddings_checkpoint.json",
+        help="File recording progress, so that an interrupted run resumes where it stopped",
+    )
+    parser.add_argument("--force", action="store_true", help="Re-embed rows even if their text is unchanged")
     args = parser.parse_args()
-    asyncio.run(update_embeddings(args.in_seed_data))
+    asyncio.run(
+        update_embeddings(args.in_seed_data, args.page_size, args.concurrent_pages, args.checkpoint, args.force)
+    )
@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+import logging
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession, async_sessionmaker
+
+from fastapi_app.dependencies import get_azure_credential
+from fastapi_app.json_stream import iter_batches
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_models import Item, ItemNeighbor
+from fastapi_app.update_embeddings import get_embedding_column
+
+logger = logging.getLogger("ragapp")
+
+
+async def find_changed_items(session: AsyncSession, embedding_column: str, neighbors: int) -> list[int]:
+    """
+    Find items with an embedding whose neighbors were never computed, computed from an older embedding,
+    or lost rows because neighbors were deleted since.
+    """
+    # Every row of an item's neighbors records the same hash, so checking the first is enough.
+    # Deleted items cascade to the rows naming them as a neighbor, so items hold fewer rows than expected,
+    # which is the number of neighbors requested, unless fewer other items have an embedding
+    return list(
+        (
+            await session.scalars(
+                text(f"""
+                WITH expected AS (
+                    SELECT LEAST(:neighbors, count(*) - 1) AS count
+                    FROM {Item.__tablename__} WHERE {embedding_column} IS NOT NULL
+                ),
+                stored AS (
+                    SELECT item_id, count(*) AS count FROM {ItemNeighbor.__tablename__}
+                    WHERE embedding_column = :embedding_column GROUP BY item_id
+                )
+                SELECT items.id FROM {Item.__tablename__} AS items
+                CROSS JOIN expected
+                LEFT JOIN {ItemNeighbor.__tablename__} AS neighbors
+                    ON neighbors.embedding_column = :embedding_column
+                    AND neighbors.item_id = items.id AND neighbors.rank = 1
+                LEFT JOIN stored ON stored.item_id = items.id
+                WHERE items.{embedding_column} IS NOT NULL
+                    AND (neighbors.item_id IS NULL
+                        OR neighbors.embedding_hash IS DISTINCT FROM items.embedding_hashes ->> '{embedding_column}'
+                        OR stored.count < expected.count)
+                ORDER BY items.id
+                """),
+                {"embedding_column": embedding_column, "neighbors": neighbors},
+            )
+        ).all()
+    )
+
+
+async def find_affected_items(session: AsyncSession, embedding_column: str, changed_ids: list[int]) -> list[int]:
+    """
+    Find items whose neighbors may be different because the embeddings of the changed items changed:
+    items that had a changed item as a neighbor, and the new neighbors of the changed items,
+    which are the items most likely to have a changed item among their own nearest neighbors now.
+    """
+    return list(
+        (
+            await session.scalars(
+                text(f"""
+                SELECT item_id FROM {ItemNeighbor.__tablename__}
+                    WHERE embedding_column = :embedding_column AND neighbor_id = ANY(:changed_ids)
+                UNION
+                SELECT neighbor_id FROM {ItemNeighbor.__tablename__}
+                    WHERE embedding_column = :embedding_column AND item_id = ANY(:changed_ids)
+                EXCEPT
+                SELECT unnest(CAST(:changed_ids AS integer[]))
+                ORDER BY 1
+                """),
+                {"embedding_column": embedding_column, "changed_ids": changed_ids},
+            )
+        ).all()
+    )
+
+
+async def compute_item_neighbors(session: AsyncSession, embedding_column: str, item_ids: list[int], neighbors: int):
+    """Replace the neighbors of the given items with their current nearest neighbors."""
+    await session.execute(
+        text(
+            f"DELETE FROM {ItemNeighbor.__tablename__} "
+            "WHERE embedding_column = :embedding_column AND item_id = ANY(:item_ids)"
+        ),
+        {"embedding_column": embedding_column, "item_ids": item_ids},
+    )
+    # The lateral subquery runs an HNSW index scan for each item, ordering by distance to that item's embedding,
+    # which returns at most hnsw.ef_search rows (40 by default), including the item itself,
+    # so raise it to the number of neighbors requested plus one
+    await session.execute(text(f"SET LOCAL hnsw.ef_search = {max(int(neighbors) + 1, 40)}"))
+    await session.execute(
+        text(f"""
+        INSERT INTO {ItemNeighbor.__tablename__}
+            (embedding_column, item_id, rank, neighbor_id, distance, embedding_hash)
+        SELECT :embedding_column, source.id, nearest.rank, nearest.id, nearest.distance,
+            source.embedding_hashes ->> '{embedding_column}'
+        FROM {Item.__tablename__} AS source
+        CROSS JOIN LATERAL (
+            SELECT id, distance, row_number() OVER (ORDER BY distance) AS rank
+            FROM (
+                SELECT id, {embedding_column} <=> source.{embedding_column} AS distance
+                FROM {Item.__tablename__}
+                WHERE id <> source.id
+                ORDER BY {embedding_column} <=> source.{embedding_column}
+                LIMIT :neighbors
+            ) AS candidates
+            WHERE distance IS NOT NULL
+        ) AS nearest
+        WHERE source.id = ANY(:item_ids) AND source.{embedding_column} IS NOT NULL
+        """),
+        {"embedding_column": embedding_column, "item_ids": item_ids, "neighbors": neighbors},
+    )
+
+
+async def update_item_neighbors_in_database(
+    bind: AsyncEngine | AsyncConnection,
+    embedding_column: str,
+    neighbors: int = 20,
+    batch_size: int = 100,
+    full: bool = False,
+) -> int:
+    """
+    Compute the nearest neighbors of items whose embedding changed since their neighbors were last computed,
+    and of the items whose neighbors those changes may affect, committing each batch of items.
+    With full, the neighbors of all items are computed again.
+    Returns the number of items whose neighbors were computed.
+    """
+    sessionmaker = async_sessionmaker(bind, expire_on_commit=False)
+    start_time = time.perf_counter()
+
+    async with sessionmaker() as session, session.begin():
+        if full:
+            await session.execute(
+                text(f"DELETE FROM {ItemNeighbor.__tablename__} WHERE embedding_column = :embedding_column"),
+                {"embedding_column": embedding_column},
+            )
+        else:
+            # Items without an embedding have no neighbors
+            await session.execute(
+                text(
+                    f"DELETE FROM {ItemNeighbor.__tablename__} WHERE embedding_column = :embedding_column "
+                    f"AND item_id IN (SELECT id FROM {Item.__tablename__} WHERE {embedding_column} IS NULL)"
+                ),
+                {"embedding_column": embedding_column},
+            )
+        changed_ids = await find_changed_items(session, embedding_column, neighbors)
+    logger.info(f"Computing neighbors of {len(changed_ids)} items with new or changed embeddings or deleted neighbors")
+
+    computed = 0
+
+    async def compute_in_batches(item_ids: list[int]):
+        nonlocal computed
+        for batch in iter_batches(item_ids, batch_size):
+            async with sessionmaker() as session, session.begin():
+                await compute_item_neighbors(session, embedding_column, batch, neighbors)
+            computed += len(batch)
+            elapsed = time.perf_counter() - start_time
+            logger.info(f"Computed neighbors of {computed} items ({computed / elapsed:.1f} items/s)")
+
+    await compute_in_batches(changed_ids)
+    if changed_ids and not full:
+        async with sessionmaker() as session:
+            affected_ids = await find_affected_items(session, embedding_column, changed_ids)
+        logger.info(f"Computing neighbors of {len(affected_ids)} items near the changed items")
+        await compute_in_batches(affected_ids)
+
+    logger.info(f"Computed neighbors of {computed} items in {time.perf_counter() - start_time:.1f}s")
+    return computed
+
+
+async def update_item_neighbors(neighbors: int = 20, batch_size: int = 100, full: bool = False):
+    embedding_column = get_embedding_column()
+    logger.info(f"Updating item neighbors for column: {embedding_column}")
+    azure_credential = await get_azure_credential()
+    engine = await create_postgres_engine_from_env(azure_credential)
+    await update_item_neighbors_in_database(
+        engine, embedding_column, neighbors=neighbors, batch_size=batch_size, full=full
+    )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--neighbors", type=int, default=20, help="Nearest neighbors stored for each item")
+    parser.add_argument("--batch_size", type=int, default=100, help="Items whose neighbors are committed together")
+    parser.add_argument("--full", action="store_true", help="Compute the neighbors of all items again")
+    args = parser.parse_args()
+    asyncio.run(update_item_neighbors(args.neighbors, args.batch_size, args.full))
@@ -45,5 +45,6 @@ export type RAGChatCompletionDelta = {
     type: string;
     delta?: string;
     context?: RAGContext;
+    thought?: Thoughts;
     error?: string;
 };
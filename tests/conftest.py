@@ -153,14 +153,16 @@ async def app(mock_session_env):
 @pytest.fixture(scope="session")
 def mock_openai_embedding(monkeypatch_session):
     async def mock_acreate(*args, **kwargs):
+        inputs = kwargs["input"] if isinstance(kwargs["input"], list) else [kwargs["input"]]
         return CreateEmbeddingResponse(
             object="list",
             data=[
                 Embedding(
                     embedding=test_data.embeddings,
-                    index=0,
+                    index=i,
                     object="embedding",
                 )
+                for i in range(len(inputs))
             ],
             model="text-embedding-3-large",
             usage=Usage(prompt_tokens=8, total_tokens=8),
@@ -67,6 +67,28 @@ async def test_similar_handler_422(test_client):
     assert b'{"detail":[{"type":"missing","loc":["query","id"]' in response.content
 
 
+@pytest.mark.asyncio
+async def test_similar_handler_nearest_first(test_client):
+    """test that the similar_handler route returns the n nearest other items, nearest first"""
+    response = test_client.get("/similar?id=1&n=5")
+
+    assert response.status_code == 200
+    items = response.json()
+    assert len(items) == 5
+    assert 1 not in [item["id"] for item in items]
+    assert [item["distance"] for item in items] == sorted(item["distance"] for item in items)
+    assert set(items[0]) == {"id", "type", "brand", "name", "description", "price", "distance"}
+
+
+@pytest.mark.asyncio
+async def test_similar_handler_n_too_large(test_client):
+    """test the similar_handler route with more neighbors than allowed"""
+    response = test_client.get("/similar?id=1&n=1000")
+
+    assert response.status_code == 422
+    assert b'"loc":["query","n"]' in response.content
+
+
 @pytest.mark.asyncio
 async def test_similar_handler_404(test_client):
     """test the similar_handler route with a non-existent item"""
@@ -95,6 +117,23 @@ async def test_search_handler(test_client):
     assert response_data["brand"] == test_data.brand
 
 
+@pytest.mark.asyncio
+async def test_search_handler_search_effort(test_client):
+    """test the search_handler route with a search effort level"""
+    response = test_client.get(f"/search?query={test_data.name}&top=1&search_effort=high")
+
+    assert response.status_code == 200
+    assert response.json()[0]["id"] == test_data.id
+
+
+@pytest.mark.asyncio
+async def test_search_handler_search_effort_422(test_client):
+    """test the search_handler route with an unknown search effort level"""
+    response = test_client.get(f"/search?query={test_data.name}&search_effort=extreme")
+
+    assert response.status_code == 422
+
+
 @pytest.mark.asyncio
 async def test_search_handler_422(test_client):
     """test the search_handler route with missing query parameters"""
@@ -106,6 +145,65 @@ async def test_search_handler_422(test_client):
     assert b'{"detail":[{"type":"missing","loc":["query","query"]' in response.content
 
 
+@pytest.mark.asyncio
+async def test_batch_search_handler(test_client):
+    """test the batch_search_handler route returns the results of each query in order"""
+    response = test_client.post(
+        "/search/batch",
+        json={
+            "queries": [
+                {"query": test_data.name, "top": 1},
+                {
+                    "query": test_data.name,
+                    "top": 2,
+                    "filters": [{"column": "brand", "comparison_operator": "=", "value": "Daybird"}],
+                },
+            ]
+        },
+    )
+    response_data = response.json()
+
+    assert response.status_code == 200
+    assert len(response_data) == 2
+    assert [item["id"] for item in response_data[0]] == [test_data.id]
+    assert 0 < len(response_data[1]) <= 2
+    assert all(item["brand"] == "Daybird" for item in response_data[1])
+
+
+@pytest.mark.asyncio
+async def test_batch_search_handler_422(test_client):
+    """test the batch_search_handler route rejects filters on columns that can't be filtered"""
+    response = test_client.post(
+        "/search/batch",
+        json={
+            "queries": [{"query": "tent", "filters": [{"column": "1=1; --", "comparison_operator": "=", "value": 1}]}]
+        },
+    )
+
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_chat_flow_fusion_override(test_client):
+    """test the chat route with a fusion override for hybrid search"""
+    response = test_client.post(
+        "/chat",
+        json={
+            "context": {
+                "overrides": {
+                    "top": 1,
+                    "use_advanced_flow": False,
+                    "fusion": {"method": "convex", "vector_weight": 0.7},
+                }
+            },
+            "input": [{"content": test_data.name, "role": "user"}],
+        },
+    )
+
+    assert response.status_code == 200
+    assert list(response.json()["context"]["data_points"]) == [str(test_data.id)]
+
+
 @pytest.mark.asyncio
 async def test_simple_chat_flow(test_client, snapshot):
     """test the simple chat flow route with hybrid retrieval mode"""
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from fastapi_app.caching import AsyncLRUCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache: AsyncLRUCache[str, int] = AsyncLRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_ttl_expiry():
+    cache: AsyncLRUCache[str, int] = AsyncLRUCache(maxsize=2, ttl=-1)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_cache_invalid_maxsize():
+    with pytest.raises(ValueError):
+        AsyncLRUCache(maxsize=0)
+
+
+@pytest.mark.asyncio
+async def test_lru_cache_get_or_compute_coalesces_misses():
+    cache: AsyncLRUCache[str, int] = AsyncLRUCache(maxsize=10)
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return 42
+
+    results = await asyncio.gather(*[cache.get_or_compute("key", compute) for _ in range(5)])
+    assert results == [42] * 5
+    assert await cache.get_or_compute("key", compute) == 42
+    assert calls == 1
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "coalesced": 4}
+
+
+@pytest.mark.asyncio
+async def test_lru_cache_get_or_compute_error_not_cached():
+    cache: AsyncLRUCache[str, int] = AsyncLRUCache(maxsize=10)
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    results = await asyncio.gather(*[cache.get_or_compute("key", fail) for _ in range(2)], return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.get("key") is None
+    assert await cache.get_or_compute("key", lambda: asyncio.sleep(0, result=7)) == 7
+
+
+@pytest.mark.asyncio
+async def test_lru_cache_get_or_compute_survives_cancelled_leader():
+    cache: AsyncLRUCache[str, int] = AsyncLRUCache(maxsize=10)
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return 42
+
+    leader = asyncio.create_task(cache.get_or_compute("key", compute))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(cache.get_or_compute("key", compute))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert await follower == 42
+    assert leader.cancelled()
+    # The follower computed the value again, since the leader's computation was cancelled
+    assert calls == 2
+    assert cache.get("key") == 42
+
+
+@pytest.mark.asyncio
+async def test_lru_cache_get_or_compute_cancelled_follower():
+    cache: AsyncLRUCache[str, int] = AsyncLRUCache(maxsize=10)
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        return 42
+
+    leader = asyncio.create_task(cache.get_or_compute("key", compute))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(cache.get_or_compute("key", compute))
+    await asyncio.sleep(0)
+    follower.cancel()
+
+    assert await leader == 42
+    assert follower.cancelled()
+
+
+def test_lru_cache_get_many_counts_hits_and_misses():
+    cache: AsyncLRUCache[str, int] = AsyncLRUCache(maxsize=10)
+    cache.set("a", 1)
+    assert cache.get_many(["a", "b", "a", "c"]) == {"a": 1}
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 2, "coalesced": 0}
@@ -1,6 +1,7 @@
 import pytest
 
 from fastapi_app.dependencies import common_parameters, get_azure_credential
+from fastapi_app.postgres_models import DEFAULT_VECTOR_INDEX, VectorIndexSpec
 
 
 @pytest.mark.asyncio
@@ -39,3 +40,10 @@ async def test_get_azure_credential(mock_session_env, mock_azure_credential):
     token = result.get_token("https://vault.azure.net")
     assert token.expires_on == 9999999999
     assert token.token == ""
+
+
+@pytest.mark.asyncio
+async def test_get_common_parameters_vector_index(mock_session_env, monkeypatch):
+    assert (await common_parameters()).vector_index == DEFAULT_VECTOR_INDEX
+    monkeypatch.setenv("POSTGRES_VECTOR_INDEX", "ivfflat:lists=200")
+    assert (await common_parameters()).vector_index == VectorIndexSpec("ivfflat", {"lists": 200})
@@ -1,6 +1,19 @@
+import asyncio
+
+import numpy as np
+import openai
 import pytest
+from openai.types import CreateEmbeddingResponse, Embedding
+from openai.types.create_embedding_response import Usage
 
-from fastapi_app.embeddings import compute_text_embedding
+from fastapi_app.caching import AsyncLRUCache
+from fastapi_app.embeddings import (
+    EmbeddingCacheKey,
+    batch_texts,
+    compute_text_embedding,
+    compute_text_embeddings,
+    truncate_embedding,
+)
 from fastapi_app.openai_clients import create_openai_embed_client
 from tests.data import test_data
 
@@ -28,3 +41,79 @@ async def test_compute_text_embedding_dimensions(mock_azure_credential, mock_ope
         embedding_dimensions=1024,
     )
     assert result == test_data.embeddings
+
+
+@pytest.mark.asyncio
+async def test_compute_text_embedding_cached(mock_azure_credential, mock_openai_embedding):
+    openai_embed_client = await create_openai_embed_client(mock_azure_credential)
+    cache: AsyncLRUCache[EmbeddingCacheKey, list[float]] = AsyncLRUCache(maxsize=10)
+    for q in ["Best shoe for hiking", "  best shoe   for HIKING "]:
+        result = await compute_text_embedding(
+            q=q,
+            openai_client=openai_embed_client,
+            embed_model="text-embedding-3-small",
+            embed_deployment="text-embedding-3-small",
+            embedding_dimensions=1024,
+            cache=cache,
+        )
+        assert result == test_data.embeddings
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "coalesced": 0}
+
+
+def test_truncate_embedding():
+    truncated = truncate_embedding(test_data.embeddings, 256)
+    assert len(truncated) == 256
+    assert np.linalg.norm(truncated) == pytest.approx(1.0)
+    # Same direction as the first dimensions of the full embedding
+    prefix = np.asarray(test_data.embeddings[:256])
+    assert np.allclose(truncated, prefix / np.linalg.norm(prefix), atol=1e-6)
+
+
+def test_truncate_embedding_zero_vector():
+    assert truncate_embedding([0.0, 0.0, 0.0], 2).tolist() == [0.0, 0.0]
+
+
+def test_batch_texts_max_inputs():
+    assert list(batch_texts(["a"] * 5, max_inputs=2)) == [(0, 2), (2, 4), (4, 5)]
+
+
+def test_batch_texts_max_tokens():
+    texts = ["x" * 30, "x" * 30, "x" * 30, "x" * 300]
+    # Each short text is estimated at 11 tokens
+    assert list(batch_texts(texts, max_inputs=10, max_tokens=25)) == [(0, 2), (2, 3), (3, 4)]
+    assert list(batch_texts([])) == []
+
+
+@pytest.mark.asyncio
+async def test_compute_text_embeddings_in_order(mock_azure_credential, monkeypatch):
+    requests = []
+
+    async def mock_acreate(*args, **kwargs):
+        inputs = kwargs["input"]
+        requests.append(inputs)
+        # Return the embeddings out of order to check that they are sorted by index
+        await asyncio.sleep(0.01 * (len(requests) % 2))
+        return CreateEmbeddingResponse(
+            object="list",
+            data=[
+                Embedding(embedding=[float(text)], index=i, object="embedding")
+                for i, text in reversed(list(enumerate(inputs)))
+            ],
+            model="text-embedding-3-large",
+            usage=Usage(prompt_tokens=len(inputs), total_tokens=len(inputs)),
+        )
+
+    monkeypatch.setattr(openai.resources.AsyncEmbeddings, "create", mock_acreate)
+    openai_embed_client = await create_openai_embed_client(mock_azure_credential)
+    texts = [str(i) for i in range(7)]
+    result = await compute_text_embeddings(
+        texts,
+        openai_client=openai_embed_client,
+        embed_model="text-embedding-3-large",
+        embed_deployment="text-embedding-3-large",
+        embedding_dimensions=1024,
+        max_inputs_per_request=3,
+        max_concurrency=2,
+    )
+    assert result == [[float(i)] for i in range(7)]
+    assert requests == [["0", "1", "2"], ["3", "4", "5"], ["6"]]
@@ -0,0 +1,59 @@
+import pytest
+from openai.types.responses import EasyInputMessageParam, ResponseInputItemParam
+
+from fastapi_app.flow_router import FlowRouter
+
+
+def user_message(content: str) -> EasyInputMessageParam:
+    return EasyInputMessageParam(role="user", content=content)
+
+
+@pytest.mark.parametrize(
+    "query, needs_rewrite",
+    [
+        ("What tents are good for winter camping?", False),
+        ("tents under $200", True),
+        ("Do you have a 2 person tent?", True),
+        ("cheapest hiking boots", True),
+        ("Show me Daybird jackets", True),
+        ("show me daybird jackets", True),
+        ("Do you have any daybirds?", False),
+    ],
+)
+def test_needs_query_rewrite(query, needs_rewrite):
+    flow_router = FlowRouter()
+    flow_router.set_brands(["Daybird", "Gravitator"])
+    assert flow_router.needs_query_rewrite([user_message(query)]) == needs_rewrite
+
+
+def test_needs_query_rewrite_follow_up():
+    flow_router = FlowRouter()
+    messages: list[ResponseInputItemParam] = [
+        user_message("What tents are good for winter camping?"),
+        EasyInputMessageParam(role="assistant", content="The Alpine Explorer Tent is a good choice."),
+        user_message("What about something lighter?"),
+    ]
+    assert flow_router.needs_query_rewrite(messages)
+
+
+def test_needs_query_rewrite_counts_routes():
+    flow_router = FlowRouter()
+    flow_router.needs_query_rewrite([user_message("warm jackets")])
+    flow_router.needs_query_rewrite([user_message("warm jackets")])
+    flow_router.needs_query_rewrite([user_message("jackets under 100")])
+    assert flow_router.stats() == {"simple": 2, "price_hint": 1}
+
+
+@pytest.mark.asyncio
+async def test_refresh_brands(db_session):
+    flow_router = FlowRouter(brands_ttl=300)
+    await flow_router.refresh_brands(db_session)
+    assert flow_router.needs_query_rewrite([user_message("daybird boots")])
+
+    # Brands are cached until they expire or are invalidated
+    flow_router.set_brands([])
+    await flow_router.refresh_brands(db_session)
+    assert not flow_router.needs_query_rewrite([user_message("daybird boots")])
+    flow_router.invalidate_brands()
+    await flow_router.refresh_brands(db_session)
+    assert flow_router.needs_query_rewrite([user_message("daybird boots")])
@@ -0,0 +1,45 @@
+from fastapi_app.api_models import Fusion, FusionMethod
+from fastapi_app.fusion import RankedCandidates, convex_combination, fuse_rankings, reciprocal_rank_fusion
+
+
+def test_reciprocal_rank_fusion():
+    vector_ranking = ([3, 1, 2], [1, 2, 3])
+    fulltext_ranking = ([2, 4], [1, 2])
+    # 2 is in both rankings, 3 and 1 beat 4 on rank, and 2's two scores beat 3's single first place
+    assert reciprocal_rank_fusion([vector_ranking, fulltext_ranking], k=60) == [2, 3, 1, 4]
+
+
+def test_reciprocal_rank_fusion_ties_ordered_by_id():
+    # Tied ranks, as RANK() gives rows with equal scores
+    assert reciprocal_rank_fusion([([9, 5, 7], [1, 1, 3])]) == [5, 9, 7]
+
+
+def test_reciprocal_rank_fusion_empty():
+    assert reciprocal_rank_fusion([]) == []
+    assert reciprocal_rank_fusion([([], []), ([], [])]) == []
+
+
+def test_reciprocal_rank_fusion_weighted():
+    vector_ranking = ([1, 2], [1, 2])
+    fulltext_ranking = ([2, 1], [1, 2])
+    assert reciprocal_rank_fusion([vector_ranking, fulltext_ranking], weights=[0.8, 0.2]) == [1, 2]
+    assert reciprocal_rank_fusion([vector_ranking, fulltext_ranking], weights=[0.2, 0.8]) == [2, 1]
+
+
+def test_convex_combination_normalizes_scores():
+    # Similarities and ts_rank_cd scores on very different scales
+    similarities = ([1, 2, 3], [0.9, 0.8, 0.7])
+    text_scores = ([3, 4], [40.0, 10.0])
+    assert convex_combination([similarities, text_scores], weights=[0.5, 0.5]) == [1, 3, 2, 4]
+    assert convex_combination([similarities, text_scores], weights=[1.0, 0.0]) == [1, 2, 3, 4]
+    # Equal scores all normalize to the top score
+    assert convex_combination([([5, 6], [0.3, 0.3])], weights=[1.0]) == [5, 6]
+
+
+def test_fuse_rankings():
+    vector = RankedCandidates(ids=[1, 2, 3], ranks=[1, 2, 3], scores=[0.9, 0.5, 0.1])
+    fulltext = RankedCandidates(ids=[3, 2], ranks=[1, 2], scores=[0.9, 0.1])
+    # 3 is first and third, so it narrowly beats 2, which is second in both
+    assert fuse_rankings(vector, fulltext, Fusion()) == [3, 2, 1]
+    assert fuse_rankings(vector, fulltext, Fusion(method=FusionMethod.WEIGHTED_RRF, vector_weight=1.0)) == [1, 2, 3]
+    assert fuse_rankings(vector, fulltext, Fusion(method=FusionMethod.CONVEX, vector_weight=0.4)) == [3, 1, 2]
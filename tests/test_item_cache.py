@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import text
+
+from fastapi_app.api_models import ItemPublic
+from fastapi_app.item_cache import ItemCache
+from fastapi_app.postgres_listener import parse_changed_ids
+from tests.data import test_data
+
+
+def test_parse_changed_ids():
+    assert parse_changed_ids("UPDATE:1,2,3") == {1, 2, 3}
+    assert parse_changed_ids("DELETE:7") == {7}
+    # Without ids, any row may have changed
+    assert parse_changed_ids("TRUNCATE") is None
+    assert parse_changed_ids("UPDATE") is None
+    assert parse_changed_ids(None) is None
+
+
+@pytest.mark.asyncio
+async def test_item_cache_loads_missing_items_in_order(db_session):
+    cache = ItemCache(maxsize=10)
+    items = await cache.get_items(db_session, [3, test_data.id, 2])
+    assert [item.id for item in items] == [3, test_data.id, 2]
+    assert items[1] == ItemPublic(**test_data.model_dump())
+    assert cache.stats() == {"size": 3, "hits": 0, "misses": 3}
+
+    cached_items = await cache.get_items(db_session, [test_data.id, 4])
+    assert cached_items[0] is items[1]
+    assert cache.stats() == {"size": 4, "hits": 1, "misses": 4}
+
+
+@pytest.mark.asyncio
+async def test_item_cache_skips_missing_ids(db_session):
+    cache = ItemCache(maxsize=10)
+    assert await cache.get_item(db_session, 1_000_000) is None
+    assert [item.id for item in await cache.get_items(db_session, [1_000_000, test_data.id])] == [test_data.id]
+
+
+@pytest.mark.asyncio
+async def test_item_cache_invalidated_by_notification(db_session):
+    cache = ItemCache(maxsize=10)
+    await cache.get_items(db_session, [1, 2, 3])
+    await db_session.execute(text("UPDATE items SET price = 1.5 WHERE id = 2"))
+
+    cache.on_items_changed("UPDATE:2")
+    assert len(cache) == 2
+    item = await cache.get_item(db_session, 2)
+    assert item is not None
+    assert item.price == 1.5
+
+    cache.on_items_changed(None)
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_item_cache_does_not_store_items_read_before_a_change(db_session, monkeypatch):
+    cache = ItemCache(maxsize=10)
+    execute = db_session.execute
+
+    async def execute_then_notify(*args, **kwargs):
+        result = await execute(*args, **kwargs)
+        # A change is notified while the rows are being read
+        cache.on_items_changed("UPDATE:1")
+        return result
+
+    monkeypatch.setattr(db_session, "execute", execute_then_notify)
+    items = await cache.get_items(db_session, [1, 2])
+    assert [item.id for item in items] == [1, 2]
+    assert len(cache) == 0
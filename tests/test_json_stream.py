@@ -0,0 +1,46 @@
+import io
+import json
+
+import pytest
+
+from fastapi_app.json_stream import iter_batches, iter_json_array, write_json_array
+
+ELEMENTS = [
+    {"id": 1, "name": "Trail boots [black]", "description": 'Escaped "quotes", commas, and } braces', "price": 109.99},
+    {"id": 2, "embedding": [0.1, -2.5e-05, 3], "tags": []},
+    12345678,
+    "plain string",
+    None,
+    [],
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1 << 16])
+@pytest.mark.parametrize("indent", [None, 4])
+def test_iter_json_array(chunk_size, indent):
+    text = json.dumps(ELEMENTS, indent=indent)
+    assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == ELEMENTS
+
+
+@pytest.mark.parametrize("text", ["[]", "  [ \n ]  "])
+def test_iter_json_array_empty(text):
+    assert list(iter_json_array(io.StringIO(text), chunk_size=1)) == []
+
+
+@pytest.mark.parametrize("text", ['{"id": 1}', '[{"id": 1} {"id": 2}]', '[{"id": 1},', '[{"id": 1'])
+def test_iter_json_array_invalid(text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(text), chunk_size=4))
+
+
+@pytest.mark.parametrize("elements", [ELEMENTS, []])
+@pytest.mark.parametrize("indent", [None, 4])
+def test_write_json_array_matches_json_dump(elements, indent):
+    f = io.StringIO()
+    write_json_array(f, iter(elements), indent=indent)
+    assert f.getvalue() == json.dumps(elements, indent=indent)
+
+
+def test_iter_batches():
+    assert list(iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_batches([], 2)) == []
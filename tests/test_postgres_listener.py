@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_listener import PostgresListener
+from tests.data import test_data
+
+
+@pytest.mark.asyncio
+async def test_postgres_listener_notified_on_items_change(app, mock_azure_credential):
+    engine = await create_postgres_engine_from_env()
+    listener = PostgresListener(engine)
+    payloads = []
+    listener.add_callback(payloads.append)
+    await listener.start()
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text("UPDATE items SET price = price WHERE id = :id"), {"id": test_data.id})
+        for _ in range(50):
+            if payloads:
+                break
+            await asyncio.sleep(0.05)
+        assert payloads == [f"UPDATE:{test_data.id}"]
+    finally:
+        await listener.stop()
+        await engine.dispose()
@@ -1,6 +1,14 @@
 import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
-from fastapi_app.api_models import Filter, ItemPublic
+from fastapi_app.api_models import Filter, Fusion, FusionMethod, ItemPublic, SearchEffort, SearchFilter, SearchQuery
+from fastapi_app.caching import AsyncLRUCache
+from fastapi_app.item_cache import ItemCache
+from fastapi_app.postgres_models import VectorIndexSpec
+from fastapi_app.postgres_searcher import PostgresSearcher
+from fastapi_app.semantic_cache import SemanticSearchCache
+from fastapi_app.setup_postgres_database import QUANTIZED_EMBEDDINGS_MIN_PGVECTOR_VERSION, add_quantized_embeddings
 from tests.data import test_data
 
 
@@ -31,6 +39,17 @@ def test_postgres_build_filter_clause_with_filters_numeric(postgres_searcher):
     )
 
 
+def test_postgres_build_filter_clause_escapes_quotes(postgres_searcher):
+    assert postgres_searcher.build_filter_clause(
+        [
+            Filter(column="brand", comparison_operator="=", value="Trek'n"),
+        ]
+    ) == (
+        "WHERE brand = 'Trek''n'",
+        "AND brand = 'Trek''n'",
+    )
+
+
 @pytest.mark.asyncio
 async def test_postgres_searcher_search_empty_text_search(postgres_searcher):
     assert await postgres_searcher.search("", [], 5, None) == []
@@ -38,9 +57,9 @@ async def test_postgres_searcher_search_empty_text_search(postgres_searcher):
 
 @pytest.mark.asyncio
 async def test_postgres_searcher_search(postgres_searcher):
-    assert (await postgres_searcher.search(test_data.name, test_data.embeddings, 5, None))[0].to_dict() == ItemPublic(
+    assert (await postgres_searcher.search(test_data.name, test_data.embeddings, 5, None))[0] == ItemPublic(
         **test_data.model_dump()
-    ).model_dump()
+    )
 
 
 @pytest.mark.asyncio
@@ -51,6 +70,292 @@ async def test_postgres_searcher_search_and_embed_empty_text_search(postgres_sea
 @pytest.mark.asyncio
 async def test_postgres_searcher_search_and_embed(postgres_searcher):
     assert await postgres_searcher.search_and_embed("", 5, False, True) == []
-    assert (await postgres_searcher.search_and_embed(test_data.name, 5, True))[0].to_dict() == ItemPublic(
+    assert (await postgres_searcher.search_and_embed(test_data.name, 5, True))[0] == ItemPublic(
         **test_data.model_dump()
-    ).model_dump()
+    )
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_vector_only_top(postgres_searcher):
+    results = await postgres_searcher.search(None, test_data.embeddings, 3, None)
+    assert len(results) == 3
+    assert results[0] == ItemPublic(**test_data.model_dump())
+    assert len({item.id for item in results}) == 3
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_text_only(postgres_searcher):
+    results = await postgres_searcher.search(test_data.name, [], 1, None)
+    assert [item.id for item in results] == [test_data.id]
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_top_exceeds_candidate_pool(postgres_searcher):
+    postgres_searcher.candidate_pool = 5
+    results = await postgres_searcher.search(None, test_data.embeddings, 10, None)
+    assert len(results) == 10
+
+
+def test_postgres_searcher_invalid_iterative_scan(postgres_searcher):
+    with pytest.raises(ValueError):
+        PostgresSearcher(
+            db_session=postgres_searcher.db_session,
+            openai_embed_client=postgres_searcher.openai_embed_client,
+            embed_deployment="text-embedding-3-large",
+            embed_model="text-embedding-3-large",
+            embed_dimensions=1024,
+            embedding_column="embedding_3l",
+            iterative_scan="sideways",
+        )
+
+
+def test_postgres_searcher_concurrent_hybrid_execution_requires_sessionmaker(postgres_searcher):
+    with pytest.raises(ValueError):
+        PostgresSearcher(
+            db_session=postgres_searcher.db_session,
+            openai_embed_client=postgres_searcher.openai_embed_client,
+            embed_deployment="text-embedding-3-large",
+            embed_model="text-embedding-3-large",
+            embed_dimensions=1024,
+            embedding_column="embedding_3l",
+            hybrid_execution="concurrent",
+        )
+
+
+def test_postgres_searcher_invalid_vector_search_mode(postgres_searcher):
+    with pytest.raises(ValueError):
+        PostgresSearcher(
+            db_session=postgres_searcher.db_session,
+            openai_embed_client=postgres_searcher.openai_embed_client,
+            embed_deployment="text-embedding-3-large",
+            embed_model="text-embedding-3-large",
+            embed_dimensions=1024,
+            embedding_column="embedding_3l",
+            vector_search_mode="int8",
+        )
+
+
+def test_postgres_searcher_two_stage_index_settings(postgres_searcher):
+    postgres_searcher.vector_search_mode = "binary"
+    postgres_searcher.coarse_candidates = 100
+    # The index must return the whole pool of candidates to rescore
+    assert postgres_searcher.build_index_settings(True, False, 20, None) == {"hnsw.ef_search": "100"}
+    assert postgres_searcher.build_index_settings(True, False, 200, SearchEffort.LOW) == {"hnsw.ef_search": "200"}
+    postgres_searcher.coarse_candidates = 50
+    assert postgres_searcher.build_index_settings(True, False, 20, SearchEffort.HIGH) == {"hnsw.ef_search": "100"}
+    assert postgres_searcher.build_index_settings(False, False, 20, None) == {}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("vector_search_mode", ["halfvec", "binary"])
+async def test_postgres_searcher_search_two_stage(postgres_searcher, vector_search_mode):
+    pgvector_version = (
+        await postgres_searcher.db_session.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'"))
+    ).scalar()
+    if tuple(int(part) for part in pgvector_version.split(".")) < QUANTIZED_EMBEDDINGS_MIN_PGVECTOR_VERSION:
+        pytest.skip(f"Quantized embeddings require pgvector 0.7.0+, the database has {pgvector_version}")
+    # The columns are added in the test's transaction, which is rolled back
+    connection = await postgres_searcher.db_session.connection()
+    await connection.run_sync(add_quantized_embeddings)
+    full_results = await postgres_searcher.search(None, test_data.embeddings, 5, None)
+    postgres_searcher.vector_search_mode = vector_search_mode
+    results = await postgres_searcher.search(None, test_data.embeddings, 5, None)
+    assert results[0] == ItemPublic(**test_data.model_dump())
+    assert [item.id for item in results] == [item.id for item in full_results]
+    hybrid_results = await postgres_searcher.search(test_data.name, test_data.embeddings, 5, None)
+    assert hybrid_results[0].id == test_data.id
+
+
+def test_postgres_searcher_matryoshka_requires_truncated_embeddings(postgres_searcher):
+    with pytest.raises(ValueError):
+        PostgresSearcher(
+            db_session=postgres_searcher.db_session,
+            openai_embed_client=postgres_searcher.openai_embed_client,
+            embed_deployment=None,
+            embed_model="nomic-embed-text",
+            embed_dimensions=None,
+            embedding_column="embedding_nomic",
+            vector_search_mode="matryoshka",
+        )
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_matryoshka(postgres_searcher):
+    full_results = await postgres_searcher.search(None, test_data.embeddings, 5, None)
+    postgres_searcher.vector_search_mode = "matryoshka"
+    results = await postgres_searcher.search(None, test_data.embeddings, 5, None)
+    assert results[0] == ItemPublic(**test_data.model_dump())
+    assert [item.id for item in results] == [item.id for item in full_results]
+    ef_search = (await postgres_searcher.db_session.execute(text("SHOW hnsw.ef_search"))).scalar()
+    assert ef_search == "100"
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_hybrid_concurrently(postgres_searcher):
+    statement_results = await postgres_searcher.search(test_data.name, test_data.embeddings, 20, None)
+    postgres_searcher.hybrid_execution = "concurrent"
+    postgres_searcher.sessionmaker = async_sessionmaker(postgres_searcher.db_session.bind)
+    concurrent_results = await postgres_searcher.search(test_data.name, test_data.embeddings, 20, None)
+    assert concurrent_results[0] == ItemPublic(**test_data.model_dump())
+    # Both fuse the same rankings, only the order of tied scores may differ
+    assert {item.id for item in concurrent_results} == {item.id for item in statement_results}
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_hybrid_concurrently_filters(postgres_searcher):
+    postgres_searcher.hybrid_execution = "concurrent"
+    postgres_searcher.sessionmaker = async_sessionmaker(postgres_searcher.db_session.bind)
+    postgres_searcher.item_cache = ItemCache(maxsize=10)
+    results = await postgres_searcher.search(
+        "tent", test_data.embeddings, 5, [Filter(column="price", comparison_operator="<", value=30)]
+    )
+    assert 0 < len(results) <= 5
+    assert all(item.price < 30 for item in results)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("hybrid_execution", ["statement", "concurrent"])
+@pytest.mark.parametrize("method", list(FusionMethod))
+async def test_postgres_searcher_search_fusion(postgres_searcher, hybrid_execution, method):
+    postgres_searcher.hybrid_execution = hybrid_execution
+    postgres_searcher.sessionmaker = async_sessionmaker(postgres_searcher.db_session.bind)
+    fusion = Fusion(method=method)
+    results = await postgres_searcher.search(test_data.name, test_data.embeddings, 5, None, fusion=fusion)
+    assert results[0] == ItemPublic(**test_data.model_dump())
+    assert len(results) == 5
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_fusion_vector_weight(postgres_searcher):
+    vector_results = await postgres_searcher.search(None, test_data.embeddings, 5)
+    # With all the weight on the vector search, the text search only adds candidates after the vector candidates
+    convex_results = await postgres_searcher.search(
+        test_data.name, test_data.embeddings, 5, fusion=Fusion(method=FusionMethod.CONVEX, vector_weight=1.0)
+    )
+    assert [item.id for item in convex_results] == [item.id for item in vector_results]
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_and_embed_semantic_cache_fusion(postgres_searcher):
+    postgres_searcher.semantic_cache = SemanticSearchCache(maxsize=10, max_distance=0.05)
+    await postgres_searcher.search_and_embed(test_data.name, 3, True, True)
+    await postgres_searcher.search_and_embed(test_data.name, 3, True, True, fusion=Fusion(method=FusionMethod.CONVEX))
+    assert postgres_searcher.semantic_cache.stats()["hits"] == 0
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_effort(postgres_searcher):
+    results = await postgres_searcher.search(None, test_data.embeddings, 5, None, SearchEffort.HIGH)
+    assert results[0].id == test_data.id
+    ef_search = (await postgres_searcher.db_session.execute(text("SHOW hnsw.ef_search"))).scalar()
+    assert ef_search == "100"
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_effort_at_least_candidates(postgres_searcher):
+    postgres_searcher.default_search_effort = SearchEffort.LOW
+    await postgres_searcher.search(None, test_data.embeddings, 50, None)
+    ef_search = (await postgres_searcher.db_session.execute(text("SHOW hnsw.ef_search"))).scalar()
+    assert ef_search == "50"
+
+
+def test_postgres_searcher_ivfflat_index_settings(postgres_searcher):
+    postgres_searcher.vector_index = VectorIndexSpec.parse("ivfflat:lists=100")
+    # Probes scale with the square root of the number of lists, with the medium effort by default
+    assert postgres_searcher.build_index_settings(True, False, 20, None) == {"ivfflat.probes": "10"}
+    assert postgres_searcher.build_index_settings(True, False, 20, SearchEffort.LOW) == {"ivfflat.probes": "5"}
+    assert postgres_searcher.build_index_settings(True, False, 20, SearchEffort.HIGH) == {"ivfflat.probes": "20"}
+    assert postgres_searcher.build_index_settings(False, False, 20, SearchEffort.HIGH) == {}
+    postgres_searcher.vector_index = VectorIndexSpec.parse("ivfflat:lists=2")
+    assert postgres_searcher.build_index_settings(True, False, 20, SearchEffort.HIGH) == {"ivfflat.probes": "2"}
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_ivfflat_probes(postgres_searcher):
+    postgres_searcher.vector_index = VectorIndexSpec.parse("ivfflat:lists=400")
+    postgres_searcher.default_search_effort = SearchEffort.HIGH
+    await postgres_searcher.search(None, test_data.embeddings, 5, None)
+    probes = (await postgres_searcher.db_session.execute(text("SHOW ivfflat.probes"))).scalar()
+    assert probes == "40"
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_and_embed_semantic_cache(postgres_searcher):
+    postgres_searcher.semantic_cache = SemanticSearchCache(maxsize=10, max_distance=0.05)
+    first = await postgres_searcher.search_and_embed(test_data.name, 3, True, True)
+    second = await postgres_searcher.search_and_embed("a paraphrase with the same embedding", 3, True, True)
+    assert second is first
+    filtered = await postgres_searcher.search_and_embed(
+        test_data.name, 3, True, True, [Filter(column="brand", comparison_operator="=", value="Daybird")]
+    )
+    assert filtered is not first
+    assert postgres_searcher.semantic_cache.stats() == {"size": 2, "hits": 1, "misses": 2}
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_and_embed_semantic_cache_cleared_during_search(postgres_searcher):
+    semantic_cache: SemanticSearchCache[list[ItemPublic]] = SemanticSearchCache(maxsize=10, max_distance=0.05)
+    postgres_searcher.semantic_cache = semantic_cache
+    search_and_rerank = postgres_searcher.search_and_rerank
+
+    async def search_and_rerank_during_change(*args):
+        results = await search_and_rerank(*args)
+        # An items_changed notification arrives before the search returns
+        semantic_cache.clear()
+        return results
+
+    postgres_searcher.search_and_rerank = search_and_rerank_during_change
+    await postgres_searcher.search_and_embed(test_data.name, 3, True, True)
+    assert len(semantic_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_batch_matches_single_searches(postgres_searcher):
+    queries = [
+        SearchQuery(query=test_data.name, top=3),
+        SearchQuery(query=test_data.name, top=1, enable_vector_search=False),
+        SearchQuery(
+            query=test_data.name,
+            top=2,
+            enable_text_search=False,
+            filters=[SearchFilter(column="price", comparison_operator="<", value=30)],
+        ),
+        SearchQuery(query="nothing to search", enable_vector_search=False, enable_text_search=False),
+    ]
+    results = await postgres_searcher.search_batch(queries)
+    assert len(results) == 4
+    for query, query_results in zip(queries[:3], results):
+        assert query_results == await postgres_searcher.search_and_embed(
+            query.query, query.top, query.enable_vector_search, query.enable_text_search, query.filters
+        )
+    assert results[0][0] == ItemPublic(**test_data.model_dump())
+    assert all(item.price < 30 for item in results[2])
+    assert results[3] == []
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_batch_one_embeddings_request(postgres_searcher, monkeypatch):
+    postgres_searcher.embedding_cache = AsyncLRUCache(maxsize=10)
+    await postgres_searcher.embed_query("cached query")
+    requests = []
+    create = postgres_searcher.openai_embed_client.embeddings.create
+
+    async def record_create(*args, **kwargs):
+        requests.append(kwargs["input"])
+        return await create(*args, **kwargs)
+
+    monkeypatch.setattr(postgres_searcher.openai_embed_client.embeddings, "create", record_create)
+    queries = [SearchQuery(query=query) for query in ("Cached  Query", "first", "second", "FIRST")]
+    results = await postgres_searcher.search_batch(queries)
+    assert [len(query_results) for query_results in results] == [5, 5, 5, 5]
+    # Only the uncached queries are embedded, once each
+    assert requests == [["first", "second"]]
+    assert postgres_searcher.embedding_cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_batch_item_cache(postgres_searcher):
+    queries = [SearchQuery(query=test_data.name, top=3), SearchQuery(query="tent", top=2)]
+    uncached = await postgres_searcher.search_batch(queries)
+    postgres_searcher.item_cache = ItemCache(maxsize=10)
+    assert await postgres_searcher.search_batch(queries) == uncached
@@ -0,0 +1,182 @@
+import asyncio
+import copy
+
+import openai
+import pytest
+from openai import AsyncOpenAI
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fastapi_app.api_models import BrandFilter, ChatRequestOverrides
+from fastapi_app.caching import AsyncLRUCache
+from fastapi_app.rag_advanced import AdvancedRAGChat
+from fastapi_app.rag_agents import create_rag_agents
+
+
+def create_chat(postgres_searcher, query: str, speculative_search: bool = True, **kwargs) -> AdvancedRAGChat:
+    return AdvancedRAGChat(
+        messages=[{"role": "user", "content": query}],
+        overrides=ChatRequestOverrides(top=1, retrieval_mode="hybrid"),
+        searcher=postgres_searcher,
+        agents=create_rag_agents(AsyncOpenAI(api_key="fakekey"), "gpt-5.4", "gpt-5.4"),
+        speculative_search=speculative_search,
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_search_database_reuses_speculative_search(postgres_searcher):
+    chat = create_chat(postgres_searcher, "Climbing gear  OUTSIDE")
+    chat._speculative_search_task = asyncio.create_task(chat.search_speculatively())
+
+    results = await chat.search_database("climbing gear outside")
+
+    assert chat.used_speculative_search
+    assert chat._speculative_search_task is None
+    expected = await postgres_searcher.search_and_embed("climbing gear outside", 1, True, True)
+    assert [item.id for item in results.items] == [item.id for item in expected]
+
+
+@pytest.mark.asyncio
+async def test_search_database_discards_speculative_search_with_filters(postgres_searcher):
+    chat = create_chat(postgres_searcher, "climbing gear outside")
+    task = asyncio.create_task(chat.search_speculatively())
+    chat._speculative_search_task = task
+
+    results = await chat.search_database(
+        "climbing gear outside", brand_filter=BrandFilter(comparison_operator="=", value="Daybird")
+    )
+
+    assert not chat.used_speculative_search
+    assert task.done()
+    assert all(item.brand == "Daybird" for item in results.items)
+
+
+@pytest.mark.asyncio
+async def test_prepare_context_discards_speculative_search_for_rewritten_query(
+    postgres_searcher, mock_openai_chatcompletion
+):
+    chat = create_chat(postgres_searcher, "What is the capital of France?")
+
+    items, thoughts = await chat.prepare_context()
+
+    assert not chat.used_speculative_search
+    assert chat._speculative_search_task is None
+    assert thoughts[1].description == "climbing gear outside"
+    assert thoughts[1].props["speculative_search"] is False
+
+
+@pytest.mark.asyncio
+async def test_prepare_context_concurrent_flows_share_discarded_speculative_embedding(
+    postgres_searcher, mock_openai_chatcompletion, monkeypatch
+):
+    create_embedding = openai.resources.AsyncEmbeddings.create
+    embedded_inputs: list[str] = []
+
+    async def slow_create_embedding(self, *args, **kwargs):
+        embedded_inputs.append(kwargs["input"])
+        # The query rewrite finishes while the speculative search is still embedding the question
+        await asyncio.sleep(0.05)
+        return await create_embedding(self, *args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.AsyncEmbeddings, "create", slow_create_embedding)
+    postgres_searcher.embedding_cache = AsyncLRUCache(maxsize=10)
+    other_searcher = copy.copy(postgres_searcher)
+    async with async_sessionmaker(postgres_searcher.db_session.bind)() as other_session:
+        other_searcher.db_session = other_session
+        chats = [
+            create_chat(searcher, "What is the capital of France?") for searcher in (postgres_searcher, other_searcher)
+        ]
+        results = await asyncio.gather(*[chat.prepare_context() for chat in chats])
+
+    assert all(thoughts[1].description == "climbing gear outside" for _, thoughts in results)
+    assert not any(chat.used_speculative_search for chat in chats)
+    # The discarded speculative searches shared one embedding of the question, which finished into the cache
+    assert embedded_inputs.count("What is the capital of France?") == 1
+    await postgres_searcher.embed_query("What is the capital of France?")
+    assert embedded_inputs.count("What is the capital of France?") == 1
+
+
+@pytest.mark.asyncio
+async def test_prepare_context_reuses_cached_query_rewrite(postgres_searcher, mock_openai_chatcompletion):
+    query_rewrite_cache = AsyncLRUCache(maxsize=10)
+    chat = create_chat(
+        postgres_searcher,
+        "What is the capital of France?",
+        speculative_search=False,
+        query_rewrite_cache=query_rewrite_cache,
+    )
+    items, thoughts = await chat.prepare_context()
+    assert thoughts[1].props["cached"] is False
+
+    # The same question with different case and spacing reuses the search arguments
+    cached_chat = create_chat(
+        postgres_searcher,
+        "what is the capital of  France?",
+        speculative_search=False,
+        query_rewrite_cache=query_rewrite_cache,
+    )
+    cached_items, cached_thoughts = await cached_chat.prepare_context()
+
+    assert query_rewrite_cache.stats()["hits"] == 1
+    assert "cached" not in cached_thoughts[0].props
+    assert cached_thoughts[1].props["cached"] is True
+    assert cached_thoughts[1].description == "climbing gear outside"
+    assert [item.id for item in cached_items] == [item.id for item in items]
+    assert cached_thoughts[0].description[-1]["content"].endswith("what is the capital of  France?")
+
+
+@pytest.mark.asyncio
+async def test_prepare_context_survives_cancelled_coalesced_query_rewrite(
+    postgres_searcher, mock_openai_chatcompletion, monkeypatch
+):
+    query_rewrite_cache: AsyncLRUCache = AsyncLRUCache(maxsize=10)
+    other_searcher = copy.copy(postgres_searcher)
+    async with async_sessionmaker(postgres_searcher.db_session.bind)() as other_session:
+        other_searcher.db_session = other_session
+        leader, follower = [
+            create_chat(searcher, "What is the capital of France?", query_rewrite_cache=query_rewrite_cache)
+            for searcher in (postgres_searcher, other_searcher)
+        ]
+        run_search_agent = leader.run_search_agent
+
+        async def slow_run_search_agent(all_messages):
+            await asyncio.sleep(0.05)
+            return await run_search_agent(all_messages)
+
+        monkeypatch.setattr(leader, "run_search_agent", slow_run_search_agent)
+        leader_task = asyncio.create_task(leader.prepare_context())
+        await asyncio.sleep(0.01)
+        follower_task = asyncio.create_task(follower.prepare_context())
+        await asyncio.sleep(0.01)
+        # The leader's client disconnects while the follower waits on its query rewrite
+        leader_task.cancel()
+
+        items, thoughts = await follower_task
+
+    assert leader_task.cancelled()
+    assert thoughts[1].description == "climbing gear outside"
+    assert query_rewrite_cache.stats()["coalesced"] == 1
+
+
+@pytest.mark.asyncio
+async def test_prepare_context_steps_reports_search_arguments_before_results(
+    postgres_searcher, mock_openai_chatcompletion
+):
+    chat = create_chat(postgres_searcher, "What is the capital of France?", speculative_search=False)
+    steps = chat.prepare_context_steps()
+
+    # The prompt is reported before the query rewrite runs
+    prompt_thought = await steps.__anext__()
+    assert prompt_thought.title == "Prompt to generate search arguments"
+    assert chat._query_rewrite is None
+
+    search_arguments_thought = await steps.__anext__()
+    assert search_arguments_thought.title == "Search using generated search arguments"
+    assert search_arguments_thought.description == "climbing gear outside"
+    assert not hasattr(chat, "context_items")
+
+    results_thought = await steps.__anext__()
+    assert results_thought.title == "Search results"
+    assert results_thought.description == chat.context_items
+    with pytest.raises(StopAsyncIteration):
+        await steps.__anext__()
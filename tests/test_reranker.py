@@ -0,0 +1,103 @@
+import asyncio
+import math
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from fastapi_app.api_models import ItemPublic
+from fastapi_app.reranker import HTTPReranker, LexicalReranker, Reranker, create_reranker, rerank
+from fastapi_app.semantic_cache import SemanticSearchCache
+from tests.data import test_data
+
+
+def make_item(id: int, name: str) -> ItemPublic:
+    return ItemPublic(id=id, type="Gear", brand="Daybird", name=name, description=f"The {name}.", price=10.0)
+
+
+class SlowReranker(Reranker):
+    async def score(self, query: str, documents: list[str]) -> list[float]:
+        await asyncio.sleep(1)
+        return [0.0] * len(documents)
+
+
+class FailingReranker(Reranker):
+    async def score(self, query: str, documents: list[str]) -> list[float]:
+        raise RuntimeError("Rerank endpoint is down")
+
+
+@pytest.mark.asyncio
+async def test_lexical_reranker_scores_matching_documents_higher():
+    scores = await LexicalReranker().score(
+        "waterproof hiking boots", ["A warm winter jacket", "Waterproof hiking boots for trails", "Hiking poles"]
+    )
+    assert scores[1] > scores[2] > scores[0] == 0
+    assert await LexicalReranker().score("boots", []) == []
+
+
+@pytest.mark.asyncio
+async def test_rerank_reorders_and_cuts_to_top():
+    items = [make_item(1, "Winter Jacket"), make_item(2, "Hiking Poles"), make_item(3, "Hiking Boots")]
+    reranked = await rerank(LexicalReranker(), "hiking boots", items, top=2, timeout=1)
+    assert reranked is not None
+    assert [item.id for item in reranked] == [3, 2]
+
+
+@pytest.mark.asyncio
+async def test_rerank_gives_up_on_timeout_or_failure():
+    items = [make_item(1, "Winter Jacket"), make_item(2, "Hiking Boots")]
+    assert await rerank(SlowReranker(), "hiking boots", items, top=1, timeout=0.01) is None
+    assert await rerank(FailingReranker(), "hiking boots", items, top=1, timeout=1) is None
+
+
+@pytest.mark.asyncio
+async def test_http_reranker_scores_documents_in_one_request():
+    requests = []
+
+    async def handle_rerank(request: web.Request) -> web.Response:
+        requests.append((request.headers.get("Authorization"), await request.json()))
+        # Scores are listed by relevance, and the last document isn't scored
+        results = [{"index": 1, "relevance_score": 0.9}, {"index": 0, "relevance_score": 0.2}]
+        return web.json_response({"results": results})
+
+    app = web.Application()
+    app.router.add_post("/rerank", handle_rerank)
+    async with TestServer(app) as server:
+        reranker = HTTPReranker(str(server.make_url("/rerank")), api_key="secret", model="rerank-model")
+        scores = await reranker.score("boots", ["jacket", "boots", "poles"])
+        await reranker.close()
+
+    assert scores == [0.2, 0.9, -math.inf]
+    assert requests == [
+        ("Bearer secret", {"query": "boots", "documents": ["jacket", "boots", "poles"], "model": "rerank-model"})
+    ]
+
+
+def test_create_reranker():
+    assert create_reranker(None, None, None, None) is None
+    assert isinstance(create_reranker("lexical", None, None, None), LexicalReranker)
+    assert isinstance(create_reranker("http", "https://example.com/rerank", None, None), HTTPReranker)
+    with pytest.raises(ValueError):
+        create_reranker("http", None, None, None)
+    with pytest.raises(ValueError):
+        create_reranker("crossencoder", None, None, None)
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_and_embed_reranks_candidates(postgres_searcher):
+    postgres_searcher.reranker = LexicalReranker()
+    postgres_searcher.rerank_candidates = 10
+    results = await postgres_searcher.search_and_embed(test_data.name, 3, True, True)
+    assert len(results) == 3
+    assert results[0] == ItemPublic(**test_data.model_dump())
+
+
+@pytest.mark.asyncio
+async def test_postgres_searcher_search_and_embed_rerank_timeout(postgres_searcher):
+    first_stage = await postgres_searcher.search_and_embed(test_data.name, 3, True, True)
+    postgres_searcher.reranker = SlowReranker()
+    postgres_searcher.rerank_timeout = 0.01
+    postgres_searcher.semantic_cache = SemanticSearchCache(maxsize=10, max_distance=0.05)
+    assert await postgres_searcher.search_and_embed(test_data.name, 3, True, True) == first_stage
+    # Results in search order aren't cached
+    assert len(postgres_searcher.semantic_cache) == 0
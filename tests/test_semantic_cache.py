@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from fastapi_app.semantic_cache import SemanticSearchCache
+
+
+def test_semantic_cache_hit_for_similar_vector():
+    cache: SemanticSearchCache[list[int]] = SemanticSearchCache(maxsize=4, max_distance=0.05)
+    cache.store([1.0, 0.0, 0.0], "key", [1, 2, 3])
+    assert cache.lookup([0.99, 0.01, 0.0], "key") == [1, 2, 3]
+    assert cache.lookup([0.0, 1.0, 0.0], "key") is None
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_semantic_cache_miss_for_different_key():
+    cache: SemanticSearchCache[list[int]] = SemanticSearchCache(maxsize=4, max_distance=0.05)
+    cache.store([1.0, 0.0], ("brand", "=", "Daybird"), [1])
+    assert cache.lookup([1.0, 0.0], ("brand", "=", "AirStrider")) is None
+    assert cache.lookup([1.0, 0.0], ("brand", "=", "Daybird")) == [1]
+
+
+def test_semantic_cache_returns_closest_entry():
+    cache: SemanticSearchCache[str] = SemanticSearchCache(maxsize=4, max_distance=0.5)
+    cache.store([1.0, 0.0], "key", "x-axis")
+    cache.store([0.8, 0.6], "key", "diagonal")
+    assert cache.lookup([0.7, 0.7], "key") == "diagonal"
+    assert cache.lookup([1.0, 0.1], "key") == "x-axis"
+
+
+def test_semantic_cache_evicts_least_recently_used():
+    cache: SemanticSearchCache[int] = SemanticSearchCache(maxsize=2, max_distance=0.01)
+    cache.store([1.0, 0.0], "key", 1)
+    cache.store([0.0, 1.0], "key", 2)
+    assert cache.lookup([1.0, 0.0], "key") == 1
+    cache.store([-1.0, 0.0], "other", 3)
+    assert cache.lookup([0.0, 1.0], "key") is None
+    assert cache.lookup([1.0, 0.0], "key") == 1
+    assert cache.lookup([-1.0, 0.0], "other") == 3
+    assert len(cache) == 2
+
+
+def test_semantic_cache_compacts_keys():
+    cache: SemanticSearchCache[int] = SemanticSearchCache(maxsize=2, max_distance=0.01)
+    for i in range(10):
+        cache.store([1.0, float(i)], f"key-{i}", i)
+    assert len(cache._keys) <= 2
+    assert cache.lookup([1.0, 9.0], "key-9") == 9
+    assert cache.lookup([1.0, 8.0], "key-8") == 8
+
+
+def test_semantic_cache_ttl_and_clear():
+    cache: SemanticSearchCache[int] = SemanticSearchCache(maxsize=2, max_distance=0.01, ttl=-1)
+    cache.store([1.0, 0.0], "key", 1)
+    assert cache.lookup([1.0, 0.0], "key") is None
+    cache = SemanticSearchCache(maxsize=2, max_distance=0.01)
+    cache.store(np.array([1.0, 0.0]), "key", 1)
+    cache.clear()
+    assert cache.lookup([1.0, 0.0], "key") is None
+
+
+def test_semantic_cache_skips_store_after_clear():
+    cache: SemanticSearchCache[int] = SemanticSearchCache(maxsize=2, max_distance=0.01)
+    generation = cache.generation
+    # The items table changed while the search ran
+    cache.clear()
+    cache.store([1.0, 0.0], "key", 1, generation)
+    assert cache.lookup([1.0, 0.0], "key") is None
+    cache.store([1.0, 0.0], "key", 2, cache.generation)
+    assert cache.lookup([1.0, 0.0], "key") == 2
+
+
+def test_semantic_cache_invalid_maxsize():
+    with pytest.raises(ValueError):
+        SemanticSearchCache(maxsize=0, max_distance=0.05)
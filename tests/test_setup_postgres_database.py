@@ -0,0 +1,78 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.postgres_models import DEFAULT_VECTOR_INDEX, VectorIndexSpec
+from fastapi_app.setup_postgres_database import configure_vector_indexes, upgrade_existing_tables
+
+
+@pytest_asyncio.fixture
+async def connection(app, mock_azure_credential):
+    """A connection whose changes are rolled back at the end of the test, keeping the default indexes intact."""
+    engine = await create_postgres_engine_from_env()
+    async with engine.connect() as connection:
+        await connection.begin()
+        yield connection
+        await connection.rollback()
+    await engine.dispose()
+
+
+async def embedding_3l_indexes(connection) -> dict[str, str]:
+    rows = await connection.execute(
+        text(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'items' AND indexdef LIKE '%(embedding_3l %'"
+        )
+    )
+    return {row.indexname: row.indexdef for row in rows}
+
+
+def test_vector_index_spec_parse():
+    assert VectorIndexSpec.parse("hnsw:m=32,ef_construction=128") == VectorIndexSpec(
+        "hnsw", {"m": 32, "ef_construction": 128}
+    )
+    assert VectorIndexSpec.parse("ivfflat:lists=100") == VectorIndexSpec("ivfflat", {"lists": 100})
+    assert VectorIndexSpec.parse("ivfflat") == VectorIndexSpec("ivfflat", {})
+    assert str(VectorIndexSpec.parse(str(DEFAULT_VECTOR_INDEX))) == "hnsw:m=16,ef_construction=64"
+
+
+@pytest.mark.parametrize("spec", ["diskann:lists=10", "hnsw:lists=10", "ivfflat:lists=many", "ivfflat:lists=0"])
+def test_vector_index_spec_parse_invalid(spec):
+    with pytest.raises(ValueError):
+        VectorIndexSpec.parse(spec)
+
+
+def test_vector_index_spec_create_index_sql():
+    assert VectorIndexSpec.parse("ivfflat:lists=10").create_index_sql("items", "embedding_3l") == (
+        "CREATE INDEX ivfflat_index_for_cosine_items_embedding_3l ON items "
+        "USING ivfflat (embedding_3l vector_cosine_ops) WITH (lists = 10)"
+    )
+    assert VectorIndexSpec.parse("hnsw").create_index_sql("items", "embedding_3l", schema="scratch") == (
+        "CREATE INDEX hnsw_index_for_cosine_items_embedding_3l ON scratch.items "
+        "USING hnsw (embedding_3l vector_cosine_ops)"
+    )
+
+
+@pytest.mark.asyncio
+async def test_configure_vector_indexes(connection):
+    await configure_vector_indexes(connection, VectorIndexSpec.parse("ivfflat:lists=10"))
+    indexes = await embedding_3l_indexes(connection)
+    assert list(indexes) == ["ivfflat_index_for_cosine_items_embedding_3l"]
+    assert "lists='10'" in indexes["ivfflat_index_for_cosine_items_embedding_3l"]
+
+    # Upgrading the tables doesn't add the models' HNSW index back next to the IVFFlat index
+    await connection.run_sync(upgrade_existing_tables)
+    assert list(await embedding_3l_indexes(connection)) == ["ivfflat_index_for_cosine_items_embedding_3l"]
+
+    await configure_vector_indexes(connection, VectorIndexSpec.parse("hnsw:m=8,ef_construction=32"))
+    indexes = await embedding_3l_indexes(connection)
+    assert list(indexes) == ["hnsw_index_for_cosine_items_embedding_3l"]
+    assert "m='8'" in indexes["hnsw_index_for_cosine_items_embedding_3l"]
+
+
+@pytest.mark.asyncio
+async def test_configure_vector_indexes_keeps_matching_index(connection):
+    oid_before = await connection.scalar(text("SELECT 'hnsw_index_for_cosine_items_embedding_3l'::regclass::oid"))
+    await configure_vector_indexes(connection, DEFAULT_VECTOR_INDEX)
+    oid_after = await connection.scalar(text("SELECT 'hnsw_index_for_cosine_items_embedding_3l'::regclass::oid"))
+    assert oid_after == oid_before
@@ -0,0 +1,45 @@
+import json
+import os
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.setup_postgres_seeddata import bulk_insert_seed_data, seed_data_row
+
+
+@pytest_asyncio.fixture
+async def connection(app, mock_azure_credential):
+    """A connection whose changes are rolled back at the end of the test, keeping the seeded rows intact."""
+    engine = await create_postgres_engine_from_env()
+    async with engine.connect() as connection:
+        await connection.begin()
+        yield connection
+        await connection.rollback()
+    await engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def seed_data_rows():
+    with open(os.path.join("src", "backend", "fastapi_app", "seed_data.json")) as f:
+        return [seed_data_row(seed_data_object) for seed_data_object in json.load(f)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("rebuild_indexes", [False, True])
+async def test_bulk_insert_seed_data(connection, seed_data_rows, rebuild_indexes):
+    await connection.execute(text("DELETE FROM items WHERE id <= 3"))
+
+    inserted = await bulk_insert_seed_data(connection, seed_data_rows, rebuild_indexes=rebuild_indexes)
+
+    assert inserted == 3
+    restored = (
+        await connection.execute(text("SELECT id, name, embedding_3l FROM items WHERE id <= 3 ORDER BY id"))
+    ).all()
+    assert [row.name for row in restored] == [row["name"] for row in seed_data_rows[:3]]
+    assert len(restored[0].embedding_3l) == 1024
+    index_names = (
+        await connection.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'items'"))
+    ).scalars()
+    assert "hnsw_index_for_cosine_items_embedding_3l" in set(index_names)
@@ -0,0 +1,128 @@
+import json
+
+import numpy as np
+import openai
+import pytest
+import pytest_asyncio
+from openai.types import CreateEmbeddingResponse, Embedding
+from openai.types.create_embedding_response import Usage
+from sqlalchemy import text
+
+from fastapi_app.dependencies import common_parameters
+from fastapi_app.embeddings import truncate_embedding
+from fastapi_app.openai_clients import create_openai_embed_client
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.update_embeddings import update_embeddings_in_database, update_truncated_embeddings
+from tests.data import test_data
+
+
+@pytest.fixture
+def embedded_inputs(monkeypatch):
+    inputs = []
+
+    async def mock_acreate(*args, **kwargs):
+        inputs.extend(kwargs["input"])
+        return CreateEmbeddingResponse(
+            object="list",
+            data=[
+                Embedding(embedding=test_data.embeddings, index=i, object="embedding")
+                for i in range(len(kwargs["input"]))
+            ],
+            model="text-embedding-3-large",
+            usage=Usage(prompt_tokens=8, total_tokens=8),
+        )
+
+    monkeypatch.setattr(openai.resources.AsyncEmbeddings, "create", mock_acreate)
+    return inputs
+
+
+@pytest_asyncio.fixture
+async def connection(app, mock_azure_credential):
+    """A connection whose changes are rolled back at the end of the test, keeping the seeded embeddings intact."""
+    engine = await create_postgres_engine_from_env()
+    async with engine.connect() as connection:
+        await connection.begin()
+        yield connection
+        await connection.rollback()
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_update_embeddings_skips_unchanged_rows(connection, embedded_inputs, mock_azure_credential, tmp_path):
+    openai_embed_client = await create_openai_embed_client(mock_azure_credential)
+    common_params = await common_parameters()
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+
+    async def update_embeddings(**kwargs):
+        return await update_embeddings_in_database(
+            connection, openai_embed_client, common_params, "embedding_3l", page_size=50, **kwargs
+        )
+
+    await update_embeddings(checkpoint_path=checkpoint_path)
+    assert not (tmp_path / "checkpoint.json").exists()
+
+    embedded_inputs.clear()
+    assert await update_embeddings() == 0
+    assert embedded_inputs == []
+
+    await connection.execute(text("UPDATE items SET description = 'A brand new description' WHERE id = 1"))
+    assert await update_embeddings() == 1
+    assert len(embedded_inputs) == 1
+    assert "A brand new description" in embedded_inputs[0]
+
+
+@pytest.mark.asyncio
+async def test_update_embeddings_resumes_from_checkpoint(connection, embedded_inputs, mock_azure_credential, tmp_path):
+    openai_embed_client = await create_openai_embed_client(mock_azure_credential)
+    common_params = await common_parameters()
+    max_id = (await connection.execute(text("SELECT max(id) FROM items"))).scalar_one()
+    checkpoint_path = tmp_path / "checkpoint.json"
+    checkpoint_path.write_text(json.dumps({"embedding_column": "embedding_3l", "last_id": max_id - 3}))
+
+    embedded = await update_embeddings_in_database(
+        connection,
+        openai_embed_client,
+        common_params,
+        "embedding_3l",
+        page_size=2,
+        checkpoint_path=str(checkpoint_path),
+        force=True,
+    )
+
+    assert embedded == 3
+    assert len(embedded_inputs) == 3
+    assert not checkpoint_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_update_embeddings_writes_truncated_embeddings(
+    connection, embedded_inputs, mock_azure_credential, tmp_path
+):
+    openai_embed_client = await create_openai_embed_client(mock_azure_credential)
+    common_params = await common_parameters()
+    max_id = (await connection.execute(text("SELECT max(id) FROM items"))).scalar_one()
+    checkpoint_path = tmp_path / "checkpoint.json"
+    checkpoint_path.write_text(json.dumps({"embedding_column": "embedding_3l", "last_id": max_id - 1}))
+
+    await update_embeddings_in_database(
+        connection, openai_embed_client, common_params, "embedding_3l", checkpoint_path=str(checkpoint_path), force=True
+    )
+
+    truncated = (
+        await connection.execute(text("SELECT embedding_3l_256 FROM items WHERE id = :id"), {"id": max_id})
+    ).scalar_one()
+    assert np.allclose(truncated, truncate_embedding(test_data.embeddings, 256), atol=1e-6)
+
+
+@pytest.mark.asyncio
+async def test_update_truncated_embeddings_fills_missing(connection):
+    await connection.execute(text("UPDATE items SET embedding_3l_256 = NULL WHERE id <= 3"))
+
+    assert await update_truncated_embeddings(connection, "embedding_3l", page_size=2) == 3
+    full, truncated = (
+        await connection.execute(text("SELECT embedding_3l, embedding_3l_256 FROM items WHERE id = 1"))
+    ).one()
+    assert np.allclose(truncated, truncate_embedding(full, 256), atol=1e-6)
+    # Nothing left to fill, and columns without truncated embeddings have nothing to fill
+    assert await update_truncated_embeddings(connection, "embedding_3l") == 0
+    assert await update_truncated_embeddings(connection, "embedding_nomic") == 0
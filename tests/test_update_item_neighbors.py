@@ -0,0 +1,111 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+
+from fastapi_app.postgres_engine import create_postgres_engine_from_env
+from fastapi_app.update_item_neighbors import update_item_neighbors_in_database
+from tests.data import test_data
+
+
+@pytest_asyncio.fixture
+async def connection(app, mock_azure_credential):
+    """A connection whose changes are rolled back at the end of the test, keeping the item_neighbors table empty."""
+    engine = await create_postgres_engine_from_env()
+    async with engine.connect() as connection:
+        await connection.begin()
+        yield connection
+        await connection.rollback()
+    await engine.dispose()
+
+
+async def get_neighbors(connection, item_id: int) -> list[tuple[int, int, float]]:
+    rows = await connection.execute(
+        text(
+            "SELECT rank, neighbor_id, distance FROM item_neighbors "
+            "WHERE embedding_column = 'embedding_3l' AND item_id = :item_id ORDER BY rank"
+        ),
+        {"item_id": item_id},
+    )
+    return [tuple(row) for row in rows]
+
+
+@pytest.mark.asyncio
+async def test_update_item_neighbors_matches_vector_search(connection):
+    items_with_embeddings = (
+        await connection.execute(text("SELECT count(*) FROM items WHERE embedding_3l IS NOT NULL"))
+    ).scalar()
+
+    computed = await update_item_neighbors_in_database(connection, "embedding_3l", neighbors=5, batch_size=50)
+    assert computed == items_with_embeddings
+
+    neighbors = await get_neighbors(connection, test_data.id)
+    assert [rank for rank, _, _ in neighbors] == [1, 2, 3, 4, 5]
+    nearest = (
+        await connection.execute(
+            text(
+                "SELECT id, embedding_3l <=> (SELECT embedding_3l FROM items WHERE id = :item_id) AS distance "
+                "FROM items WHERE id <> :item_id ORDER BY distance LIMIT 5"
+            ),
+            {"item_id": test_data.id},
+        )
+    ).all()
+    assert [neighbor_id for _, neighbor_id, _ in neighbors] == [row.id for row in nearest]
+    assert [distance for _, _, distance in neighbors] == pytest.approx([row.distance for row in nearest])
+
+
+@pytest.mark.asyncio
+async def test_update_item_neighbors_only_refreshes_changed_items(connection):
+    await update_item_neighbors_in_database(connection, "embedding_3l", neighbors=5)
+    assert await update_item_neighbors_in_database(connection, "embedding_3l", neighbors=5) == 0
+
+    # Give another item the same embedding as the test item, as if its text had changed and been embedded again
+    changed_id = (await get_neighbors(connection, test_data.id))[-1][1]
+    await connection.execute(
+        text(
+            "UPDATE items SET embedding_3l = (SELECT embedding_3l FROM items WHERE id = :item_id), "
+            "embedding_hashes = jsonb_build_object('embedding_3l', 'new-hash') WHERE id = :changed_id"
+        ),
+        {"item_id": test_data.id, "changed_id": changed_id},
+    )
+
+    computed = await update_item_neighbors_in_database(connection, "embedding_3l", neighbors=5)
+    assert 1 < computed < 100
+    # The test item was refreshed because the changed item was one of its neighbors
+    assert (await get_neighbors(connection, test_data.id))[0][1:] == (changed_id, pytest.approx(0))
+    assert (await get_neighbors(connection, changed_id))[0][1:] == (test_data.id, pytest.approx(0))
+
+
+@pytest.mark.asyncio
+async def test_update_item_neighbors_refreshes_items_with_deleted_neighbors(connection):
+    await update_item_neighbors_in_database(connection, "embedding_3l", neighbors=5)
+    # Delete a neighbor that isn't the nearest one, which removes a row from the middle of the test item's neighbors
+    deleted_id = (await get_neighbors(connection, test_data.id))[2][1]
+    await connection.execute(text("DELETE FROM items WHERE id = :id"), {"id": deleted_id})
+    assert len(await get_neighbors(connection, test_data.id)) == 4
+
+    assert await update_item_neighbors_in_database(connection, "embedding_3l", neighbors=5) > 0
+    neighbors = await get_neighbors(connection, test_data.id)
+    assert [rank for rank, _, _ in neighbors] == [1, 2, 3, 4, 5]
+    assert deleted_id not in [neighbor_id for _, neighbor_id, _ in neighbors]
+
+
+@pytest.mark.asyncio
+async def test_update_item_neighbors_full(connection):
+    await update_item_neighbors_in_database(connection, "embedding_3l", neighbors=5)
+    await update_item_neighbors_in_database(connection, "embedding_3l", neighbors=3, full=True)
+    assert len(await get_neighbors(connection, test_data.id)) == 3
+
+
+@pytest.mark.asyncio
+async def test_update_item_neighbors_more_than_default_ef_search(connection):
+    # Rows that other tests rolled back leave dead entries in the HNSW index, which also count toward hnsw.ef_search
+    engine = await create_postgres_engine_from_env()
+    async with engine.connect() as autocommit_connection:
+        autocommit_connection = await autocommit_connection.execution_options(isolation_level="AUTOCOMMIT")
+        await autocommit_connection.execute(text("VACUUM items"))
+    await engine.dispose()
+    # Use the HNSW index even on the small test catalog, where it returns at most hnsw.ef_search rows
+    await connection.execute(text("SET LOCAL enable_seqscan = off"))
+    await update_item_neighbors_in_database(connection, "embedding_3l", neighbors=60)
+    assert len(await get_neighbors(connection, test_data.id)) == 60
+    assert await update_item_neighbors_in_database(connection, "embedding_3l", neighbors=60) == 0